@@ -0,0 +1,87 @@
+"""This python file will catch the alerts of the course page inside the page itself.
+
+The quota and add results come back as alert() calls. Waiting for a native
+alert costs WebDriver round trips, probing for one before every click costs
+one more, and an alert that never comes costs the whole timeout. A script
+injected into every document replaces window.alert and window.confirm with
+functions that only record the message, so the bot reads the messages in the
+same round trip as its next wait. Native alert handling stays the fallback
+for pages loaded before the hook was installed.
+"""
+from selenium.common.exceptions import UnexpectedAlertPresentException, WebDriverException
+
+import page_sync
+import utilities as utils
+
+HOOK_SCRIPT = """
+(function () {
+    if (window.__autoclassAlerts) {
+        return;
+    }
+    window.__autoclassAlerts = [];
+    window.alert = function (message) {
+        window.__autoclassAlerts.push(String(message));
+    };
+    // The native confirm handling accepted every dialog too
+    window.confirm = function (message) {
+        window.__autoclassAlerts.push(String(message));
+        return true;
+    };
+})();
+"""
+
+WAIT_ALERT_SCRIPT = """
+var timeoutMs = arguments[0], done = arguments[arguments.length - 1];
+var started = Date.now();
+(function poll() {
+    var alerts = window.__autoclassAlerts;
+    if (alerts && alerts.length) {
+        done(alerts.splice(0, alerts.length));
+    } else if (!alerts || Date.now() - started >= timeoutMs) {
+        done(alerts ? [] : null);
+    } else {
+        setTimeout(poll, 10);
+    }
+})();
+"""
+
+
+def install(web_driver):
+    """Install the hook in every document the browser loads from now on, and the current one.
+
+    :param web_driver: Chrome driver.
+    :return: True if the hook is installed.
+    """
+    try:
+        web_driver.execute_cdp_cmd('Page.addScriptToEvaluateOnNewDocument', {'source': HOOK_SCRIPT})
+        web_driver.execute_script(HOOK_SCRIPT)
+        return True
+    except WebDriverException as e:
+        utils.log_warning(f"安裝彈窗攔截腳本失敗，改用原生彈窗處理: {e.msg}")
+        return False
+
+
+def wait_for_alert(web_driver, timeout=5):
+    """Wait for the next alert message recorded by the hook, in one round trip.
+
+    :param web_driver: Driver to use.
+    :param timeout: Max seconds to wait.
+    :return: Text of the last message, or None if none came.
+    """
+    try:
+        alerts = web_driver.execute_async_script(WAIT_ALERT_SCRIPT, int(timeout * 1000))
+    except UnexpectedAlertPresentException as e:
+        # The document isn't hooked, the alert went native
+        alert_text = page_sync.alert_text_of(e)
+        utils.log_debug(f"Alert detected: {alert_text}")
+        return alert_text
+    except WebDriverException as e:
+        utils.log_warning(f"讀取攔截的彈窗訊息時發生錯誤: {e.msg}")
+        return None
+    if alerts is None:
+        # The document isn't hooked, fall back to waiting for a native alert
+        return utils.safe_handle_alert(web_driver, timeout=timeout, poll_frequency=0.05)
+    if not alerts:
+        return None
+    utils.log_debug(f"Alert detected: {alerts[-1]}")
+    return alerts[-1]
@@ -4,52 +4,60 @@ import sys
 import time
 import signal
 import atexit
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from os.path import exists
 
-from selenium import webdriver
-from selenium.common import TimeoutException, NoAlertPresentException
+from selenium.common import TimeoutException, NoAlertPresentException, UnexpectedAlertPresentException
 from selenium.webdriver import Keys
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support import expected_conditions as ec
 from selenium.webdriver.support.ui import WebDriverWait
-from webdriver_manager.chrome import ChromeDriverManager
-from selenium.webdriver.chrome.service import Service
 
+import alert_hook
+import browser
+import captcha
+import catalog
+import clock
+import http_engine
+import js_actions
+import metrics
+import outcomes
+import pacing
+import page_sync
+import priority
+import quota_scan
+import session_store
+import supervisor
 import utilities as utils
 
-# Setup logging
-logger = utils.setup_logger()
-
-config = utils.read_config()
-utils.log_info(f"設定檔讀取完成 - 使用者: {config.get('username')}, 課程數量: {len(config.get('class_ids'))}")
-utils.log_info(f"目標課程: {', '.join(config.get('class_ids'))}")
-utils.log_info(f"無頭模式: {'啟用' if config.get('headless') else '停用'}")
-
-options = webdriver.ChromeOptions()
-if config.get("headless"):
-    options.add_argument('--headless')
-# Add options to prevent orphaned processes
-options.add_argument('--no-sandbox')
-options.add_argument('--disable-dev-shm-usage')
-# Use webdriver-manager to automatically manage ChromeDriver
-utils.log_info("正在初始化 Chrome 瀏覽器...")
-service = Service(ChromeDriverManager().install())
-driver = webdriver.Chrome(service=service, options=options)
-driver.maximize_window()
-utils.log_info("瀏覽器初始化完成")
-
-
-def kill_chrome_processes():
-    """Kill any orphaned Chrome processes."""
-    try:
-        if os.name == 'nt':  # Windows
-            os.system('taskkill /f /im chrome.exe 2>nul')
-            os.system('taskkill /f /im chromedriver.exe 2>nul')
-        else:  # Linux/Mac
-            os.system('pkill -f chrome')
-            os.system('pkill -f chromedriver')
-    except:
-        pass
+# Set by setup(), importing this module has no side effects
+config = None
+logger = None
+scheduler = None
+checkpoint = None
+rate_limiter = None
+browser_factory = None
+driver = None
+
+# Latency metrics of the hot phases
+METRICS_SUMMARY_FILE = './logs/metrics.json'
+# Drivers of the extra polling sessions, quit together with the main driver
+session_drivers = []
+# Time from the quota query to the result of each course check, to compare the page_sync modes
+cycle_stats = page_sync.CycleStats()
+# Outcome of every course added or given up, for the report at the end
+settled_classes = {}
+# Runs the captcha OCR while the driver fills in the login form
+ocr_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ocr")
+
+
+def create_driver():
+    """Create a new Chrome browser with the configured options.
+
+    :rtype: webdriver.Chrome
+    """
+    return browser_factory.acquire()
 
 
 def cleanup():
@@ -62,15 +70,26 @@ def cleanup():
             # Set a shorter timeout for cleanup to avoid hanging
             driver.set_page_load_timeout(5)
             driver.implicitly_wait(2)
-            driver.quit()
+            browser_factory.release(driver)
             utils.log_info("瀏覽器清理完成")
     except Exception as e:
         utils.log_warning(f"清理瀏覽器時發生錯誤，跳過: {e}")
         # Don't log this as error since it's expected during forced shutdown
+
+    for session_driver in session_drivers[:]:
+        browser_factory.release(session_driver)
+    session_drivers.clear()
+    browser_factory.shutdown()
+
+    if config.get("metrics_summary_interval"):
+        try:
+            metrics.write_summary(METRICS_SUMMARY_FILE)
+        except OSError as e:
+            utils.log_warning(f"寫入效能指標摘要失敗: {e}")
     
-    # Also kill any orphaned processes
+    # Also kill what is left of this instance's browsers, never the ones of other instances
     utils.log_info("正在清理殘留程序...")
-    kill_chrome_processes()
+    browser_factory.reap()
     utils.log_info("程序清理完成")
 
 
@@ -84,80 +103,100 @@ def signal_handler(signum, frame):
     try:
         if driver:
             # Try a quick cleanup, but don't wait too long
-            driver.quit()
+            browser_factory.release(driver)
     except:
         # Ignore any errors during forced cleanup
         pass
     driver = None
+    for session_driver in session_drivers[:]:
+        browser_factory.release(session_driver)
+    session_drivers.clear()
+    browser_factory.shutdown()
     
-    # Kill processes directly
-    kill_chrome_processes()
+    # Kill what is left of this instance's browsers directly
+    browser_factory.reap()
     utils.log_info("程式因中斷信號結束")
     sys.exit(0)
 
 
-# Register cleanup function to be called on exit
-atexit.register(cleanup)
+def wait_page_ready(web_driver=None):
+    """Wait for the page to settle after an action.
 
-# Register signal handlers for graceful shutdown
-signal.signal(signal.SIGINT, signal_handler)  # Ctrl+C
-if hasattr(signal, 'SIGTERM'):
-    signal.signal(signal.SIGTERM, signal_handler)  # Termination signal
+    :param web_driver: Driver to use, default to the main driver.
+    :return: Text of the alert raised meanwhile, or None.
+    """
+    web_driver = web_driver or driver
+    if config.get("page_sync") == "event":
+        return page_sync.wait_for_ready(web_driver)
+    time.sleep(0.5)
+    return None
 
 
-def driver_send_keys(locator, key):
+def driver_send_keys(locator, key, web_driver=None):
     """Send keys to element.
 
     :param locator: Locator of element.
     :param key: Keys to send.
+    :param web_driver: Driver to use, default to the main driver.
     """
-    # Clear any alerts first
-    utils.dismiss_any_alert(driver)
+    web_driver = web_driver or driver
+    # Clear any alerts first, the alert hook never lets one open
+    if config.get("alert_mode") == "native":
+        utils.dismiss_any_alert(web_driver)
     
     # Use safe element interaction to handle stale elements
-    result = utils.safe_element_interaction(driver, locator, 'send_keys', key)
+    result = utils.safe_element_interaction(web_driver, locator, 'send_keys', key, stale_wait=wait_page_ready)
     if not result:
         raise Exception(f"Failed to send keys to element: {locator}")
 
 
-def driver_click(locator):
+def driver_click(locator, web_driver=None):
     """Click element.
 
     :param locator: Locator of element.
+    :param web_driver: Driver to use, default to the main driver.
     """
-    # Clear any alerts before clicking to avoid interference
-    utils.dismiss_any_alert(driver)
+    web_driver = web_driver or driver
+    # Clear any alerts before clicking to avoid interference, the alert hook never lets one open
+    if config.get("alert_mode") == "native":
+        utils.dismiss_any_alert(web_driver)
     
     # Use safe element interaction to handle stale elements
-    result = utils.safe_element_interaction(driver, locator, 'click')
+    result = utils.safe_element_interaction(web_driver, locator, 'click', stale_wait=wait_page_ready)
     if not result:
         raise Exception(f"Failed to click element: {locator}")
 
 
-def driver_screenshot(locator, path):
+def driver_screenshot(locator, web_driver=None):
     """Take screenshot of element.
 
     :param locator: Locator of element.
-    :param path: Path to save screenshot.
+    :param web_driver: Driver to use, default to the main driver.
+    :return: PNG bytes of the screenshot.
     """
-    WebDriverWait(driver, 10).until(ec.presence_of_element_located(locator)).screenshot(path)
+    return WebDriverWait(web_driver or driver, 10).until(ec.presence_of_element_located(locator)).screenshot_as_png
 
 
-def driver_get_text(locator):
+def driver_get_text(locator, web_driver=None):
     """Get text of element.
 
     :param locator: Locator of element.
+    :param web_driver: Driver to use, default to the main driver.
     :return: Text of element.
     """
     # Use safe element interaction to handle stale elements
-    result = utils.safe_element_interaction(driver, locator, 'get_text')
+    result = utils.safe_element_interaction(web_driver or driver, locator, 'get_text', stale_wait=wait_page_ready)
     if result is None:
         raise Exception(f"Failed to get text from element: {locator}")
     return result
 
 
-def check_and_close_popup():
-    """Check for popup windows and close them."""
+def check_and_close_popup(web_driver=None):
+    """Check for popup windows and close them.
+
+    :param web_driver: Driver to use, default to the main driver.
+    """
+    web_driver = web_driver or driver
     try:
         # 專門處理登入後的調查彈窗
         survey_close_selectors = [
@@ -168,7 +207,7 @@ def check_and_close_popup():
         
         for selector in survey_close_selectors:
             try:
-                close_button = WebDriverWait(driver, 2).until(
+                close_button = WebDriverWait(web_driver, 2).until(
                     ec.element_to_be_clickable((By.XPATH, selector))
                 )
                 close_button.click()
@@ -185,274 +224,1137 @@ def check_and_close_popup():
         return False
 
 
-def login():
-    """Login to FCU course system."""
-    global driver
-    
-    utils.log_info("開始登入 FCU 課程系統...")
-    max_retries = 3
-    retry_count = 0
+CAPTCHA_LOCATOR = (By.ID, "ctl00_Login1_Image1")
+
+
+def refresh_captcha(web_driver=None):
+    """Load a new captcha image in place, without reloading the login page.
+
+    :param web_driver: Driver to use, default to the main driver.
+    """
+    web_driver = web_driver or driver
+    element = WebDriverWait(web_driver, 10).until(ec.presence_of_element_located(CAPTCHA_LOCATOR))
+    web_driver.execute_script("""
+        var image = arguments[0];
+        var src = image.src.replace(/([?&])_r=\\d+&?/, '$1').replace(/[?&]$/, '');
+        image.src = src + (src.indexOf('?') < 0 ? '?' : '&') + '_r=' + Date.now();
+    """, element)
+    try:
+        WebDriverWait(web_driver, 5).until(lambda d: d.execute_script(
+            "return arguments[0].complete && arguments[0].naturalWidth > 0", element))
+    except TimeoutException:
+        utils.log_warning("等待新驗證碼圖片逾時")
+
+
+def ensure_captcha_loaded(web_driver=None):
+    """Make sure the lean profile didn't block the captcha image, loading it unblocked if it did.
+
+    :param web_driver: Driver to use, default to the main driver.
+    """
+    web_driver = web_driver or driver
+    element = WebDriverWait(web_driver, 10).until(ec.presence_of_element_located(CAPTCHA_LOCATOR))
+    if web_driver.execute_script("return arguments[0].complete && arguments[0].naturalWidth > 0", element):
+        return
+    utils.log_warning("驗證碼圖片被資源封鎖擋下，暫時解除封鎖後重新載入")
+    browser.block_resources(web_driver, blocked=False)
+    try:
+        refresh_captcha(web_driver)
+    finally:
+        browser.block_resources(web_driver)
+
+
+def capture_captcha(web_driver=None):
+    """Screenshot the login captcha.
+
+    :param web_driver: Driver to use, default to the main driver.
+    :return: PNG bytes of the captcha.
+    """
+    with metrics.timer('captcha_screenshot'):
+        captcha_png = driver_screenshot(CAPTCHA_LOCATOR, web_driver)
+    utils.log_info("已擷取驗證碼圖片")
+    return captcha_png
+
+
+def recognize_captcha(captcha_png):
+    """Solve a captcha screenshot, safe to run in the OCR worker.
+
+    :param captcha_png: PNG bytes of the captcha.
+    :rtype: captcha.CaptchaSolution
+    """
+    with metrics.timer('ocr'):
+        solution = captcha.solve_captcha(captcha_png, config.get("captcha_length"), config.get("captcha_charset"))
+    candidates = ', '.join(f"{answer}({score:.2f})" for answer, score in solution.candidates)
+    utils.log_info(f"OCR 辨識驗證碼: {solution.answer} (信心 {solution.confidence:.2f}，候選: {candidates})")
+    return solution
+
+
+def solve_login_captcha(max_refreshes=3, web_driver=None, first_solution=None):
+    """Screenshot and solve the login captcha, loading a new one while the confidence is low.
+
+    :param max_refreshes: Max number of new captcha images to try.
+    :param web_driver: Driver to use, default to the main driver.
+    :param first_solution: Solution of the captcha on the page, already recognized.
+    :return: Captcha answer.
+    """
+    for attempt in range(max_refreshes + 1):
+        if attempt == 0 and first_solution is not None:
+            solution = first_solution
+        else:
+            solution = recognize_captcha(capture_captcha(web_driver))
+        if solution.confidence >= config.get("captcha_min_confidence"):
+            return solution.answer
+
+        if attempt < max_refreshes:
+            utils.log_warning("驗證碼辨識信心不足，更換驗證碼後重新辨識...")
+            refresh_captcha(web_driver)
+
+    utils.log_warning("多次更換驗證碼仍信心不足，使用目前最佳答案")
+    return solution.answer
+
+
+LOGOUT_LOCATOR = (By.ID, "ctl00_btnLogout")
+LOGIN_FAILURE_LOCATOR = (By.ID, "ctl00_Login1_FailureText")
+LOGIN_FAILURE_KEYWORDS = {
+    'captcha': ('驗證碼', '檢核碼'),
+    'credentials': ('密碼', '帳號', '學號', '使用者'),
+}
+
+
+class LoginRejected(Exception):
+    """The site rejected the username or password, logging in again won't help."""
+
+
+def classify_login_failure(message):
+    """Tell why the site refused a login from its failure message.
+
+    :param message: Text of the failure label or alert, empty if the page showed none.
+    :return: 'captcha', 'credentials' or 'site' for anything else, like a timeout or server error.
+    """
+    for reason, keywords in LOGIN_FAILURE_KEYWORDS.items():
+        if any(keyword in message for keyword in keywords):
+            return reason
+    return 'site'
+
+
+def restore_login(web_driver=None):
+    """Reuse the saved session of the last login instead of logging in.
+
+    :param web_driver: Driver to use, default to the main driver.
+    :return: True if the saved session is still logged in.
+    """
+    web_driver = web_driver or driver
+    session = session_store.load_session(config.get("username"), config.get("password"))
+    if not session:
+        return False
+
+    start = time.perf_counter()
+    try:
+        session_store.restore_cookies(web_driver, session['cookies'])
+        with metrics.timer('page_load'):
+            web_driver.get(session['url'])
+        # The page only has the logout button while the server session is alive
+        WebDriverWait(web_driver, 3, poll_frequency=0.05).until(ec.presence_of_element_located(LOGOUT_LOCATOR))
+    except TimeoutException:
+        utils.log_info("已儲存的登入狀態已失效，改為完整登入")
+        session_store.clear_session()
+        web_driver.delete_all_cookies()
+        return False
+    except Exception as e:
+        utils.log_warning(f"還原登入狀態失敗，改為完整登入: {e}")
+        return False
+    utils.log_info(f"已還原登入狀態，略過登入，耗時 {time.perf_counter() - start:.2f} 秒")
+    return True
+
+
+def fill_credentials(web_driver):
+    """Choose the student role and type the username and password.
+
+    :param web_driver: Driver to use.
+    """
+    driver_click((By.XPATH, '//*[@id="ctl00_Login1_RadioButtonList1_0"]'), web_driver)
+    utils.log_info("已選擇學生身分")
+
+    driver_send_keys((By.ID, "ctl00_Login1_UserName"), config.get("username"), web_driver)
+    utils.log_info("已輸入使用者名稱")
+
+    driver_send_keys((By.ID, "ctl00_Login1_Password"), config.get("password"), web_driver)
+    utils.log_info("已輸入密碼")
+
+
+def fill_login_form(web_driver=None):
+    """Fill in the whole login form on the loaded login page, up to the login click.
+
+    With login_pipeline the captcha is captured first and recognized in the
+    OCR worker while the credentials are typed, otherwise one step after the
+    other.
+
+    :param web_driver: Driver to use, default to the main driver.
+    """
+    web_driver = web_driver or driver
+    if config.get("login_pipeline"):
+        if config.get("lean_browser"):
+            ensure_captcha_loaded(web_driver)
+        pending_solution = ocr_executor.submit(recognize_captcha, capture_captcha(web_driver))
+        fill_credentials(web_driver)
+        ocr_answer = solve_login_captcha(web_driver=web_driver, first_solution=pending_solution.result())
+    else:
+        fill_credentials(web_driver)
+        if config.get("lean_browser"):
+            ensure_captcha_loaded(web_driver)
+        ocr_answer = solve_login_captcha(web_driver=web_driver)
+
+    driver_send_keys((By.ID, "ctl00_Login1_vcode"), ocr_answer, web_driver)
+    utils.log_info("已輸入驗證碼")
+
+
+def submit_login(web_driver, timeout=10):
+    """Click the login button and wait for the page that answers it.
+
+    :param web_driver: Driver to use.
+    :param timeout: Max seconds to wait for the answer.
+    :return: Tuple of (logged in, failure message), the message is empty if the page showed none.
+    """
+    old_page = web_driver.find_element(By.TAG_NAME, "html")
+    driver_click((By.ID, "ctl00_Login1_LoginButton"), web_driver)
+    utils.log_info("已點擊登入按鈕")
+
+    def answered(d):
+        # The failure label of the last attempt stays until the postback replaces the page
+        if not ec.staleness_of(old_page)(d):
+            return False
+        if d.find_elements(*LOGOUT_LOCATOR):
+            return True, ''
+        labels = d.find_elements(*LOGIN_FAILURE_LOCATOR)
+        message = labels[0].text.strip() if labels else ''
+        if not message and config.get("alert_mode") == 'hook':
+            alerts = d.execute_script("return window.__autoclassAlerts || []")
+            message = alerts[-1] if alerts else ''
+        return (False, message) if message else False
+
+    try:
+        return WebDriverWait(web_driver, timeout, poll_frequency=0.05).until(answered)
+    except UnexpectedAlertPresentException as e:
+        return False, page_sync.alert_text_of(e) or ''
+    except TimeoutException:
+        return False, ''
+
+
+def login_once(web_driver=None, persist_session=True):
+    """Fill in and submit the login form once.
+
+    The saved session is tried first when session_persistence is on. A wrong
+    captcha is retried on the same page with a new captcha, up to
+    captcha_retry_budget times, instead of failing the whole login.
+
+    :param web_driver: Driver to use, default to the main driver.
+    :param persist_session: Restore and save the session of session_persistence, False for the extra
+        polling sessions, each must keep an ASP.NET session of its own.
+    :return: True if login succeeded.
+    :raises LoginRejected: When the username or password is wrong.
+    """
+    web_driver = web_driver or driver
+    persist_session = persist_session and config.get("session_persistence")
+    if persist_session and restore_login(web_driver):
+        return True
+
+    start = time.perf_counter()
+    with metrics.timer('page_load'):
+        web_driver.get(config.get("course_url"))
+    utils.log_info("已開啟課程系統網頁")
+
+    fill_start = time.perf_counter()
+    fill_login_form(web_driver)
+    fill_time = time.perf_counter() - fill_start
+    metrics.observe('login_fill', fill_time)
+    utils.log_info(f"登入表單填寫完成，耗時 {fill_time:.2f} 秒 ({'並行' if config.get('login_pipeline') else '依序'})")
     
-    while retry_count < max_retries:
+    captcha_retries = 0
+    while True:
+        submit_start = time.perf_counter()
+        logged_in, failure = submit_login(web_driver)
+        metrics.observe('login_submit', time.perf_counter() - submit_start)
+        if logged_in:
+            break
+
+        reason = classify_login_failure(failure)
+        if reason == 'credentials':
+            utils.log_error(f"帳號或密碼錯誤，停止登入: {failure}")
+            raise LoginRejected(failure)
+        if reason == 'site' or captcha_retries >= config.get("captcha_retry_budget"):
+            utils.log_warning(f"登入失敗: {failure or '網站沒有回應或沒有錯誤訊息'}")
+            return False
+
+        # Only the captcha was wrong: the page and its session are still good
+        captcha_retries += 1
+        utils.log_warning(f"驗證碼錯誤，更換驗證碼後重新送出 ({captcha_retries}/{config.get('captcha_retry_budget')})")
+        metrics.observe('login_captcha_retry', time.perf_counter() - submit_start)
+        retry_start = time.perf_counter()
+        refresh_captcha(web_driver)
+        # The postback cleared the password field, type the whole form again
+        fill_login_form(web_driver)
+        metrics.observe('login_fill', time.perf_counter() - retry_start)
+
+    utils.log_info(f"登入成功！耗時 {time.perf_counter() - start:.2f} 秒，檢查是否有調查彈窗...")
+    # Check for survey popup after successful login
+    time.sleep(2)  # Wait for any popup to appear
+    if check_and_close_popup(web_driver):
+        utils.log_info("登入後發現並關閉調查彈窗")
+    else:
+        utils.log_info("未發現調查彈窗，繼續執行...")
+    if persist_session:
+        session_store.save_session(web_driver.get_cookies(), web_driver.current_url,
+                                   config.get("username"), config.get("password"))
+    return True
+
+
+TAB_LOCATOR = (By.ID, "ctl00_MainContent_TabContainer1_tabSelected_Label3")
+SUB_ID_LOCATOR = (By.ID, "ctl00_MainContent_TabContainer1_tabSelected_tbSubID")
+QUERY_BUTTON_LOCATOR = (By.XPATH,
+                        "//*[@id='ctl00_MainContent_TabContainer1_tabSelected_gvToAdd']/tbody/tr[2]/td[8]/input")
+ADD_BUTTON_LOCATOR = (By.XPATH,
+                      "//*[@id='ctl00_MainContent_TabContainer1_tabSelected_gvToAdd']/tbody/tr[2]/td[1]/input")
+MSG_BLOCK_LOCATOR = (By.XPATH, "//*[@id='ctl00_MainContent_TabContainer1_tabSelected_lblMsgBlock']/span")
+
+
+class BrowserEngine:
+    """Enrollment engine that clicks through the course page in Chrome."""
+
+    def __init__(self, web_driver=None):
+        """Create the engine.
+
+        :param web_driver: Driver to use, default to the main driver.
+        """
+        self.web_driver = web_driver
+        self.event_sync = config.get("page_sync") == "event"
+        self.hook_alerts = config.get("alert_mode") == "hook"
+        self.batch_actions = config.get("batch_actions")
+
+    @property
+    def driver(self):
+        return self.web_driver or driver
+
+    def _batch(self, steps, after=()):
+        """Run steps in one round trip, waiting for their postback with page_sync event.
+
+        :rtype: js_actions.BatchResult
+        """
+        return js_actions.BatchExecutor(self.driver).run(steps, after, wait=self.event_sync)
+
+    def open(self):
+        """Open the enrollment tab."""
+        utils.log_info("點擊加退選頁面...")
+        if self.batch_actions:
+            self._batch([js_actions.click(TAB_LOCATOR)])
+            return
+        driver_click(TAB_LOCATOR, self.driver)
+        if self.event_sync:
+            wait_page_ready(self.driver)
+
+    def recover(self):
+        """Clean up alerts and refresh the page elements after an error."""
+        utils.dismiss_any_alert(self.driver)
         try:
-            utils.log_info(f"登入嘗試 {retry_count + 1}/{max_retries}")
-            driver.get('https://course.fcu.edu.tw/')
-            utils.log_info("已開啟課程系統網頁")
-            
-            driver_click((By.XPATH, '//*[@id="ctl00_Login1_RadioButtonList1_0"]'))
-            utils.log_info("已選擇學生身分")
-            
-            driver_send_keys((By.ID, "ctl00_Login1_UserName"), config.get("username"))
-            utils.log_info("已輸入使用者名稱")
-            
-            driver_send_keys((By.ID, "ctl00_Login1_Password"), config.get("password"))
-            utils.log_info("已輸入密碼")
-            
-            driver_screenshot((By.ID, "ctl00_Login1_Image1"), "captcha.png")
-            utils.log_info("已擷取驗證碼圖片")
-            
-            ocr_answer = utils.get_ocr_answer("captcha.png")
-            utils.log_info(f"OCR 辨識驗證碼: {ocr_answer}")
-            
-            driver_send_keys((By.ID, "ctl00_Login1_vcode"), ocr_answer)
-            utils.log_info("已輸入驗證碼")
-            
-            driver_click((By.ID, "ctl00_Login1_LoginButton"))
-            utils.log_info("已點擊登入按鈕")
-            
-            # Check if login was successful
+            driver_click(TAB_LOCATOR, self.driver)
+            wait_page_ready(self.driver)
+        except:
+            pass
+
+    def keep_alive(self):
+        """Reload the page to keep the login session alive."""
+        with metrics.timer('page_load'):
+            self.driver.get(self.driver.current_url)
+        self.open()
+
+    def close(self):
+        """Nothing to close, the browser belongs to the browser factory."""
+
+    def query_quota(self, class_id):
+        """Query remaining positions of class.
+
+        :param class_id: Class id to query.
+        :return: Quota alert text, or None if no alert came back.
+        """
+        # Clear any existing alerts before proceeding
+        if not self.hook_alerts:
+            utils.dismiss_any_alert(self.driver)
+
+        if self.batch_actions:
+            return self._batch_query_quota(class_id)
+
+        # Re-locate and clear the input field, then send new course ID
+        try:
+            driver_send_keys(SUB_ID_LOCATOR, class_id, self.driver)
+        except Exception as input_error:
+            utils.log_warning(f"輸入課程ID失敗，重試中: {input_error}")
+            # Try to click the tab again to refresh elements
+            driver_click(TAB_LOCATOR, self.driver)
+            wait_page_ready(self.driver)
+            driver_send_keys(SUB_ID_LOCATOR, class_id, self.driver)
+
+        driver_click(QUERY_BUTTON_LOCATOR, self.driver)
+        with metrics.timer('alert_wait', class_id):
+            if self.event_sync:
+                # The quota alert comes with the end of the postback
+                alert_text = wait_page_ready(self.driver)
+                if alert_text is not None:
+                    return alert_text
+            return self._wait_quota_alert()
+
+    def _batch_query_quota(self, class_id):
+        """Fill in the class id, query and wait for the quota alert in one round trip."""
+        steps = [js_actions.set_value(SUB_ID_LOCATOR, class_id), js_actions.click(QUERY_BUTTON_LOCATOR)]
+        with metrics.timer('alert_wait', class_id):
             try:
-                WebDriverWait(driver, 3).until(ec.presence_of_element_located((By.ID, "ctl00_btnLogout")))
-                utils.log_info("登入成功！檢查是否有調查彈窗...")
-                
-                # Check for survey popup after successful login
-                time.sleep(2)  # Wait for any popup to appear
-                if check_and_close_popup():
-                    utils.log_info("登入後發現並關閉調查彈窗")
-                else:
-                    utils.log_info("未發現調查彈窗，繼續執行...")
-                
-                utils.log_info("開始自動加課...")
-                print('-------------------------------------')
-                print("Login Success. Start auto classing...")
-                auto_class(config.get("class_ids"))
-                return  # Successfully logged in, exit the function
-            except TimeoutException:
-                retry_count += 1
-                utils.log_warning(f"登入失敗 (第 {retry_count}/{max_retries} 次嘗試)")
-                print(f"Login Failed (attempt {retry_count}/{max_retries}), retrying...")
-                
-                if retry_count < max_retries:
-                    # Close current browser and create a new one
-                    utils.log_info("關閉當前瀏覽器並建立新實例...")
-                    print("Closing current browser and creating new instance...")
-                    driver.quit()
-                    time.sleep(2)  # Wait a bit before creating new browser
-                    
-                    # Create new browser instance
-                    utils.log_info("建立新的瀏覽器實例...")
-                    options = webdriver.ChromeOptions()
-                    if config.get("headless"):
-                        options.add_argument('--headless')
-                    options.add_argument('--no-sandbox')
-                    options.add_argument('--disable-dev-shm-usage')
-                    service = Service(ChromeDriverManager().install())
-                    driver = webdriver.Chrome(service=service, options=options)
-                    driver.maximize_window()
-                    utils.log_info("新瀏覽器實例建立完成")
-                else:
-                    utils.log_error("達到最大登入嘗試次數，程式結束...")
-                    print("Max login attempts reached. Exiting...")
-                    driver.quit()
-                    sys.exit("Login failed after maximum attempts.")
-                    
+                result = self._batch(steps)
+            except js_actions.BatchActionError as e:
+                utils.log_warning(f"輸入課程ID失敗，重試中: {e}")
+                # Click the tab again to refresh elements
+                self._batch([js_actions.click(TAB_LOCATOR)])
+                result = self._batch(steps)
+            if result.alert is not None:
+                return result.alert
+            return self._wait_quota_alert()
+
+    def _wait_quota_alert(self):
+        """Wait for the quota alert the page wait didn't bring back.
+
+        :return: Quota alert text, or None.
+        """
+        timeout = 1 if self.event_sync else 5
+        if self.hook_alerts:
+            # Returns as soon as the alert is caught, in one round trip
+            return alert_hook.wait_for_alert(self.driver, timeout=timeout)
+        # Use safer alert handling
+        return utils.safe_handle_alert(self.driver, timeout=timeout, poll_frequency=0.05 if self.event_sync else 0.5)
+
+    def add_class(self, class_id):
+        """Add class and read the result message.
+
+        :param class_id: Class id to add, already filled in by query_quota.
+        :return: Result text of lblMsgBlock, or None if no new message came back.
+        """
+        if self.batch_actions and self.event_sync:
+            # Click, wait for the postback and read its message in one round trip
+            result = self._batch([js_actions.click(ADD_BUTTON_LOCATOR)], [js_actions.get_text(MSG_BLOCK_LOCATOR)])
+            if result.alert is not None:
+                return result.alert
+            if len(result.values) == 2:
+                return result.values[-1]
+            return driver_get_text(MSG_BLOCK_LOCATOR, self.driver)
+        if self.event_sync:
+            driver_click(ADD_BUTTON_LOCATOR, self.driver)
+            # Read the message of this postback, not the one left by the last add
+            alert_text = wait_page_ready(self.driver)
+            if alert_text is not None:
+                return alert_text
+            return driver_get_text(MSG_BLOCK_LOCATOR, self.driver)
+
+        # Without a postback to wait for, only a message other than the last one is this add's result
+        if self.batch_actions:
+            result = self._batch([js_actions.get_text(MSG_BLOCK_LOCATOR), js_actions.click(ADD_BUTTON_LOCATOR)])
+            if result.alert is not None:
+                return result.alert
+            previous = result.values[0]
+        else:
+            previous = driver_get_text(MSG_BLOCK_LOCATOR, self.driver)
+            driver_click(ADD_BUTTON_LOCATOR, self.driver)
+        return self._wait_new_message(previous)
+
+    def _wait_new_message(self, previous, timeout=5):
+        """Wait for lblMsgBlock to show a message other than previous.
+
+        :param previous: Message shown before the add click.
+        :param timeout: Max seconds to wait.
+        :return: New message text, or None if it didn't change in time.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            message = driver_get_text(MSG_BLOCK_LOCATOR, self.driver)
+            if message != previous:
+                return message
+            if time.monotonic() >= deadline:
+                utils.log_warning(f"加選結果訊息未更新，無法確認此次加選結果 (畫面上仍是: {previous})")
+                return None
+            time.sleep(0.1)
+
+
+def create_enrollment_engine(web_driver=None):
+    """Create the enrollment engine chosen by the engine setting.
+
+    :param web_driver: Logged in driver to use, default to the main driver.
+    :return: BrowserEngine or http_engine.HttpEnrollmentEngine.
+    """
+    if config.get("engine") == "http":
+        utils.log_info("使用 HTTP 加選引擎，瀏覽器僅用於登入")
+        return http_engine.HttpEnrollmentEngine.from_driver(web_driver or driver)
+    return BrowserEngine(web_driver)
+
+
+def close_clients(*clients):
+    """Close the connection pools of the engines and scanners no longer used.
+
+    :param clients: Enrollment engines or quota scanners, None is skipped.
+    """
+    for client in clients:
+        if client is None:
+            continue
+        try:
+            client.close()
         except Exception as e:
-            retry_count += 1
-            utils.log_error(f"登入過程中發生未預期錯誤 (第 {retry_count}/{max_retries} 次嘗試): {e}")
-            print(f"Unexpected error during login (attempt {retry_count}/{max_retries}): {e}")
-            
-            if retry_count < max_retries:
-                # Close current browser and create a new one
-                utils.log_info("因錯誤關閉當前瀏覽器並建立新實例...")
-                print("Closing current browser due to error and creating new instance...")
-                try:
-                    driver.quit()
-                except Exception as quit_error:
-                    utils.log_warning(f"關閉瀏覽器時發生錯誤: {quit_error}")
-                time.sleep(2)
-                
-                # Create new browser instance
-                utils.log_info("建立新的瀏覽器實例...")
-                options = webdriver.ChromeOptions()
-                if config.get("headless"):
-                    options.add_argument('--headless')
-                options.add_argument('--no-sandbox')
-                options.add_argument('--disable-dev-shm-usage')
-                service = Service(ChromeDriverManager().install())
-                driver = webdriver.Chrome(service=service, options=options)
-                driver.maximize_window()
-                utils.log_info("新瀏覽器實例建立完成")
+            utils.log_warning(f"關閉連線失敗: {e}")
+
+
+def create_quota_scanner(web_driver=None):
+    """Create the bulk quota scanner of the quota_scan_url setting.
+
+    :param web_driver: Logged in driver to take the cookies from, default to the main driver.
+    :return: quota_scan.QuotaScanner, or None if quota_scan_url isn't set.
+    """
+    if not config.get("quota_scan_url"):
+        return None
+    utils.log_info(f"使用課程清單頁一次取得所有課程名額: {config.get('quota_scan_url')}")
+    return quota_scan.QuotaScanner.from_driver(config.get("quota_scan_url"), config.get("quota_scan_body"),
+                                               web_driver or driver)
+
+
+def classes_to_check(scanner, class_ids, pacer=None):
+    """Get the class ids worth a query this round.
+
+    With a scanner, one fetch of the course listing tells which courses show
+    free seats, only those and the ones missing from the listing are queried.
+
+    :param scanner: quota_scan.QuotaScanner, or None to check every class.
+    :param class_ids: Class ids to join.
+    :param pacer: pacing.AimdPacer to wait on before the scan and feed with its latency.
+    :rtype: list
+    """
+    if scanner is None or not class_ids:
+        return class_ids[:]
+    if pacer:
+        pacer.wait()
+    start = time.perf_counter()
+    try:
+        with metrics.timer('bulk_scan'):
+            quotas = scanner.scan(class_ids)
+    except Exception as e:
+        if pacer:
+            pacer.record(time.perf_counter() - start, ok=False)
+        utils.log_warning(f"讀取課程清單頁失敗，本輪改為逐一查詢: {e}")
+        return class_ids[:]
+    if pacer:
+        pacer.record(time.perf_counter() - start)
+
+    free = [class_id for class_id, remaining in quotas.items() if remaining is None or remaining > 0]
+    utils.log_repeated(('bulk_scan', tuple(free)),
+                       f"課程清單頁掃描 {len(class_ids)} 門課程，有名額或需逐一查詢: {', '.join(free) or '無'}",
+                       config.get("log_repeat_interval"))
+    return free
+
+
+def create_start_schedule():
+    """Estimate the server clock offset for the start_at setting.
+
+    :return: clock.StartSchedule, or None if start_at isn't set or has passed.
+    """
+    start_at = config.get("start_at")
+    if start_at is None:
+        return None
+    if start_at <= time.time():
+        utils.log_info("已超過 start_at 設定的開始時間，直接開始輪詢")
+        return None
+
+    try:
+        offset, uncertainty = clock.estimate_clock_offset(config.get("course_url"))
+        utils.log_info(f"伺服器時間差 {offset * 1000:+.0f} 毫秒 (誤差 ±{uncertainty * 1000:.0f} 毫秒)")
+    except Exception as e:
+        utils.log_warning(f"無法估計伺服器時間差，使用本機時間: {e}")
+        offset = 0.0
+    schedule = clock.StartSchedule(start_at, offset, config.get("start_burst_seconds"))
+    utils.log_info(f"將於 {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(start_at))} (伺服器時間) 開始搶課，"
+                   f"還有 {schedule.fire_at - time.time():.0f} 秒")
+    return schedule
+
+
+def create_burst_pacer():
+    """Create the pacer of the burst right after start_at, only limited by max_rate.
+
+    :rtype: pacing.AimdPacer
+    """
+    return pacing.AimdPacer(min_interval=0, initial_interval=0, step=0, limiter=rate_limiter)
+
+
+def check_class(engine, class_id, pacer=None):
+    """Query remaining positions of class and add it if there is any.
+
+    :param engine: Enrollment engine.
+    :param class_id: Class id to check.
+    :param pacer: pacing.AimdPacer to wait on before the query and feed with its latency.
+    :return: outcomes.Outcome of the query, or of the add if there was a seat.
+    """
+    utils.log_debug(f"正在處理課程: {class_id}")
+    if pacer:
+        pacer.wait()
+
+    # query remain position
+    utils.log_debug(f"查詢課程 {class_id} 剩餘名額...")
+    start = time.perf_counter()
+    try:
+        with metrics.timer('seat_query', class_id):
+            alert_text = engine.query_quota(class_id)
+    except Exception:
+        if pacer:
+            pacer.record(time.perf_counter() - start, ok=False)
+        raise
+    if pacer:
+        pacer.record(time.perf_counter() - start, ok=bool(alert_text))
+    try:
+        return _handle_quota(engine, class_id, alert_text)
+    finally:
+        cycle_stats.record(time.perf_counter() - start)
+
+
+def _handle_quota(engine, class_id, alert_text):
+    """Add class if the quota alert shows remaining positions.
+
+    :rtype: outcomes.Outcome
+    """
+    if not alert_text:
+        utils.log_warning(f"課程 {class_id} 未收到名額資訊，跳過此次檢查...")
+        return outcomes.classify(alert_text)
+
+    try:
+        # Parse the alert text to get remaining positions
+        remain_pos = utils.parse_remain_position(alert_text)
+    except (ValueError, IndexError) as parse_error:
+        outcome = outcomes.classify(alert_text)
+        if outcome.kind == outcomes.PERMANENT:
+            # Not a quota alert but a refusal, like an unknown course
+            return outcome
+        utils.log_error(f"解析課程 {class_id} 名額資訊失敗: {parse_error}, Alert text: {alert_text}")
+        utils.log_info(f"課程 {class_id} 跳過此次檢查...")
+        return outcome
+    if remain_pos == 0:
+        # Logged every round for every full class, collapse the repeats
+        utils.log_repeated(('no_seats', class_id), f"課程 {class_id}: {alert_text}，無剩餘名額，跳過...",
+                           config.get("log_repeat_interval"), class_id=class_id, remain=0)
+        return outcomes.Outcome(outcomes.TRANSIENT, 'no_seats', alert_text)
+
+    utils.log_info(f"課程 {class_id}: {alert_text}", class_id=class_id, remain=remain_pos)
+    print("課程" + class_id + ": " + alert_text)
+
+    utils.log_info(f"課程 {class_id} 有名額，嘗試加選...")
+    with metrics.timer('add_click', class_id):
+        result_text = engine.add_class(class_id)
+    outcome = outcomes.classify(result_text)
+    if outcome.kind == outcomes.SUCCESS:
+        utils.log_info(f"✅ 成功加選課程: {class_id}", class_id=class_id, result=result_text)
+        print("成功加選課程：" + class_id)
+        return outcome
+
+    utils.log_warning(f"❌ 課程 {class_id} 加選失敗: {result_text}", class_id=class_id, result=result_text,
+                      kind=outcome.kind, reason=outcome.reason)
+    if outcome.kind == outcomes.TRANSIENT:
+        print("課程" + class_id + ": 加選失敗, 名額可能被其他機器人搶走了, 繼續輪詢..")
+    return outcome
+
+
+def settle_class(class_ids, class_id, outcome):
+    """Stop polling a course that was added or can't be added, and checkpoint it.
+
+    :param class_ids: List of class ids still to join, updated in place.
+    :param class_id: Class id checked.
+    :param outcome: outcomes.Outcome of check_class.
+    :return: True if the course is settled, False if it is still worth polling.
+    """
+    if outcome.kind == outcomes.TRANSIENT:
+        return False
+    if class_id in class_ids:
+        class_ids.remove(class_id)
+    settled_classes[class_id] = outcome
+    if outcome.kind == outcomes.SUCCESS:
+        for other in scheduler.drop_alternatives(class_ids, class_id):
+            settled_classes[other] = outcomes.Outcome(outcomes.PERMANENT, 'alternative', class_id)
+    else:
+        reason = outcomes.describe(outcome)
+        utils.log_warning(f"課程 {class_id} 無法加選 ({reason})，停止輪詢: {outcome.message}",
+                          class_id=class_id, reason=outcome.reason)
+        print(f"課程{class_id}: {outcome.message} ({reason})，停止輪詢")
+    if checkpoint:
+        checkpoint.record(class_id, outcome)
+    return True
+
+
+class ShardedPoller:
+    """Poll class ids across several logged in sessions of the same account.
+
+    Each session owns a browser (and HTTP client with the http engine) and
+    checks its shard of the remaining class ids. Shards are recomputed every
+    round from the remaining classes and the healthy sessions, so added
+    classes and dead sessions are rebalanced onto the others.
+    """
+
+    def __init__(self, class_ids, session_count, first_driver=None, health_timeout=60, schedule=None,
+                 on_progress=None):
+        """Create the poller.
+
+        :param class_ids: List of class ids to join, updated in place.
+        :param session_count: Number of sessions.
+        :param first_driver: Already logged in driver for session 0.
+        :param health_timeout: Seconds without progress before a session is restarted.
+        :param schedule: clock.StartSchedule the sessions wait for after logging in.
+        :param on_progress: Called after every shard round that went through.
+        """
+        self.class_ids = class_ids
+        self.session_count = session_count
+        self.first_driver = first_driver
+        self.health_timeout = health_timeout
+        self.schedule = schedule
+        self.on_progress = on_progress
+        self.lock = threading.Lock()
+        self.healthy = set()
+        self.heartbeats = {}
+        self.generations = {}
+        self.threads = {}
+        self.fatal_error = None
+
+    def run(self):
+        """Poll until every class is added.
+
+        :raises LoginRejected: When a session is refused for a wrong username or password.
+        """
+        utils.log_info(f"啟動 {self.session_count} 個輪詢工作階段")
+        for index in range(self.session_count):
+            self._start_session(index)
+
+        while self.remaining():
+            time.sleep(1)
+            if self.fatal_error is not None or not self.remaining():
+                break
+            now = time.monotonic()
+            waiting = self.schedule is not None and time.time() < self.schedule.fire_at
+            for index in range(self.session_count):
+                stalled = now - self.heartbeats[index] > self.health_timeout and not waiting
+                if not self.threads[index].is_alive() or stalled:
+                    utils.log_warning(f"工作階段 {index} 無回應，重新啟動並將其課程分配給其他工作階段")
+                    self._start_session(index)
+
+        with self.lock:
+            self.generations = {index: None for index in self.generations}
+        if self.fatal_error is not None:
+            raise self.fatal_error
+        utils.log_info(f"平均每門課程檢查耗時 {cycle_stats.average * 1000:.0f} 毫秒 ({config.get('page_sync')})")
+
+    def remaining(self):
+        """Get class ids still to join.
+
+        :rtype: list
+        """
+        with self.lock:
+            return self.class_ids[:]
+
+    def shard(self, index):
+        """Get the class ids session index should check this round.
+
+        :rtype: list
+        """
+        with self.lock:
+            sessions = sorted(self.healthy)
+            if index not in sessions:
+                return []
+            position = sessions.index(index)
+            return self.class_ids[position::len(sessions)]
+
+    def _start_session(self, index):
+        with self.lock:
+            generation = self.generations.get(index, 0) + 1
+            self.generations[index] = generation
+            self.healthy.discard(index)
+            self.heartbeats[index] = time.monotonic()
+        first_driver = None
+        if index == 0:
+            first_driver, self.first_driver = self.first_driver, None
+        thread = threading.Thread(target=self._run_session, args=(index, generation, first_driver),
+                                  name=f"session-{index}", daemon=True)
+        self.threads[index] = thread
+        thread.start()
+
+    def _is_current(self, index, generation):
+        with self.lock:
+            return self.generations.get(index) == generation
+
+    def _beat(self, index):
+        with self.lock:
+            self.heartbeats[index] = time.monotonic()
+
+    def _set_healthy(self, index, healthy):
+        with self.lock:
+            if healthy:
+                self.healthy.add(index)
             else:
-                utils.log_error("因錯誤達到最大登入嘗試次數，程式結束...")
-                print("Max login attempts reached due to errors. Exiting...")
-                try:
-                    driver.quit()
-                except:
-                    pass
-                sys.exit("Login failed after maximum attempts due to errors.")
+                self.healthy.discard(index)
+
+    def _login_session(self, index):
+        """Create a browser for session index and log in.
+
+        :rtype: webdriver.Chrome
+        """
+        for attempt in range(3):
+            self._beat(index)
+            web_driver = create_driver()
+            session_drivers.append(web_driver)
+            try:
+                # A restored session would be shared with the main browser and break its ViewState
+                if login_once(web_driver, persist_session=False):
+                    return web_driver
+                utils.log_warning(f"工作階段 {index} 登入失敗 (第 {attempt + 1}/3 次嘗試)")
+            except LoginRejected:
+                self._quit(web_driver)
+                raise
+            except Exception as e:
+                utils.log_error(f"工作階段 {index} 登入時發生錯誤: {e}")
+            self._quit(web_driver)
+        raise Exception(f"工作階段 {index} 無法登入")
+
+    @staticmethod
+    def _quit(web_driver):
+        browser_factory.release(web_driver)
+        if web_driver in session_drivers:
+            session_drivers.remove(web_driver)
+
+    def _run_session(self, index, generation, web_driver=None):
+        """Login and poll the shard of session index until replaced or done."""
+        while self.remaining() and self._is_current(index, generation):
+            engine = scanner = None
+            try:
+                if web_driver is None:
+                    web_driver = self._login_session(index)
+                self._beat(index)
+                pacer = pacing.AimdPacer(limiter=rate_limiter, **config.get("pacing"))
+                burst_pacer = create_burst_pacer()
+                engine = create_enrollment_engine(web_driver)
+                scanner = create_quota_scanner(web_driver)
+                engine.open()
+                self._set_healthy(index, True)
+                utils.log_info(f"工作階段 {index} 已就緒")
+                if self.schedule and time.time() < self.schedule.fire_at:
+                    self.schedule.wait(keep_alive=engine.keep_alive)
+                    self._beat(index)
+
+                while self.remaining() and self._is_current(index, generation):
+                    shard = self.shard(index)
+                    round_start = time.perf_counter()
+                    active_pacer = burst_pacer if self.schedule and self.schedule.in_burst() else pacer
+                    for class_id in classes_to_check(scanner, scheduler.due(shard, self.remaining()), active_pacer):
+                        if class_id not in self.remaining() or not self._is_current(index, generation):
+                            continue
+                        try:
+                            outcome = check_class(engine, class_id, active_pacer)
+                            with self.lock:
+                                settle_class(self.class_ids, class_id, outcome)
+                        except http_engine.SessionExpiredError:
+                            raise
+                        except Exception as e:
+                            utils.log_error(f"工作階段 {index} 處理課程 {class_id} 時發生錯誤: {e}")
+                            engine.recover()
+                        self._beat(index)
+                    self._beat(index)
+                    if shard:
+                        metrics.observe('round', time.perf_counter() - round_start)
+                        if self.on_progress:
+                            self.on_progress()
+                    if not shard:
+                        # Not healthy yet or more sessions than classes, the pacer isn't waiting for us
+                        time.sleep(0.5)
+            except LoginRejected as e:
+                # Every session uses the same account, stop them all
+                with self.lock:
+                    self.fatal_error = e
+                break
+            except Exception as e:
+                utils.log_error(f"工作階段 {index} 發生嚴重錯誤，重新登入: {e}")
+                self._set_healthy(index, False)
+                if web_driver is not None and web_driver is not driver:
+                    self._quit(web_driver)
+                web_driver = None
+                time.sleep(3)
+            finally:
+                # A new login gets new clients, the old connection pools would leak
+                close_clients(engine, scanner)
+
+        self._set_healthy(index, False)
+        if web_driver is not None and web_driver is not driver:
+            self._quit(web_driver)
 
 
-def auto_class(class_ids):
+def auto_class(class_ids, schedule=None, on_progress=None):
     """Auto join class script.
 
+    Returns when every class is added, a critical error is raised to the supervisor.
+
     :param class_ids: List of class ids to join.
+    :param schedule: clock.StartSchedule to wait for before polling.
+    :param on_progress: Called after every round that went through.
     """
-    global driver
-    
     utils.log_info(f"開始自動加課程序，待加課程: {', '.join(class_ids)}")
+    if config.get("sessions") > 1:
+        ShardedPoller(class_ids, config.get("sessions"), first_driver=driver, schedule=schedule,
+                      on_progress=on_progress).run()
+        return
+
+    engine = create_enrollment_engine()
+    scanner = create_quota_scanner()
+    try:
+        pacer = pacing.AimdPacer(limiter=rate_limiter, **config.get("pacing"))
+        burst_pacer = create_burst_pacer()
+        if schedule and time.time() < schedule.fire_at:
+            engine.open()
+            schedule.wait(keep_alive=engine.keep_alive)
     
-    while class_ids:
-        try:
-            utils.log_info("點擊加退選頁面...")
-            driver_click((By.ID, "ctl00_MainContent_TabContainer1_tabSelected_Label3"))
+        while class_ids:
+            round_start = time.perf_counter()
+            try:
+                engine.open()
             
-            for class_id in class_ids[:]:  # create a copy of class_ids for iteration
-                try:
-                    utils.log_info(f"正在處理課程: {class_id}")
-                    
-                    # Clear any existing alerts before proceeding
-                    utils.dismiss_any_alert(driver)
-                    
-                    # Refresh the page elements by clicking the tab again
-                    time.sleep(0.3)  # Small delay to ensure page stability
-                    
-                    # Re-locate and clear the input field, then send new course ID
+                active_pacer = burst_pacer if schedule and schedule.in_burst() else pacer
+                # The courses due this round by weight, a new list so class_ids can change
+                for class_id in classes_to_check(scanner, scheduler.due(class_ids), active_pacer):
+                    if class_id not in class_ids:
+                        continue  # Dropped as the alternative of an added course
                     try:
-                        driver_send_keys((By.ID, "ctl00_MainContent_TabContainer1_tabSelected_tbSubID"),
-                                         class_id)
-                    except Exception as input_error:
-                        utils.log_warning(f"輸入課程ID失敗，重試中: {input_error}")
-                        # Try to click the tab again to refresh elements
-                        driver_click((By.ID, "ctl00_MainContent_TabContainer1_tabSelected_Label3"))
-                        time.sleep(0.5)
-                        driver_send_keys((By.ID, "ctl00_MainContent_TabContainer1_tabSelected_tbSubID"),
-                                         class_id)
-
-                    # query remain position
-                    utils.log_info(f"查詢課程 {class_id} 剩餘名額...")
-                    driver_click((By.XPATH,
-                                  "//*[@id='ctl00_MainContent_TabContainer1_tabSelected_gvToAdd']/tbody/tr[2]/td[8]/input"))
-                    
-                    # Use safer alert handling
-                    alert_text = utils.safe_handle_alert(driver, timeout=5)
-                    
-                    if alert_text:
+                        settle_class(class_ids, class_id, check_class(engine, class_id, active_pacer))
+                    except http_engine.SessionExpiredError:
+                        # The session is gone, let the critical error handler re-login
+                        raise
+                    except Exception as e:
+                        utils.log_error(f"處理課程 {class_id} 時發生錯誤: {e}")
+                        print(f"Error processing class {class_id}: {e}")
+                        # Clean up any alerts and refresh the page before continuing
                         try:
-                            # Parse the alert text to get remaining positions
-                            remain_pos = int(alert_text.strip('剩餘名額/開放名額：').split(" /")[0])
-                            utils.log_info(f"課程 {class_id}: {alert_text}")
-                            print("課程" + class_id + ": " + alert_text)
-
-                            if not remain_pos == 0:
-                                utils.log_info(f"課程 {class_id} 有名額，嘗試加選...")
-                                driver_click((By.XPATH,
-                                              "//*[@id='ctl00_MainContent_TabContainer1_tabSelected_gvToAdd']/tbody/tr[2]/td[1]/input"))
-                                result_text = driver_get_text((By.XPATH,
-                                                    "//*[@id='ctl00_MainContent_TabContainer1_tabSelected_lblMsgBlock']/span"))
-                                
-                                if result_text == "加選成功":
-                                    utils.log_info(f"✅ 成功加選課程: {class_id}")
-                                    print("成功加選課程：" + class_id)
-                                    class_ids.remove(class_id)
-                                else:
-                                    utils.log_warning(f"❌ 課程 {class_id} 加選失敗: {result_text}")
-                                    print(
-                                        "課程" + class_id + ": 加選失敗, 請確認是否已加選或衝堂/超修, 也可能被其他機器人搶走了..")
-                            else:
-                                utils.log_info(f"課程 {class_id} 無剩餘名額，跳過...")
-                        except (ValueError, IndexError) as parse_error:
-                            utils.log_error(f"解析課程 {class_id} 名額資訊失敗: {parse_error}, Alert text: {alert_text}")
-                            utils.log_info(f"課程 {class_id} 跳過此次檢查...")
-                    else:
-                        utils.log_warning(f"課程 {class_id} 未收到名額資訊，跳過此次檢查...")
-                    
-                    # Small delay between course checks
-                    time.sleep(0.5)
+                            engine.recover()
+                        except Exception as recover_error:
+                            utils.log_warning(f"重新整理頁面失敗: {recover_error}")
+                        continue  # Try next class
                     
-                except Exception as e:
-                    utils.log_error(f"處理課程 {class_id} 時發生錯誤: {e}")
-                    print(f"Error processing class {class_id}: {e}")
-                    # Clean up any alerts before continuing
-                    utils.dismiss_any_alert(driver)
-                    # Try to refresh the page by clicking the tab
-                    try:
-                        driver_click((By.ID, "ctl00_MainContent_TabContainer1_tabSelected_Label3"))
-                        time.sleep(0.5)
-                    except:
-                        pass
-                    continue  # Try next class
-                    
-        except Exception as e:
-            utils.log_error(f"自動加課過程中發生嚴重錯誤: {e}")
-            print(f"Critical error in auto_class: {e}")
-            
-            # Clean up any alerts before attempting recovery
-            utils.dismiss_any_alert(driver)
-            
-            utils.log_info("嘗試重新啟動瀏覽器並重新登入...")
-            print("Attempting to restart browser and re-login...")
-            
-            # Close current browser
-            try:
-                driver.quit()
-            except Exception as quit_error:
-                utils.log_warning(f"關閉瀏覽器時發生錯誤: {quit_error}")
-            
-            time.sleep(3)  # Wait before restarting
-            
-            # Create new browser instance
-            try:
-                utils.log_info("建立新的瀏覽器實例...")
-                options = webdriver.ChromeOptions()
-                if config.get("headless"):
-                    options.add_argument('--headless')
-                options.add_argument('--no-sandbox')
-                options.add_argument('--disable-dev-shm-usage')
-                service = Service(ChromeDriverManager().install())
-                driver = webdriver.Chrome(service=service, options=options)
-                driver.maximize_window()
-                utils.log_info("新瀏覽器實例建立完成")
-                
-                # Re-login
-                utils.log_info("重新登入中...")
-                print("Re-logging in...")
-                login()
-                return  # Exit current auto_class call since login() will call auto_class again
-                
-            except Exception as restart_error:
-                utils.log_error(f"重新啟動失敗: {restart_error}")
-                print(f"Failed to restart: {restart_error}")
-                print("Exiting program...")
-                try:
-                    driver.quit()
-                except:
-                    pass
-                sys.exit("Critical error: Unable to restart browser.")
-        
-        # Small delay before next round of checking all classes
-        if class_ids:  # Only sleep if there are still classes to check
-            utils.log_info(f"等待 2 秒後繼續檢查課程，剩餘課程: {', '.join(class_ids)}")
-            time.sleep(2)
+            except Exception as e:
+                # The supervisor recovers the page or the browser and calls auto_class again
+                print(f"Critical error in auto_class: {e}")
+                raise
 
+            metrics.observe('round', time.perf_counter() - round_start)
+            if on_progress:
+                on_progress()
+            if class_ids:
+                utils.log_info(f"輪詢間隔 {pacer.interval:.2f} 秒，"
+                               f"平均每門課程檢查耗時 {cycle_stats.average * 1000:.0f} 毫秒 ({config.get('page_sync')})，"
+                               f"繼續檢查課程，剩餘課程: {', '.join(class_ids)}")
+    finally:
+        # The supervisor calls auto_class again after a recovery, with new clients
+        close_clients(engine, scanner)
 
-if __name__ == "__main__":
+
+def replace_browser():
+    """Quit the main browser and take a new one."""
+    global driver
+    utils.log_info("關閉當前瀏覽器並建立新實例...")
+    browser_factory.release(driver)
+    driver = create_driver()
+    utils.log_info("新瀏覽器實例建立完成")
+
+
+def recover_tab():
+    """Recovery step 1: click the enrollment tab again."""
+    utils.dismiss_any_alert(driver)
+    if config.get("engine") == "selenium":
+        BrowserEngine().open()
+        WebDriverWait(driver, 3).until(ec.presence_of_element_located(SUB_ID_LOCATOR))
+    return True
+
+
+def recover_reload():
+    """Recovery step 2: reload the course page, still logged in."""
+    utils.dismiss_any_alert(driver)
+    with metrics.timer('page_load'):
+        driver.get(driver.current_url)
+    WebDriverWait(driver, 3).until(ec.presence_of_element_located(LOGOUT_LOCATOR))
+    return True
+
+
+def recover_relogin():
+    """Recovery step 3: log in again in the same browser."""
+    utils.dismiss_any_alert(driver)
+    driver.delete_all_cookies()
+    return login_once()
+
+
+def recover_new_browser():
+    """Recovery step 4: replace the browser and log in."""
+    replace_browser()
+    return login_once()
+
+
+RECOVERY_LADDER = [
+    ('tab', recover_tab),
+    ('reload', recover_reload),
+    ('relogin', recover_relogin),
+    ('new_browser', recover_new_browser),
+]
+
+
+def first_recovery_step(error):
+    """Skip the steps that can't help with error.
+
+    :return: Name of the recovery step to start at, or None for the cheapest.
+    """
+    if isinstance(error, http_engine.SessionExpiredError):
+        return 'relogin'
+    return None
+
+
+def run():
+    """Log in and poll until every class is added, recovering from errors in one loop."""
+    schedule = []
+
+    def poll():
+        if not schedule:
+            # Estimated once, so a recovery during the wait or the burst keeps the same start
+            schedule.append(create_start_schedule())
+            utils.log_info("開始自動加課...")
+            print('-------------------------------------')
+            print("Login Success. Start auto classing...")
+        auto_class(config.get("class_ids"), schedule[0], on_progress=bot_supervisor.mark_progress)
+
+    utils.log_info("開始登入 FCU 課程系統...")
+    bot_supervisor = supervisor.Supervisor(login_once, poll, RECOVERY_LADDER, replace_browser,
+                                           first_step=first_recovery_step, fatal=(LoginRejected,))
+    try:
+        bot_supervisor.run()
+    except LoginRejected as e:
+        print(f"Login rejected: {e} Exiting...")
+        sys.exit(f"Login rejected: {e}")
+    except supervisor.RecoveryFailed as e:
+        utils.log_error(f"無法恢復，程式結束: {e}")
+        print(f"{e} Exiting...")
+        sys.exit(str(e))
+    finally:
+        if bot_supervisor.recovery_steps:
+            utils.log_info(f"共執行 {bot_supervisor.recovery_steps} 次復原步驟，"
+                           f"合計耗時 {bot_supervisor.recovery_seconds:.2f} 秒")
+
+
+def setup():
+    """Read the config, set up logging and metrics and launch the first browser."""
+    global config, logger, scheduler, checkpoint, rate_limiter, browser_factory, driver
+
+    config = utils.read_config()
+
+    # Setup logging
+    logger = utils.setup_logger(max_bytes=int(config.get("log_max_mb") * 1024 * 1024),
+                                backup_count=config.get("log_backup_count"), jsonl=config.get("log_jsonl"))
+    # Load the OCR model while Chrome is starting, unless the shared OCR service does the OCR
+    if not utils.use_ocr_service(config.get("ocr_socket")):
+        utils.warm_up_ocr()
+    utils.log_info(f"設定檔讀取完成 - 使用者: {config.get('username')}, 課程數量: {len(config.get('class_ids'))}")
+    utils.log_info(f"目標課程: {', '.join(config.get('class_ids'))}")
+    utils.log_info(f"無頭模式: {'啟用' if config.get('headless') else '停用'}")
+    utils.log_info(f"加選引擎: {config.get('engine')}")
+    utils.log_info(f"頁面同步方式: {config.get('page_sync')}")
+    utils.log_info(f"彈窗處理方式: {config.get('alert_mode')}")
+    utils.log_info(f"輪詢工作階段數: {config.get('sessions')}")
+    if config.get('start_at'):
+        utils.log_info(f"預定開始時間: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(config.get('start_at')))}")
+
+    # Drop invalid or impossible courses before spending live queries on them
+    config['class_ids'] = catalog.check_class_ids(config)
+    if not config.get('class_ids'):
+        utils.log_error("預先檢查後沒有可加選的課程，程式結束")
+        sys.exit("No class left to join after the catalog check.")
+
+    # Share the polling rounds by course weight and drop alternatives once one is added
+    scheduler = priority.from_config(config)
+    if config.get('class_weights') or config.get('class_groups'):
+        for class_id in config.get('class_ids'):
+            group = config.get('class_groups').get(class_id)
+            utils.log_info(f"課程 {class_id} 權重 {scheduler.weight(class_id):g}" + (f"，備選組 {group}" if group else ""))
+
+    # Resume without the courses added or evicted by the last run
+    if config.get("progress_checkpoint"):
+        checkpoint = outcomes.ProgressCheckpoint(config.get("username"), config.get("course_url"),
+                                                 config.get("class_ids"))
+        remaining = checkpoint.resume(config.get('class_ids'), scheduler)
+        for class_id in config.get('class_ids'):
+            if class_id in remaining:
+                continue
+            record = checkpoint.settled.get(class_id)
+            settled_classes[class_id] = (outcomes.Outcome(record['kind'], record['reason'], record['message']) if record
+                                         else outcomes.Outcome(outcomes.PERMANENT, 'alternative', ''))
+        config['class_ids'] = remaining
+        if not config.get('class_ids'):
+            report_results()
+            utils.log_info(f"上次執行已處理完所有課程，程式結束 (刪除 {checkpoint.path} 可重新開始)")
+            sys.exit("Every class was settled by the last run.")
+
+    if config.get("metrics_port"):
+        metrics.serve(config.get("metrics_port"))
+    if config.get("metrics_summary_interval"):
+        metrics.start_summary_writer(METRICS_SUMMARY_FILE, config.get("metrics_summary_interval"))
+
+    # Shared by every polling session, caps the total query rate
+    rate_limiter = pacing.RateLimiter(config.get("pacing").get("max_rate"))
+    browser_factory = browser.BrowserFactory(headless=config.get("headless"), standby=config.get("browser_standby"),
+                                             lean=config.get("lean_browser"),
+                                             hook_alerts=config.get("alert_mode") == "hook")
+
+    # Register cleanup function to be called on exit
+    atexit.register(cleanup)
+
+    # Register signal handlers for graceful shutdown
+    signal.signal(signal.SIGINT, signal_handler)  # Ctrl+C
+    if hasattr(signal, 'SIGTERM'):
+        signal.signal(signal.SIGTERM, signal_handler)  # Termination signal
+
+    utils.log_info("正在初始化 Chrome 瀏覽器...")
+    driver = create_driver()
+    utils.log_info("瀏覽器初始化完成")
+
+
+def report_results():
+    """Log the added courses and the ones given up with their reason.
+
+    Alternatives of an added course aren't given up, the group got its course.
+
+    :return: True if every course was added, or an alternative of it.
+    """
+    added = [class_id for class_id, outcome in settled_classes.items() if outcome.kind == outcomes.SUCCESS]
+    not_needed = [class_id for class_id, outcome in settled_classes.items() if outcome.reason == 'alternative']
+    given_up = {class_id: outcome for class_id, outcome in settled_classes.items()
+                if outcome.kind != outcomes.SUCCESS and outcome.reason != 'alternative'}
+    if added:
+        utils.log_info(f"加選成功的課程: {', '.join(added)}")
+        print(f"Joined: {', '.join(added)}")
+    if not_needed:
+        utils.log_info(f"同組已有課程加選成功，不再需要的備選課程: {', '.join(not_needed)}")
+    for class_id, outcome in given_up.items():
+        detail = f" ({outcome.message})" if outcome.message else ""
+        utils.log_warning(f"放棄加選課程 {class_id}: {outcomes.describe(outcome)}{detail}",
+                          class_id=class_id, reason=outcome.reason)
+        print(f"Gave up {class_id}: {outcomes.describe(outcome)}{detail}")
+    return not given_up
+
+
+def main():
+    """Entry point of FCU AutoClass."""
+    setup()
     if not exists('./logs'):
         os.makedirs('./logs')
     try:
         utils.log_info("開始執行 FCU AutoClass 程式")
-        login()
-        utils.log_info("🎉 所有課程加選成功！")
-        print("All classes joined successfully!")
+        run()
+        if report_results():
+            utils.log_info("🎉 所有課程加選成功！")
+            print("All classes joined successfully!")
+        else:
+            utils.log_warning("輪詢結束，但部分課程無法加選，原因如上")
+            print("Polling finished, some classes could not be joined.")
     except KeyboardInterrupt:
         utils.log_warning("程式被使用者中斷")
         print("\nProgram interrupted by user.")
@@ -463,3 +1365,7 @@ if __name__ == "__main__":
         # cleanup() will be called automatically due to atexit.register()
         utils.log_info("=== FCU AutoClass 程式結束 ===")
         sys.exit("Program finished.")
+
+
+if __name__ == "__main__":
+    main()
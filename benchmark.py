@@ -0,0 +1,571 @@
+"""This python file will run the micro-benchmarks of FCU AutoClass.
+
+Usage:
+    python benchmark.py ocr [--image captcha.png] [--cold-runs 3] [--warm-runs 50]
+    python benchmark.py ocr-service [--instances 4] [--requests 20] [--image captcha.png]
+    python benchmark.py captcha --dir captchas/ [--min-confidence 0.5]
+    python benchmark.py browser [--url https://course.fcu.edu.tw/] [--runs 5] [--headless]
+    python benchmark.py logging [--lines 20000] [--jsonl] [--console-delay-ms 0]
+    python benchmark.py login [--runs 10] [--headless]
+    python benchmark.py startup [--runs 5] [--budget-ms 800]
+    python benchmark.py e2e [--config config.yml] [--duration 120] [--course 0050:75 --open 0050@30+1 --bots 3 ...] [--bulk-scan]
+
+Labelled captcha folders hold images named after their answer, like
+``9368.png`` or ``9368_2.png``.
+"""
+import argparse
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import simulator
+from metrics import percentile
+
+
+UNITS = {'ms': 1e3, 'us': 1e6}
+
+
+def report(name, samples, unit='ms'):
+    """Print latency summary of samples in seconds.
+
+    :param unit: 'ms' or 'us'.
+    """
+    scale = UNITS[unit]
+    print(f"{name:<24} n={len(samples):<5} mean={statistics.mean(samples) * scale:8.1f} {unit}  "
+          f"p50={percentile(samples, 50) * scale:8.1f} {unit}  p99={percentile(samples, 99) * scale:8.1f} {unit}")
+
+
+def sample_captcha(text="9368"):
+    """Draw a captcha-like PNG, used when no real captcha image is given.
+
+    :rtype: bytes
+    """
+    from PIL import Image, ImageDraw
+
+    image = Image.new('RGB', (100, 36), 'white')
+    draw = ImageDraw.Draw(image)
+    for index, char in enumerate(text):
+        draw.text((12 + index * 20, 10), char, fill='black')
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def bench_ocr(args):
+    """Compare a cold OCR call (model load + classify) with a warm one on the shared engine."""
+    import ddddocr
+    import utilities as utils
+
+    if args.image:
+        with open(args.image, 'rb') as f:
+            image = f.read()
+    else:
+        image = sample_captcha()
+
+    cold = []
+    for _ in range(args.cold_runs):
+        start = time.perf_counter()
+        ddddocr.DdddOcr().classification(image)
+        cold.append(time.perf_counter() - start)
+
+    utils.get_ocr_engine()
+    warm = []
+    for _ in range(args.warm_runs):
+        start = time.perf_counter()
+        utils.get_ocr_answer(image)
+        warm.append(time.perf_counter() - start)
+
+    report("cold (load + classify)", cold)
+    report("warm (shared engine)", warm)
+
+
+# Run by every instance of the ocr-service benchmark: load the engine, report ready,
+# wait for the go line so all instances start together, then time each captcha
+OCR_INSTANCE_SCRIPT = """
+import json, sys, time
+import utilities as utils
+socket_path, image_path, requests = sys.argv[1], sys.argv[2], int(sys.argv[3])
+with open(image_path, 'rb') as f:
+    image = f.read()
+utils.use_ocr_service(socket_path)
+utils.get_ocr_engine().classification(image)
+print('ready', flush=True)
+sys.stdin.readline()
+latencies = []
+for _ in range(requests):
+    start = time.perf_counter()
+    utils.get_ocr_engine().classification(image)
+    latencies.append(time.perf_counter() - start)
+rss = 0
+with open('/proc/self/status') as f:
+    for line in f:
+        if line.startswith('VmRSS:'):
+            rss = int(line.split()[1]) * 1024
+print('result ' + json.dumps({'latencies': latencies, 'rss': rss}), flush=True)
+"""
+
+
+def run_ocr_instances(count, socket_path, image_path, requests):
+    """Run count OCR instances at once.
+
+    :return: Tuple of (all latencies, RSS of each instance).
+    """
+    instances = [subprocess.Popen([sys.executable, '-c', OCR_INSTANCE_SCRIPT, socket_path, image_path, str(requests)],
+                                  cwd=os.path.dirname(os.path.abspath(__file__)), stdin=subprocess.PIPE,
+                                  stdout=subprocess.PIPE, text=True)
+                 for _ in range(count)]
+
+    def read_line(instance, prefix):
+        # ddddocr prints a banner to stdout when the model loads
+        for line in instance.stdout:
+            if line.startswith(prefix):
+                return line[len(prefix):].strip()
+        raise RuntimeError("OCR instance exited early")
+
+    for instance in instances:
+        read_line(instance, 'ready')
+    for instance in instances:
+        instance.stdin.write('go\n')
+        instance.stdin.flush()
+    latencies, rss = [], []
+    for instance in instances:
+        result = json.loads(read_line(instance, 'result '))
+        instance.wait()
+        latencies.extend(result['latencies'])
+        rss.append(result['rss'])
+    return latencies, rss
+
+
+def bench_ocr_service(args):
+    """Compare memory per instance and captcha latency under concurrent load, in-process OCR vs the OCR service."""
+    import ocr_service
+
+    if not os.path.isdir('/proc') or not ocr_service.is_supported():
+        print("The ocr-service benchmark needs Linux (/proc and Unix domain sockets)")
+        return 1
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        image_path = args.image
+        if not image_path:
+            image_path = os.path.join(work_dir, 'captcha.png')
+            with open(image_path, 'wb') as f:
+                f.write(sample_captcha())
+        socket_path = os.path.join(work_dir, 'ocr.sock')
+
+        latencies, rss = run_ocr_instances(args.instances, '', image_path, args.requests)
+        report(f"in-process x{args.instances}", latencies)
+        print(f"{'':<24} RSS per instance {statistics.mean(rss) / 2 ** 20:.1f} MB, "
+              f"total {sum(rss) / 2 ** 20:.1f} MB")
+
+        service = subprocess.Popen([sys.executable, 'ocr_service.py', '--socket', socket_path, '--log-dir', work_dir],
+                                   cwd=os.path.dirname(os.path.abspath(__file__)), stdout=subprocess.DEVNULL)
+        try:
+            client = ocr_service.OcrClient(socket_path)
+            deadline = time.monotonic() + 60
+            while not client.ping():
+                if service.poll() is not None or time.monotonic() > deadline:
+                    print("OCR service failed to start")
+                    return 1
+                time.sleep(0.1)
+            latencies, rss = run_ocr_instances(args.instances, socket_path, image_path, args.requests)
+            service_rss = process_tree_rss(service.pid)
+        finally:
+            service.terminate()
+            service.wait()
+        report(f"service x{args.instances}", latencies)
+        print(f"{'':<24} RSS per instance {statistics.mean(rss) / 2 ** 20:.1f} MB, service "
+              f"{service_rss / 2 ** 20:.1f} MB, total {(sum(rss) + service_rss) / 2 ** 20:.1f} MB")
+
+
+def load_labelled_captchas(folder):
+    """Load captcha images labelled by file name.
+
+    :return: List of (label, PNG bytes).
+    """
+    captchas = []
+    for name in sorted(os.listdir(folder)):
+        stem, extension = os.path.splitext(name)
+        if extension.lower() not in ('.png', '.jpg', '.jpeg', '.gif', '.bmp'):
+            continue
+        with open(os.path.join(folder, name), 'rb') as f:
+            captchas.append((stem.split('_')[0], f.read()))
+    return captchas
+
+
+def bench_captcha(args):
+    """Measure accuracy, latency and expected login round trips of the captcha solver."""
+    import captcha
+    import utilities as utils
+
+    captchas = load_labelled_captchas(args.dir)
+    if not captchas:
+        print(f"No labelled captcha images found in {args.dir}")
+        return 1
+    utils.get_ocr_engine()
+
+    single_latency, single_correct = [], 0
+    solver_latency, solver_correct, submitted, submitted_correct = [], 0, 0, 0
+    for label, image in captchas:
+        start = time.perf_counter()
+        answer = utils.get_ocr_answer(image)
+        single_latency.append(time.perf_counter() - start)
+        single_correct += answer == label
+
+        start = time.perf_counter()
+        solution = captcha.solve_captcha(image, args.length, args.charset)
+        solver_latency.append(time.perf_counter() - start)
+        solver_correct += solution.answer == label
+        if solution.confidence >= args.min_confidence:
+            submitted += 1
+            submitted_correct += solution.answer == label
+
+    total = len(captchas)
+    print(f"captchas: {total}")
+    report("single pass", single_latency)
+    report("solver", solver_latency)
+    print(f"single pass accuracy:      {single_correct / total:.1%}")
+    print(f"solver accuracy:           {solver_correct / total:.1%}")
+    print(f"solver submitted:          {submitted / total:.1%} "
+          f"(accuracy when submitted {submitted_correct / max(submitted, 1):.1%})")
+    # Every captcha is one login round trip in single pass mode. The solver only
+    # submits confident answers, a rejected one costs a captcha refresh instead.
+    if single_correct:
+        print(f"expected login round trips, single pass: {total / single_correct:.2f}")
+    if submitted_correct:
+        print(f"expected login round trips, solver:      {submitted / submitted_correct:.2f} "
+              f"(captcha refreshes {(total - submitted) / submitted_correct:.2f})")
+
+
+def process_tree_rss(pid):
+    """Sum the resident memory of a process and all its descendants, Linux only.
+
+    :param pid: Root process id.
+    :return: RSS in bytes, or None where /proc isn't available.
+    """
+    if not os.path.isdir('/proc'):
+        return None
+    import browser
+
+    total = 0
+    for current in [pid] + browser.descendant_pids(pid):
+        try:
+            with open(f'/proc/{current}/status', 'r') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1]) * 1024
+                        break
+        except OSError:
+            continue
+    return total
+
+
+def bench_browser(args):
+    """Compare page-load time and Chrome memory of the default and the lean browser profile."""
+    import browser
+
+    for lean in (False, True):
+        name = "lean" if lean else "default"
+        factory = browser.BrowserFactory(headless=args.headless, standby=False, lean=lean)
+        web_driver = factory.launch()
+        try:
+            loads, navigations = [], []
+            for _ in range(args.runs):
+                # Start from a blank page so every run loads the whole page again
+                web_driver.get('about:blank')
+                start = time.perf_counter()
+                web_driver.get(args.url)
+                loads.append(time.perf_counter() - start)
+                navigations.append(web_driver.execute_script(
+                    "var t = performance.timing; return (t.loadEventEnd - t.navigationStart) / 1000;"))
+            rss = process_tree_rss(web_driver.service.process.pid)
+        finally:
+            factory.release(web_driver)
+        report(f"{name} get()", loads)
+        report(f"{name} load event", navigations)
+        print(f"{name + ' RSS':<24} {rss / 1024 / 1024:.1f} MiB" if rss is not None else f"{name + ' RSS':<24} N/A")
+
+
+class SlowStream(io.TextIOWrapper):
+    """Console stream that takes delay seconds per write, like a slow terminal."""
+
+    def __init__(self, path, delay):
+        super().__init__(open(path, 'wb'), encoding='utf8')
+        self.delay = delay
+
+    def write(self, text):
+        if self.delay:
+            time.sleep(self.delay)
+        return super().write(text)
+
+
+def bench_logging(args):
+    """Measure the time a log call costs the caller, synchronous handlers vs the queued writer.
+
+    With a fast disk and console the queue saves little per call, as the writer
+    thread still competes for the GIL. --console-delay-ms makes every console
+    write slow, where the synchronous caller waits for each write and the
+    queued caller doesn't.
+    """
+    import logging
+    import utilities as utils
+
+    message = "課程 0050: 剩餘名額/開放名額：0  /75 ，無剩餘名額，跳過..."
+    with tempfile.TemporaryDirectory() as log_dir, SlowStream(os.devnull, args.console_delay_ms / 1000) as console:
+        # What setup_logger did before: file and console written in the calling thread
+        handlers = [logging.FileHandler(os.path.join(log_dir, 'sync.txt'), encoding='utf-8'),
+                    logging.StreamHandler(console)]
+        logging.basicConfig(level=logging.INFO, format=utils.LOG_FORMAT, handlers=handlers, force=True)
+        sync = []
+        for _ in range(args.lines):
+            start = time.perf_counter()
+            utils.log_info(message)
+            sync.append(time.perf_counter() - start)
+        for handler in handlers:
+            handler.close()
+
+        utils.setup_logger(jsonl=args.jsonl, log_dir=log_dir, stream=console)
+        queued = []
+        for _ in range(args.lines):
+            start = time.perf_counter()
+            utils.log_info(message, class_id='0050', remain=0)
+            queued.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        utils.stop_logger()
+        drain = time.perf_counter() - start
+
+        repeated = []
+        for _ in range(args.lines):
+            start = time.perf_counter()
+            utils.log_repeated(('no_seats', '0050'), message)
+            repeated.append(time.perf_counter() - start)
+        logging.basicConfig(force=True)
+
+    report("synchronous", sync, 'us')
+    report("queued", queued, 'us')
+    report("queued, collapsed", repeated, 'us')
+    print(f"writer thread drained the queue {drain * 1000:.1f} ms after the last call")
+
+
+def bench_login(args):
+    """Compare the time from the loaded login page to the login click, sequential vs pipelined, on the simulator."""
+    import yaml
+    import app
+    import browser
+    import utilities as utils
+
+    site = simulator.site_from_args(args)
+    server = simulator.serve(site)
+    url = f'http://127.0.0.1:{server.server_address[1]}/'
+    with tempfile.TemporaryDirectory() as work_dir:
+        with open(os.path.join(work_dir, 'config.yml'), 'w', encoding='utf8') as f:
+            yaml.safe_dump({'username': 'D0000000', 'password': 'simulator', 'class_id': ' '.join(site.courses),
+                            'headless': args.headless, 'course_url': url, 'session_persistence': False}, f)
+        cwd = os.getcwd()
+        os.chdir(work_dir)
+        try:
+            app.config = utils.read_config()
+        finally:
+            os.chdir(cwd)
+    # Both flows get a warm model, the cold load is the ocr benchmark's business
+    utils.get_ocr_engine()
+
+    factory = browser.BrowserFactory(headless=args.headless, standby=False, lean=app.config.get('lean_browser'))
+    web_driver = factory.launch()
+    try:
+        for pipeline in (False, True):
+            app.config['login_pipeline'] = pipeline
+            samples = []
+            for _ in range(args.runs):
+                web_driver.delete_all_cookies()
+                web_driver.get(url)
+                start = time.perf_counter()
+                app.fill_login_form(web_driver)
+                samples.append(time.perf_counter() - start)
+            report("pipelined" if pipeline else "sequential", samples)
+    finally:
+        factory.release(web_driver)
+        server.shutdown()
+
+
+# Must not be imported just by importing app, they load when first needed or in the background
+LAZY_MODULES = ('ddddocr', 'onnxruntime', 'webdriver_manager')
+
+
+def parse_importtime(stderr):
+    """Parse the output of python -X importtime.
+
+    :return: List of (module, depth, self seconds, cumulative seconds) in import order.
+    """
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        imports.append((name.strip(), depth, int(self_us) / 1e6, int(cumulative_us) / 1e6))
+    return imports
+
+
+def bench_startup(args):
+    """Measure the import time of app and check that importing it has no side effects."""
+    app_dir = os.path.dirname(os.path.abspath(__file__))
+    totals, regressions = [], []
+    with tempfile.TemporaryDirectory() as work_dir:
+        for _ in range(args.runs):
+            # An empty folder, so a config.yml or logs folder showing up there is a side effect
+            process = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'], cwd=work_dir,
+                                     env={**os.environ, 'PYTHONPATH': app_dir}, capture_output=True, text=True,
+                                     timeout=120)
+            if process.returncode:
+                print(process.stderr[-2000:])
+                return 1
+            imports = parse_importtime(process.stderr)
+            totals.append(next(cumulative for name, depth, _, cumulative in imports if name == 'app' and depth == 0))
+        side_effects = os.listdir(work_dir)
+
+    report("import app", totals)
+    print("slowest imports of app (cumulative):")
+    # importtime lists the imports of a module right before the module itself
+    app_index = max(index for index, (name, depth, _, _) in enumerate(imports) if name == 'app' and depth == 0)
+    direct = []
+    for name, depth, _, cumulative in reversed(imports[:app_index]):
+        if depth == 0:
+            break
+        if depth == 1:
+            direct.append((cumulative, name))
+    for cumulative, name in sorted(direct, reverse=True)[:args.top]:
+        print(f"  {name:<48} {cumulative * 1000:8.1f} ms")
+
+    loaded = sorted({name.split('.')[0] for name, _, _, _ in imports} & set(LAZY_MODULES))
+    if loaded:
+        regressions.append(f"heavy modules imported eagerly: {', '.join(loaded)}")
+    if side_effects:
+        regressions.append(f"importing app created: {', '.join(sorted(side_effects))}")
+    if args.budget_ms and percentile(totals, 50) * 1000 > args.budget_ms:
+        regressions.append(f"p50 import time over the {args.budget_ms:g} ms budget")
+    for regression in regressions:
+        print(f"REGRESSION: {regression}")
+    return 1 if regressions else 0
+
+
+def bench_e2e(args):
+    """Run the bot against the local simulator and measure seat-open to add time and rounds per second."""
+    import yaml
+
+    site = simulator.site_from_args(args)
+    if not args.open:
+        # Release one seat of every course after the bot had time to log in
+        site.openings = [(30.0, code, 1) for code in site.courses]
+    server = simulator.serve(site)
+    config = {}
+    if args.config:
+        with open(args.config, 'r', encoding='utf8') as f:
+            config = yaml.safe_load(f) or {}
+    config.update({
+        'username': 'D0000000',
+        'password': 'simulator',
+        'class_id': ' '.join(site.courses),
+        'course_url': f'http://127.0.0.1:{server.server_address[1]}/',
+        'headless': True,
+        'start_at': '',
+        'catalog_file': '',
+    })
+    if args.bulk_scan:
+        config['quota_scan_url'] = f'http://127.0.0.1:{server.server_address[1]}/CourseList.aspx'
+        config['quota_scan_body'] = ''
+
+    app_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app.py')
+    with tempfile.TemporaryDirectory() as work_dir:
+        with open(os.path.join(work_dir, 'config.yml'), 'w', encoding='utf8') as f:
+            yaml.safe_dump(config, f, allow_unicode=True)
+        site.start()
+        process = subprocess.Popen([sys.executable, app_path], cwd=work_dir,
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            process.wait(timeout=args.duration)
+        except subprocess.TimeoutExpired:
+            process.terminate()
+            process.wait(timeout=30)
+        duration = time.time() - site.started_at
+    server.shutdown()
+
+    summary = site.summary()
+    print(f"engine={config.get('engine', 'selenium')} page_sync={config.get('page_sync', 'event')} "
+          f"alert_mode={config.get('alert_mode', 'hook')} "
+          f"sessions={config.get('sessions', 1)} bulk_scan={bool(config.get('quota_scan_url'))} bots={args.bots} latency={args.latency}s run={duration:.1f}s")
+    reactions = [add['reaction'] for add in summary['adds'] if add['reaction'] is not None]
+    if reactions:
+        report("seat open -> added", reactions)
+    print(f"courses added:            {len(summary['adds'])}/{len(site.courses)} "
+          f"(seats taken by other bots: {summary['bot_adds']})")
+    # With the listing scan a round is one scan, the queries only follow free seats
+    rounds_per_second = summary['scans_per_second'] or summary['queries_per_second'] / len(site.courses)
+    print(f"rounds per second:        {rounds_per_second:.2f} "
+          f"({summary['queries']} queries, {summary['scans']} listing scans)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="FCU AutoClass micro-benchmarks")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    ocr_parser = subparsers.add_parser('ocr', help="cold vs warm OCR latency")
+    ocr_parser.add_argument('--image', help="captcha image to recognize (default: a generated sample)")
+    ocr_parser.add_argument('--cold-runs', type=int, default=3)
+    ocr_parser.add_argument('--warm-runs', type=int, default=50)
+    ocr_parser.set_defaults(func=bench_ocr)
+
+    service_parser = subparsers.add_parser('ocr-service', help="memory and concurrent latency of the shared OCR service")
+    service_parser.add_argument('--instances', type=int, default=4, help="bot instances doing OCR at once")
+    service_parser.add_argument('--requests', type=int, default=20, help="captchas per instance")
+    service_parser.add_argument('--image', help="captcha image to recognize (default: a generated sample)")
+    service_parser.set_defaults(func=bench_ocr_service)
+
+    captcha_parser = subparsers.add_parser('captcha', help="captcha solver accuracy and latency")
+    captcha_parser.add_argument('--dir', required=True, help="folder of captcha images named by their answer")
+    captcha_parser.add_argument('--length', type=int, default=4)
+    captcha_parser.add_argument('--charset', default='0123456789')
+    captcha_parser.add_argument('--min-confidence', type=float, default=0.5)
+    captcha_parser.set_defaults(func=bench_captcha)
+
+    browser_parser = subparsers.add_parser('browser', help="page-load time and memory of the lean browser profile")
+    browser_parser.add_argument('--url', default='https://course.fcu.edu.tw/')
+    browser_parser.add_argument('--runs', type=int, default=5)
+    browser_parser.add_argument('--headless', action='store_true')
+    browser_parser.set_defaults(func=bench_browser)
+
+    logging_parser = subparsers.add_parser('logging', help="per-line cost of the logging setup")
+    logging_parser.add_argument('--lines', type=int, default=20000)
+    logging_parser.add_argument('--jsonl', action='store_true', help="also write the JSONL records")
+    logging_parser.add_argument('--console-delay-ms', type=float, default=0, help="time each console write takes")
+    logging_parser.set_defaults(func=bench_logging)
+
+    login_parser = subparsers.add_parser('login', help="page loaded to login click, sequential vs pipelined")
+    login_parser.add_argument('--runs', type=int, default=10)
+    login_parser.add_argument('--headless', action='store_true')
+    simulator.add_site_arguments(login_parser)
+    login_parser.set_defaults(func=bench_login)
+
+    startup_parser = subparsers.add_parser('startup', help="import time and side effects of importing app")
+    startup_parser.add_argument('--runs', type=int, default=5)
+    startup_parser.add_argument('--top', type=int, default=10, help="number of slowest imports to list")
+    startup_parser.add_argument('--budget-ms', type=float, default=0, help="fail when the p50 import time is over it")
+    startup_parser.set_defaults(func=bench_startup)
+
+    e2e_parser = subparsers.add_parser('e2e', help="reaction time of a config against the local simulator")
+    e2e_parser.add_argument('--config', help="config.yml to run, the account, classes and course_url are replaced")
+    e2e_parser.add_argument('--duration', type=float, default=120, help="max seconds to run the bot")
+    e2e_parser.add_argument('--bulk-scan', action='store_true', help="read the seats from the simulator's course listing")
+    simulator.add_site_arguments(e2e_parser)
+    e2e_parser.set_defaults(func=bench_e2e)
+
+    args = parser.parse_args()
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,404 @@
+"""This python file will create the Chrome browsers of FCU AutoClass.
+
+The chromedriver binary is resolved once and cached on disk, so restarts and
+offline runs don't ask webdriver-manager again. A standby browser is launched
+in the background, so replacing a broken browser is a hand-off instead of a
+cold launch. The lean profile drops everything the bot never looks at: images,
+fonts, stylesheets and trackers are blocked through DevTools, and Chrome runs
+without extensions, GPU or background networking in a small fixed window.
+With the alert hook, every browser catches the page alerts in the page.
+
+Every browser gets its own temporary profile, and its chromedriver runs in a
+process group of its own. The factory keeps the chromedriver process of each
+browser it made, so cleanup reaps only this instance's Chrome processes and
+many bots can share one host.
+"""
+import json
+import os
+import shutil
+import signal
+import subprocess
+import tempfile
+import threading
+import time
+from os.path import exists
+
+from selenium import webdriver
+from selenium.common.exceptions import SessionNotCreatedException, WebDriverException
+from selenium.webdriver.chrome.service import Service
+
+import alert_hook
+import metrics
+import utilities as utils
+
+DRIVER_CACHE_FILE = './.cache/chromedriver.json'
+
+# Blocked by the lean profile. The captcha (ctl00_Login1_Image1) comes from an .aspx handler and isn't matched.
+BLOCKED_URL_PATTERNS = [
+    '*.png', '*.jpg', '*.jpeg', '*.gif', '*.bmp', '*.webp', '*.svg', '*.ico',
+    '*.woff', '*.woff2', '*.ttf', '*.otf', '*.eot',
+    '*.css',
+    '*google-analytics.com*', '*googletagmanager.com*', '*doubleclick.net*', '*facebook.net*', '*hotjar.com*',
+]
+LEAN_WINDOW_SIZE = (1024, 768)
+LEAN_ARGUMENTS = [
+    '--disable-extensions',
+    '--disable-gpu',
+    '--disable-background-networking',
+    '--disable-component-update',
+    '--disable-default-apps',
+    '--disable-sync',
+    '--no-first-run',
+    '--mute-audio',
+    f'--window-size={LEAN_WINDOW_SIZE[0]},{LEAN_WINDOW_SIZE[1]}',
+]
+
+PROFILE_PREFIX = 'autoclass-profile-'
+
+_driver_path = None
+_driver_path_lock = threading.Lock()
+
+
+def resolve_driver_path(refresh=False):
+    """Get the chromedriver path, resolving it with webdriver-manager only when needed.
+
+    :param refresh: Ignore the cached path and resolve again.
+    :rtype: str
+    """
+    global _driver_path
+    with _driver_path_lock:
+        if _driver_path and not refresh:
+            return _driver_path
+
+        if not refresh and exists(DRIVER_CACHE_FILE):
+            try:
+                with open(DRIVER_CACHE_FILE, 'r', encoding='utf8') as f:
+                    cached_path = json.load(f).get('path')
+                if cached_path and exists(cached_path):
+                    _driver_path = cached_path
+                    utils.log_info(f"使用快取的 ChromeDriver: {cached_path}")
+                    return _driver_path
+            except (OSError, ValueError) as e:
+                utils.log_warning(f"讀取 ChromeDriver 快取失敗: {e}")
+
+        # Use webdriver-manager to automatically manage ChromeDriver, only imported when the cache misses
+        from webdriver_manager.chrome import ChromeDriverManager
+
+        start = time.perf_counter()
+        _driver_path = ChromeDriverManager().install()
+        utils.log_info(f"ChromeDriver 解析完成，耗時 {time.perf_counter() - start:.2f} 秒: {_driver_path}")
+        try:
+            os.makedirs(os.path.dirname(DRIVER_CACHE_FILE), exist_ok=True)
+            with open(DRIVER_CACHE_FILE, 'w', encoding='utf8') as f:
+                json.dump({'path': _driver_path, 'resolved_at': time.time()}, f)
+        except OSError as e:
+            utils.log_warning(f"寫入 ChromeDriver 快取失敗: {e}")
+        return _driver_path
+
+
+def build_options(headless=False, lean=False, profile_dir=None):
+    """Build the Chrome options.
+
+    :param headless: Run Chrome without a window.
+    :param lean: Use the lean profile.
+    :param profile_dir: User data dir of this browser alone.
+    :rtype: webdriver.ChromeOptions
+    """
+    options = webdriver.ChromeOptions()
+    if headless:
+        options.add_argument('--headless')
+    if profile_dir:
+        options.add_argument(f'--user-data-dir={profile_dir}')
+    # Add options to prevent orphaned processes
+    options.add_argument('--no-sandbox')
+    options.add_argument('--disable-dev-shm-usage')
+    if lean:
+        for argument in LEAN_ARGUMENTS:
+            options.add_argument(argument)
+    return options
+
+
+def block_resources(web_driver, blocked=True):
+    """Block the resources of BLOCKED_URL_PATTERNS through DevTools, or allow everything again.
+
+    :param web_driver: Chrome driver.
+    :param blocked: False to lift the block.
+    """
+    web_driver.execute_cdp_cmd('Network.enable', {})
+    web_driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': BLOCKED_URL_PATTERNS if blocked else []})
+
+
+def descendant_pids(pid):
+    """Get the process ids of every descendant of a process.
+
+    :param pid: Root process id.
+    :rtype: list
+    """
+    children = {}
+    if os.path.isdir('/proc'):
+        for entry in os.listdir('/proc'):
+            if not entry.isdigit():
+                continue
+            try:
+                with open(f'/proc/{entry}/stat', 'r') as f:
+                    # The command name may contain spaces, the fields after it don't
+                    parent = int(f.read().rsplit(')', 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+            children.setdefault(parent, []).append(int(entry))
+    elif os.name != 'nt':
+        try:
+            output = subprocess.run(['ps', '-A', '-o', 'pid=,ppid='], capture_output=True, text=True).stdout
+        except OSError:
+            return []
+        for line in output.splitlines():
+            child, parent = map(int, line.split())
+            children.setdefault(parent, []).append(child)
+
+    descendants = []
+    pending = list(children.get(pid, []))
+    while pending:
+        current = pending.pop()
+        descendants.append(current)
+        pending.extend(children.get(current, []))
+    return descendants
+
+
+def process_start_time(pid):
+    """Get when a process started, to tell it apart from a later process given the same pid.
+
+    :param pid: Process id.
+    :return: Start time in an opaque format, or None if there is no such process.
+    """
+    if os.path.isdir('/proc'):
+        try:
+            with open(f'/proc/{pid}/stat', 'r') as f:
+                # Field 22, clock ticks since boot, counted after the command name
+                return f.read().rsplit(')', 1)[1].split()[19]
+        except (OSError, IndexError):
+            return None
+    if os.name != 'nt':
+        try:
+            output = subprocess.run(['ps', '-o', 'lstart=', '-p', str(pid)], capture_output=True, text=True).stdout
+        except OSError:
+            return None
+        return output.strip() or None
+    return None
+
+
+def snapshot_descendants(pid):
+    """Get every descendant of a process with its start time.
+
+    :param pid: Root process id.
+    :return: Dict of pid to start time, for kill_pids.
+    """
+    snapshot = {}
+    for child in descendant_pids(pid):
+        start_time = process_start_time(child)
+        if start_time is not None:
+            snapshot[child] = start_time
+    return snapshot
+
+
+def kill_pids(snapshot):
+    """Kill the processes of a snapshot that are still the same processes.
+
+    A pid whose start time changed was reused by another process after ours
+    exited, and is left alone.
+
+    :param snapshot: Dict of pid to start time from snapshot_descendants.
+    """
+    for pid, start_time in snapshot.items():
+        if process_start_time(pid) != start_time:
+            continue
+        try:
+            os.kill(pid, signal.SIGKILL if os.name != 'nt' else signal.SIGTERM)
+        except (ProcessLookupError, PermissionError, OSError):
+            pass
+
+
+def kill_process_tree(process):
+    """Kill a process started by this program and every descendant of it, nothing else.
+
+    :param process: subprocess.Popen, like the chromedriver of one browser.
+    """
+    # Only while it hasn't been reaped, so its pid can't belong to someone else yet
+    if process.poll() is not None:
+        return
+    if os.name == 'nt':
+        subprocess.run(['taskkill', '/f', '/t', '/pid', str(process.pid)], capture_output=True)
+    else:
+        descendants = snapshot_descendants(process.pid)
+        try:
+            # chromedriver leads its own group, which also holds Chrome helpers that lost their parent
+            if os.getpgid(process.pid) == process.pid:
+                os.killpg(process.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+        kill_pids(descendants)
+    try:
+        process.wait(timeout=5)
+    except subprocess.TimeoutExpired:
+        pass
+
+
+def is_alive(web_driver):
+    """Check if the browser still answers commands.
+
+    :rtype: bool
+    """
+    try:
+        web_driver.execute_script("return 1")
+        return True
+    except WebDriverException:
+        return False
+
+
+class BrowserFactory:
+    """Create browsers, keeping one pre-launched standby ready for the next request."""
+
+    def __init__(self, headless=False, standby=True, lean=False, hook_alerts=False):
+        """Create the factory.
+
+        :param headless: Run Chrome without a window.
+        :param standby: Keep a pre-launched standby browser.
+        :param lean: Use the lean profile.
+        :param hook_alerts: Install the alert_hook in every browser.
+        """
+        self.headless = headless
+        self.standby = standby
+        self.lean = lean
+        self.hook_alerts = hook_alerts
+        self._lock = threading.Lock()
+        # Driver to (chromedriver process, profile dir) of every browser not released yet
+        self._processes = {}
+        self._standby_driver = None
+        self._standby_thread = None
+        self._closed = False
+
+    def acquire(self):
+        """Get a ready browser, handing off the standby one if there is any.
+
+        :rtype: webdriver.Chrome
+        """
+        start = time.perf_counter()
+        web_driver = self._take_standby()
+        if web_driver is not None:
+            source = "熱備瀏覽器接手"
+        else:
+            web_driver = self.launch()
+            source = "冷啟動"
+        elapsed = time.perf_counter() - start
+        metrics.observe('browser_launch', elapsed)
+        utils.log_info(f"瀏覽器就緒 ({source})，耗時 {elapsed:.2f} 秒")
+        self.prepare_standby()
+        return web_driver
+
+    def launch(self):
+        """Launch a new browser.
+
+        :rtype: webdriver.Chrome
+        """
+        profile_dir = tempfile.mkdtemp(prefix=PROFILE_PREFIX)
+        options = build_options(self.headless, self.lean, profile_dir)
+        try:
+            try:
+                web_driver = webdriver.Chrome(service=self._service(resolve_driver_path()), options=options)
+            except SessionNotCreatedException as e:
+                # The cached driver doesn't match the installed Chrome anymore
+                utils.log_warning(f"ChromeDriver 與 Chrome 版本不符，重新解析: {e.msg}")
+                web_driver = webdriver.Chrome(service=self._service(resolve_driver_path(refresh=True)),
+                                              options=options)
+        except Exception:
+            shutil.rmtree(profile_dir, ignore_errors=True)
+            raise
+        with self._lock:
+            self._processes[web_driver] = (web_driver.service.process, profile_dir)
+        if self.lean:
+            block_resources(web_driver)
+        else:
+            web_driver.maximize_window()
+        if self.hook_alerts:
+            alert_hook.install(web_driver)
+        return web_driver
+
+    @staticmethod
+    def _service(driver_path):
+        # A process group of its own, so reaping this browser never touches another instance
+        popen_kw = {} if os.name == 'nt' else {'start_new_session': True}
+        return Service(driver_path, popen_kw=popen_kw)
+
+    def release(self, web_driver):
+        """Quit a browser of this factory, then kill what is left of it and delete its profile.
+
+        :param web_driver: Driver made by this factory.
+        """
+        with self._lock:
+            tracked = self._processes.pop(web_driver, None)
+        # Chrome processes that outlive chromedriver are orphaned, find them while they are still its children.
+        # Their start times make sure only these processes are killed after quit(), even if a pid gets reused.
+        leftovers = snapshot_descendants(tracked[0].pid) if tracked and tracked[0].poll() is None else {}
+        try:
+            web_driver.quit()
+        except Exception as e:
+            utils.log_warning(f"關閉瀏覽器時發生錯誤: {e}")
+        if tracked is not None:
+            process, profile_dir = tracked
+            kill_process_tree(process)
+            kill_pids(leftovers)
+            shutil.rmtree(profile_dir, ignore_errors=True)
+
+    def reap(self):
+        """Kill the processes and delete the profiles of every browser this factory made and didn't release."""
+        with self._lock:
+            processes, self._processes = self._processes, {}
+        for process, profile_dir in processes.values():
+            kill_process_tree(process)
+            shutil.rmtree(profile_dir, ignore_errors=True)
+        if processes:
+            utils.log_info(f"已清理本程式的 {len(processes)} 個瀏覽器程序")
+
+    def prepare_standby(self):
+        """Launch a standby browser in the background if there isn't one."""
+        if not self.standby:
+            return
+        with self._lock:
+            if self._closed or self._standby_driver is not None:
+                return
+            if self._standby_thread is not None and self._standby_thread.is_alive():
+                return
+            self._standby_thread = threading.Thread(target=self._launch_standby, name="browser-standby", daemon=True)
+            self._standby_thread.start()
+
+    def shutdown(self):
+        """Quit the standby browser and stop preparing new ones."""
+        with self._lock:
+            self._closed = True
+            standby_driver, self._standby_driver = self._standby_driver, None
+        if standby_driver is not None:
+            self.release(standby_driver)
+
+    def _launch_standby(self):
+        try:
+            web_driver = self.launch()
+        except Exception as e:
+            utils.log_warning(f"熱備瀏覽器啟動失敗: {e}")
+            return
+        with self._lock:
+            if not self._closed:
+                self._standby_driver = web_driver
+                return
+        self.release(web_driver)
+
+    def _take_standby(self):
+        # A standby that is still launching is closer to ready than a new cold launch
+        thread = self._standby_thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout=60)
+        with self._lock:
+            web_driver, self._standby_driver = self._standby_driver, None
+        if web_driver is not None and not is_alive(web_driver):
+            utils.log_warning("熱備瀏覽器已失效，改為冷啟動")
+            self.release(web_driver)
+            return None
+        return web_driver
@@ -0,0 +1,133 @@
+"""This python file will solve the login captcha with confidence scoring.
+
+Each captcha is decoded from a few preprocessed variants of the image. The
+answers vote for ranked candidates, and the share of votes of the best valid
+candidate is its confidence, so a doubtful captcha can be refreshed instead
+of costing a failed login round trip.
+"""
+import io
+from collections import Counter, namedtuple
+
+from PIL import Image, ImageFilter, ImageOps
+
+import utilities as utils
+
+DEFAULT_LENGTH = 4
+DEFAULT_CHARSET = "0123456789"
+
+# Letters the model commonly returns for digits
+DIGIT_LOOKALIKES = str.maketrans({'o': '0', 'O': '0', 'D': '0', 'Q': '0', 'l': '1', 'i': '1', 'I': '1', 'L': '1',
+                                  '|': '1', 'z': '2', 'Z': '2', 's': '5', 'S': '5', 'b': '6', 'G': '6', 'T': '7',
+                                  'B': '8', 'g': '9', 'q': '9'})
+
+CaptchaSolution = namedtuple('CaptchaSolution', ['answer', 'confidence', 'candidates'])
+
+
+def _to_png(image):
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def _variant_original(image):
+    return image
+
+
+def _variant_autocontrast(image):
+    return ImageOps.autocontrast(ImageOps.grayscale(image))
+
+
+def _variant_binarized(image):
+    gray = ImageOps.autocontrast(ImageOps.grayscale(image))
+    return gray.point(lambda value: 255 if value > 140 else 0)
+
+
+def _variant_denoised(image):
+    return ImageOps.grayscale(image).filter(ImageFilter.MedianFilter(3))
+
+
+def _variant_upscaled(image):
+    return ImageOps.grayscale(image).resize((image.width * 2, image.height * 2), Image.BICUBIC)
+
+
+# Ordered cheapest and most accurate first, so the early exit usually happens after two variants
+VARIANTS = (_variant_original, _variant_autocontrast, _variant_binarized, _variant_denoised, _variant_upscaled)
+
+
+def normalize_answer(answer, charset=DEFAULT_CHARSET):
+    """Clean up an OCR answer for the captcha charset.
+
+    :param answer: Raw OCR answer.
+    :param charset: Characters the captcha can contain.
+    :rtype: str
+    """
+    answer = answer.strip().replace(' ', '')
+    if charset.isdigit():
+        answer = answer.translate(DIGIT_LOOKALIKES)
+    return answer
+
+
+def is_valid_answer(answer, length=DEFAULT_LENGTH, charset=DEFAULT_CHARSET):
+    """Check the answer's length and charset before submitting it.
+
+    :rtype: bool
+    """
+    return len(answer) == length and all(char in charset for char in answer)
+
+
+def _merge_by_position(answers, length):
+    """Majority vote each character position over answers of the right length."""
+    same_length = [answer for answer in answers if len(answer) == length]
+    if not same_length:
+        return None
+    return ''.join(Counter(chars).most_common(1)[0][0] for chars in zip(*same_length))
+
+
+def solve_captcha(image, length=DEFAULT_LENGTH, charset=DEFAULT_CHARSET, variants=VARIANTS):
+    """Solve captcha into ranked candidates.
+
+    Candidates are scored by the share of variants that decoded them. Invalid
+    answers are kept for the log but get zero confidence.
+
+    :param image: Captcha image as PNG bytes.
+    :param length: Expected answer length.
+    :param charset: Characters the captcha can contain.
+    :param variants: Preprocessing functions to decode.
+    :rtype: CaptchaSolution
+    """
+    ocr = utils.get_ocr_engine()
+    source = Image.open(io.BytesIO(image))
+    source.load()
+    votes = Counter()
+    answers = []
+    for index, variant in enumerate(variants):
+        data = image if variant is _variant_original else _to_png(variant(source))
+        try:
+            answer = normalize_answer(ocr.classification(data), charset)
+        except Exception as e:
+            utils.log_warning(f"驗證碼前處理 {variant.__name__} 辨識失敗: {e}")
+            continue
+        answers.append(answer)
+        votes[answer] += 1
+        # Stop early once the remaining variants can't change the winner
+        ranked = votes.most_common(2)
+        remaining = len(variants) - index - 1
+        runner_up = ranked[1][1] if len(ranked) > 1 else 0
+        if is_valid_answer(ranked[0][0], length, charset) and (
+                (ranked[0][1] >= 2 and runner_up == 0) or ranked[0][1] > runner_up + remaining):
+            break
+
+    merged = _merge_by_position(answers, length)
+    if merged and merged not in votes:
+        # The per-position merge is a guess from partial agreement, score it below a single full vote
+        votes[merged] += 0.5
+
+    total = len(answers) or 1
+    candidates = []
+    for answer, count in votes.most_common():
+        score = count / total if is_valid_answer(answer, length, charset) else 0.0
+        candidates.append((answer, score))
+    candidates.sort(key=lambda candidate: candidate[1], reverse=True)
+    if not candidates:
+        return CaptchaSolution('', 0.0, [])
+    return CaptchaSolution(candidates[0][0], candidates[0][1], candidates)
@@ -0,0 +1,168 @@
+"""This python file will handle the local course catalog index.
+
+The catalog is loaded from a course listing export (CSV, or JSON saved from
+the course search site) and maps each course code to its time slots, credits
+and section. It lets the bot drop invalid codes and flag conflicting courses
+before spending any live query on them.
+"""
+import csv
+import json
+import re
+from collections import namedtuple
+from os.path import exists, splitext
+
+import utilities as utils
+
+Course = namedtuple('Course', ['code', 'name', 'credits', 'section', 'slots'])
+
+# Accepted column names of each field, the first match wins
+FIELD_ALIASES = {
+    'code': ('code', 'class_id', '選課代號', '代號', 'scr_selcode'),
+    'name': ('name', '課程名稱', '科目名稱', 'sub_name'),
+    'credits': ('credits', '學分', '學分數', 'scr_credit'),
+    'section': ('section', '班級', '開課班級', 'cls_name'),
+    'time': ('time', '上課時間', '時間', '上課時間/上課教室/授課教師', 'scr_period'),
+}
+
+WEEKDAYS = '一二三四五六日'
+SLOT_PATTERN = re.compile(r"[(（]\s*([一二三四五六日])\s*[)）]\s*(\d{1,2})(?:\s*-\s*(\d{1,2}))?")
+
+
+def parse_slots(text):
+    """Parse class time like '(二)03-04 資電234 (四)02' into time slots.
+
+    :param text: Class time text.
+    :return: Frozenset of (weekday, period), weekday 1 is Monday.
+    """
+    slots = set()
+    for day, start, end in SLOT_PATTERN.findall(text or ''):
+        weekday = WEEKDAYS.index(day) + 1
+        for period in range(int(start), int(end or start) + 1):
+            slots.add((weekday, period))
+    return frozenset(slots)
+
+
+def _field(row, name):
+    for alias in FIELD_ALIASES[name]:
+        if alias in row and row[alias] not in (None, ''):
+            return str(row[alias]).strip()
+    return ''
+
+
+def json_rows(data):
+    """Get the course rows of a JSON course listing.
+
+    :param data: Decoded JSON, a list of rows or a wrapper of it.
+    :rtype: list
+    """
+    # The course search site wraps results like {"d": "{\"items\": [...]}"}
+    if isinstance(data, dict) and isinstance(data.get('d'), str):
+        data = json.loads(data['d'])
+    if isinstance(data, dict):
+        data = data.get('items') or data.get('courses') or []
+    return data
+
+
+def _load_rows(path):
+    """Load raw rows of the export file."""
+    if splitext(path)[1].lower() == '.json':
+        with open(path, 'r', encoding='utf8') as f:
+            return json_rows(json.load(f))
+    with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+        return list(csv.DictReader(f))
+
+
+def load_catalog(path):
+    """Load the course catalog export.
+
+    :param path: Path of the CSV or JSON export.
+    :return: Dict of course code to Course.
+    """
+    catalog = {}
+    for row in _load_rows(path):
+        code = _field(row, 'code')
+        if not code:
+            continue
+        try:
+            credits = float(_field(row, 'credits') or 0)
+        except ValueError:
+            credits = 0.0
+        catalog[code] = Course(code, _field(row, 'name'), credits, _field(row, 'section'),
+                               parse_slots(_field(row, 'time')))
+    return catalog
+
+
+def preflight(class_ids, catalog, max_credits=None, drop_conflicts=False, groups=None):
+    """Check class ids against the catalog before polling.
+
+    Invalid codes and courses with more credits than max_credits are dropped.
+    Courses that conflict with an earlier one in class_ids are flagged, or
+    dropped when drop_conflicts is set, since the earlier one has priority.
+    Alternatives of one group are never added together, so they may share
+    a time slot, and only the largest of them counts toward max_credits.
+
+    :param class_ids: Class ids in priority order.
+    :param catalog: Dict from load_catalog.
+    :param max_credits: Credits still allowed to add, None for no limit.
+    :param drop_conflicts: Drop conflicting courses instead of only flagging them.
+    :param groups: Dict of class id to alternative group name.
+    :return: (kept class ids, list of (class id, reason)).
+    """
+    groups = groups or {}
+    kept = []
+    issues = []
+    for class_id in class_ids:
+        course = catalog.get(class_id)
+        if course is None:
+            issues.append((class_id, "課程代碼不存在於課程清單"))
+            continue
+        if max_credits is not None and course.credits > max_credits:
+            issues.append((class_id, f"學分 {course.credits:g} 超過可加選學分 {max_credits:g} (超修)"))
+            continue
+        group = groups.get(class_id)
+        conflicts = [other for other in kept
+                     if catalog[other].slots & course.slots and (group is None or groups.get(other) != group)]
+        if conflicts:
+            issues.append((class_id, f"與 {', '.join(conflicts)} 衝堂"))
+            if drop_conflicts:
+                continue
+        kept.append(class_id)
+
+    if max_credits is not None:
+        # Each course alone, or the largest course of each alternative group
+        credits = {}
+        for class_id in kept:
+            key = ('group', groups[class_id]) if class_id in groups else ('course', class_id)
+            credits[key] = max(credits.get(key, 0.0), catalog[class_id].credits)
+        total = sum(credits.values())
+        if total > max_credits:
+            issues.append(('*', f"全部加選共 {total:g} 學分，超過可加選學分 {max_credits:g}，後面的課程可能會超修"))
+    return kept, issues
+
+
+def check_class_ids(config):
+    """Run the pre-flight check configured by catalog_file.
+
+    :param config: Config dict from utilities.read_config.
+    :return: Class ids worth polling.
+    """
+    class_ids = config.get('class_ids')
+    path = config.get('catalog_file')
+    if not path:
+        return class_ids
+    if not exists(path):
+        utils.log_warning(f"找不到課程清單檔案 {path}，略過預先檢查")
+        return class_ids
+
+    catalog = load_catalog(path)
+    utils.log_info(f"課程清單載入完成，共 {len(catalog)} 門課程")
+    kept, issues = preflight(class_ids, catalog, config.get('max_credits'), config.get('catalog_drop_conflicts'),
+                             config.get('class_groups'))
+    for class_id, reason in issues:
+        action = "移除" if class_id != '*' and class_id not in kept else "注意"
+        utils.log_warning(f"預先檢查{action}: 課程 {class_id} {reason}")
+        print(f"預先檢查{action}: 課程 {class_id} {reason}")
+    for class_id in kept:
+        course = catalog[class_id]
+        utils.log_info(f"課程 {class_id} {course.name} {course.section} {course.credits:g} 學分")
+    return kept
@@ -0,0 +1,128 @@
+"""This python file will time the start of enrollment against the server clock.
+
+The offset between our clock and the server clock is estimated from the HTTP
+Date headers. Each response bounds the offset to a one second window, shifted
+by when the request was sent and answered, and intersecting the windows of
+several samples taken at different sub-second phases narrows it down.
+"""
+import random
+import time
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+
+import requests
+
+import utilities as utils
+
+START_AT_FORMATS = ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y/%m/%d %H:%M:%S', '%Y/%m/%d %H:%M')
+
+
+def parse_start_at(value):
+    """Parse the start_at setting in local time.
+
+    :param value: datetime, or text like '2025-09-04 12:30:00'.
+    :return: Epoch seconds, or None if not set.
+    """
+    if not value:
+        return None
+    if isinstance(value, datetime):
+        return value.timestamp()
+    for start_at_format in START_AT_FORMATS:
+        try:
+            return datetime.strptime(str(value).strip(), start_at_format).timestamp()
+        except ValueError:
+            continue
+    raise ValueError(f"無法解析 start_at: {value}")
+
+
+def estimate_clock_offset(url, samples=8, timeout=5):
+    """Estimate server clock minus local clock from HTTP Date headers.
+
+    :param url: URL of the server.
+    :param samples: Number of requests to send.
+    :param timeout: Timeout of each request in seconds.
+    :return: (offset in seconds, uncertainty in seconds).
+    """
+    low, high = float('-inf'), float('inf')
+    midpoints = []
+    with requests.Session() as session:
+        for _ in range(samples):
+            sent = time.time()
+            response = session.head(url, timeout=timeout, allow_redirects=False)
+            received = time.time()
+            date = response.headers.get('Date')
+            if not date:
+                continue
+            server_second = parsedate_to_datetime(date).timestamp()
+            # The server stamped a time in [server_second, server_second + 1) somewhere between sent and received
+            low = max(low, server_second - received)
+            high = min(high, server_second + 1 - sent)
+            midpoints.append(server_second + 0.5 - (sent + received) / 2)
+            # Sample at a different sub-second phase each time
+            time.sleep(random.uniform(0.1, 0.4))
+
+    if not midpoints:
+        raise ValueError("伺服器回應沒有 Date 標頭，無法估計時間差")
+    if low <= high:
+        return (low + high) / 2, (high - low) / 2
+    # Inconsistent windows, e.g. the network delay changed a lot, fall back to the median
+    midpoints.sort()
+    return midpoints[len(midpoints) // 2], 0.5
+
+
+class StartSchedule:
+    """Wait for the enrollment window to open, then fire a tight burst."""
+
+    def __init__(self, start_at, offset, burst_seconds=10):
+        """Create the schedule.
+
+        :param start_at: Server time to start at, in epoch seconds.
+        :param offset: Server clock minus local clock in seconds.
+        :param burst_seconds: How long to query without pacing after the start.
+        """
+        self.start_at = start_at
+        self.offset = offset
+        self.burst_seconds = burst_seconds
+
+    @property
+    def fire_at(self):
+        """Local time to fire at, in epoch seconds."""
+        return self.start_at - self.offset
+
+    def in_burst(self):
+        """Check if we are in the burst window right after the start.
+
+        :rtype: bool
+        """
+        return self.fire_at <= time.time() < self.fire_at + self.burst_seconds
+
+    def wait(self, keep_alive=None, keep_alive_interval=60):
+        """Sleep until the start, keeping the session alive meanwhile.
+
+        :param keep_alive: Cheap request keeping the login session alive.
+        :param keep_alive_interval: Seconds between keep-alive requests.
+        :return: Fire error in seconds, positive if we fired late.
+        """
+        last_keep_alive = time.monotonic()
+        while True:
+            remaining = self.fire_at - time.time()
+            if remaining <= 0.05:
+                break
+            if keep_alive and remaining > 5 and time.monotonic() - last_keep_alive >= keep_alive_interval:
+                try:
+                    keep_alive()
+                    utils.log_info(f"保持登入狀態，距離開始還有 {remaining:.0f} 秒")
+                except Exception as e:
+                    utils.log_warning(f"保持登入狀態的請求失敗: {e}")
+                last_keep_alive = time.monotonic()
+                continue
+            # Sleep coarsely, waking up before the next keep-alive and the final stretch
+            time.sleep(min(remaining - 0.05, keep_alive_interval, 1.0 if remaining < 5 else 5.0))
+        # Spin for the last few milliseconds, sleep is not that precise
+        while time.time() < self.fire_at:
+            pass
+
+        error = time.time() - self.fire_at
+        fired_at = datetime.fromtimestamp(time.time() + self.offset).strftime('%H:%M:%S.%f')[:-3]
+        utils.log_info(f"開始搶課！伺服器時間 {fired_at}，誤差 {error * 1000:+.1f} 毫秒")
+        return error
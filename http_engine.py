@@ -0,0 +1,467 @@
+"""This python file will handle the browserless HTTP enrollment engine.
+
+The engine replays the ASP.NET WebForms postbacks of the course page over a
+pooled keep-alive HTTP session, so Selenium is only needed for login.
+"""
+import json
+import re
+from html.parser import HTMLParser
+from urllib.parse import urljoin
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import utilities as utils
+
+TAB_CONTAINER_ID = "ctl00_MainContent_TabContainer1"
+TAB_ID = "ctl00_MainContent_TabContainer1_tabSelected"
+SUB_ID_INPUT_ID = "ctl00_MainContent_TabContainer1_tabSelected_tbSubID"
+GRID_ID = "ctl00_MainContent_TabContainer1_tabSelected_gvToAdd"
+MSG_BLOCK_ID = "ctl00_MainContent_TabContainer1_tabSelected_lblMsgBlock"
+LOGIN_USERNAME_ID = "ctl00_Login1_UserName"
+
+# Column of the first data row in gvToAdd, same as td[N] in the Selenium XPath
+ADD_BUTTON_COLUMN = 1
+QUERY_BUTTON_COLUMN = 8
+
+VOID_TAGS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'param', 'source',
+             'track', 'wbr'}
+SKIPPED_INPUT_TYPES = {'submit', 'image', 'button', 'reset', 'file'}
+
+PRM_INIT_PATTERN = re.compile(r"PageRequestManager\._initialize\(\s*'([^']+)'\s*,\s*'[^']*'\s*,\s*\[([^\]]*)\]")
+POSTBACK_PATTERN = re.compile(r"""(?:__doPostBack\(|WebForm_PostBackOptions\()\s*['"]([^'"]+)['"]\s*,\s*['"]([^'"]*)['"]""")
+ALERT_PATTERN = re.compile(r"""alert\(\s*(['"])((?:\\.|(?!\1).)*)\1\s*\)""", re.S)
+JS_ESCAPE_PATTERN = re.compile(r"\\(u[0-9a-fA-F]{4}|x[0-9a-fA-F]{2}|.)", re.S)
+JS_SIMPLE_ESCAPES = {'n': '\n', 'r': '\r', 't': '\t', 'b': '\b', 'f': '\f', 'v': '\v', '0': '\0'}
+
+
+class PostbackError(Exception):
+    """Raised when the server rejects or fails a postback."""
+
+
+class SessionExpiredError(PostbackError):
+    """Raised when the server sends us back to the login page."""
+
+
+class Node:
+    """Minimal HTML element node used to keep the page state between postbacks."""
+
+    def __init__(self, tag, attrs=None, parent=None):
+        self.tag = tag
+        self.attrs = dict(attrs or {})
+        self.children = []
+        self.parent = parent
+
+    def iter(self, tag=None):
+        """Iterate over descendant elements in document order.
+
+        :param tag: Only yield elements with this tag name.
+        """
+        for child in self.children:
+            if isinstance(child, Node):
+                if tag is None or child.tag == tag:
+                    yield child
+                yield from child.iter(tag)
+
+    def find(self, element_id):
+        """Find descendant element by id.
+
+        :param element_id: Client id of element.
+        :return: Node or None if not found.
+        """
+        for node in self.iter():
+            if node.attrs.get('id') == element_id:
+                return node
+        return None
+
+    def text(self):
+        """Get text content of element.
+
+        :rtype: str
+        """
+        parts = []
+        for child in self.children:
+            parts.append(child.text() if isinstance(child, Node) else child)
+        return ''.join(parts)
+
+    def ancestor_ids(self):
+        """Get ids of all ancestor elements, nearest first.
+
+        :rtype: list
+        """
+        ids = []
+        node = self.parent
+        while node is not None:
+            if node.attrs.get('id'):
+                ids.append(node.attrs['id'])
+            node = node.parent
+        return ids
+
+
+class _TreeBuilder(HTMLParser):
+    """Build a Node tree from HTML, tolerating the usual unclosed tags."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.root = Node('#document')
+        self._current = self.root
+
+    def handle_starttag(self, tag, attrs):
+        node = Node(tag, [(k, v if v is not None else '') for k, v in attrs], self._current)
+        self._current.children.append(node)
+        if tag not in VOID_TAGS:
+            self._current = node
+
+    def handle_startendtag(self, tag, attrs):
+        node = Node(tag, [(k, v if v is not None else '') for k, v in attrs], self._current)
+        self._current.children.append(node)
+
+    def handle_endtag(self, tag):
+        node = self._current
+        while node is not None and node.tag != tag:
+            node = node.parent
+        if node is not None and node.parent is not None:
+            self._current = node.parent
+
+    def handle_data(self, data):
+        self._current.children.append(data)
+
+
+def parse_html(html):
+    """Parse HTML into a Node tree.
+
+    :param html: HTML source.
+    :rtype: Node
+    """
+    builder = _TreeBuilder()
+    builder.feed(html)
+    builder.close()
+    return builder.root
+
+
+def parse_delta_response(text):
+    """Parse an UpdatePanel async postback (delta) response.
+
+    The format is a sequence of ``length|type|id|content|`` records.
+
+    :param text: Response body.
+    :return: List of (type, id, content) tuples.
+    """
+    records = []
+    index = 0
+    while index < len(text):
+        try:
+            length_end = text.index('|', index)
+            length = int(text[index:length_end])
+            type_end = text.index('|', length_end + 1)
+            id_end = text.index('|', type_end + 1)
+        except ValueError as e:
+            raise PostbackError(f"無法解析非同步回應: {text[index:index + 80]!r}") from e
+        content_start = id_end + 1
+        content_end = content_start + length
+        if text[content_end:content_end + 1] != '|':
+            raise PostbackError(f"非同步回應長度不符: {text[index:index + 80]!r}")
+        records.append((text[length_end + 1:type_end], text[type_end + 1:id_end], text[content_start:content_end]))
+        index = content_end + 1
+    return records
+
+
+def _unescape_js(value):
+    """Unescape a JavaScript string literal body."""
+
+    def replace(match):
+        escape = match.group(1)
+        if escape[0] in 'ux' and len(escape) > 1:
+            return chr(int(escape[1:], 16))
+        return JS_SIMPLE_ESCAPES.get(escape, escape)
+
+    return JS_ESCAPE_PATTERN.sub(replace, value)
+
+
+def extract_alerts(script):
+    """Extract the messages of alert() calls in a script.
+
+    :param script: JavaScript source.
+    :rtype: list
+    """
+    return [_unescape_js(match.group(2)) for match in ALERT_PATTERN.finditer(script)]
+
+
+def get_grid_inputs(root, grid_id, row=2):
+    """Get the inputs of a GridView row by column, like ``tbody/tr[row]/td[N]/input``.
+
+    :param root: Node tree of the page.
+    :param grid_id: Client id of the GridView table.
+    :param row: 1-based row number, header row included.
+    :return: Dict of 1-based column number to list of input Nodes.
+    """
+    grid = root.find(grid_id)
+    if grid is None:
+        return {}
+    rows = [tr for tr in grid.iter('tr') if _nearest(tr, 'table') is grid]
+    if len(rows) < row:
+        return {}
+    columns = {}
+    cells = [td for td in rows[row - 1].children if isinstance(td, Node) and td.tag in ('td', 'th')]
+    for number, cell in enumerate(cells, start=1):
+        columns[number] = list(cell.iter('input'))
+    return columns
+
+
+def _nearest(node, tag):
+    """Get the nearest ancestor with tag."""
+    parent = node.parent
+    while parent is not None and parent.tag != tag:
+        parent = parent.parent
+    return parent
+
+
+class HttpEnrollmentEngine:
+    """Enrollment engine that talks to the course page over plain HTTP."""
+
+    def __init__(self, page_url, cookies=(), user_agent=None, timeout=10, pool_size=4):
+        """Create the engine.
+
+        :param page_url: URL of the course page after login.
+        :param cookies: Cookies in Selenium ``get_cookies()`` format.
+        :param user_agent: User agent to send, should match the login browser.
+        :param timeout: Timeout of each request in seconds.
+        :param pool_size: Max keep-alive connections per host.
+        """
+        self.page_url = page_url
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        if user_agent:
+            self.session.headers['User-Agent'] = user_agent
+        for cookie in cookies:
+            self.session.cookies.set(cookie['name'], cookie['value'], domain=cookie.get('domain', ''),
+                                     path=cookie.get('path', '/'))
+        self._root = None
+        self._form = None
+        self._action_url = page_url
+        self._script_manager = None
+        self._update_panels = {}
+
+    @classmethod
+    def from_driver(cls, driver, **kwargs):
+        """Create the engine from a logged in Selenium driver.
+
+        :param driver: Selenium WebDriver instance on the course page.
+        :rtype: HttpEnrollmentEngine
+        """
+        user_agent = driver.execute_script("return navigator.userAgent")
+        return cls(driver.current_url, driver.get_cookies(), user_agent=user_agent, **kwargs)
+
+    def close(self):
+        """Close the pooled connections."""
+        self.session.close()
+
+    def open(self, reload=False):
+        """Load the course page and select the enrollment tab.
+
+        :param reload: Fetch the page again even if it is already loaded.
+        """
+        if self._root is not None and not reload:
+            return
+        utils.log_info("正在載入加退選頁面 (HTTP)...")
+        response = self.session.get(self.page_url, timeout=self.timeout)
+        response.raise_for_status()
+        self._load_page(response.text, response.url)
+        self._select_tab()
+
+    def recover(self):
+        """Reload the page state after an error."""
+        self.open(reload=True)
+
+    def keep_alive(self):
+        """Reload the page to keep the login session alive."""
+        self.open(reload=True)
+
+    def query_quota(self, class_id):
+        """Query remaining positions of class.
+
+        :param class_id: Class id to query.
+        :return: Quota alert text, or None if no alert came back.
+        """
+        self.open()
+        alerts = self._postback_grid_button(class_id, QUERY_BUTTON_COLUMN)
+        return alerts[-1] if alerts else None
+
+    def add_class(self, class_id):
+        """Add class and read the result message.
+
+        :param class_id: Class id to add.
+        :return: Result text of lblMsgBlock, or None if not found.
+        """
+        self.open()
+        alerts = self._postback_grid_button(class_id, ADD_BUTTON_COLUMN)
+        message_block = self._root.find(MSG_BLOCK_ID)
+        if message_block is None:
+            return alerts[-1] if alerts else None
+        span = next(message_block.iter('span'), None)
+        return (span or message_block).text().strip()
+
+    def _postback_grid_button(self, class_id, column):
+        """Fill in the class id and post back a button of gvToAdd.
+
+        :return: Alert messages from the response.
+        """
+        sub_id_input = self._root.find(SUB_ID_INPUT_ID)
+        if sub_id_input is None or not sub_id_input.attrs.get('name'):
+            raise PostbackError("找不到課程代碼輸入框")
+        sub_id_input.attrs['value'] = class_id
+        buttons = get_grid_inputs(self._root, GRID_ID).get(column)
+        if not buttons:
+            raise PostbackError(f"找不到 gvToAdd 第 {column} 欄的按鈕")
+        return self._postback(buttons[0])
+
+    def _load_page(self, html, url):
+        """Replace the page state with a full page response."""
+        if self._is_login_page(html):
+            raise SessionExpiredError("登入狀態已失效，伺服器導回登入頁面")
+        self._root = parse_html(html)
+        self._form = next(self._root.iter('form'), self._root)
+        self._action_url = urljoin(url, self._form.attrs.get('action') or url)
+        self._script_manager = None
+        self._update_panels = {}
+        match = PRM_INIT_PATTERN.search(html)
+        if match:
+            self._script_manager = match.group(1)
+            # Unique ids are prefixed with the ChildrenAsTriggers flag, like 'tctl00$MainContent$UpdatePanel1'.
+            # ASP.NET 4 follows each of them with the client id, older versions list unique ids only.
+            entries = re.findall(r"'([^']*)'", match.group(2))
+            paired = (len(entries) % 2 == 0 and all(entry[:1] in ('t', 'f') for entry in entries[::2])
+                      and all('$' not in entry for entry in entries[1::2]))
+            if paired:
+                panels = [(unique_id[1:], client_id) for unique_id, client_id in zip(entries[::2], entries[1::2])]
+            else:
+                panels = [(entry[1:], entry[1:].replace('$', '_')) for entry in entries if entry[:1] in ('t', 'f')]
+            for unique_id, client_id in panels:
+                if unique_id:
+                    self._update_panels[client_id] = unique_id
+
+    def _select_tab(self):
+        """Point the TabContainer client state at the enrollment tab, like clicking its header."""
+        state_input = self._root.find(f"{TAB_CONTAINER_ID}_ClientState")
+        body = self._root.find(f"{TAB_CONTAINER_ID}_body")
+        if state_input is None or body is None:
+            return
+        tab_ids = [child.attrs.get('id') for child in body.children if isinstance(child, Node) and child.tag == 'div']
+        if TAB_ID not in tab_ids:
+            return
+        try:
+            state = json.loads(state_input.attrs.get('value') or '{}')
+        except ValueError:
+            return
+        state['ActiveTabIndex'] = tab_ids.index(TAB_ID)
+        state_input.attrs['value'] = json.dumps(state, separators=(',', ':'))
+
+    @staticmethod
+    def _is_login_page(html):
+        return LOGIN_USERNAME_ID in html
+
+    def _collect_fields(self):
+        """Collect the form fields the browser would submit.
+
+        :rtype: dict
+        """
+        fields = {}
+        for node in self._form.iter():
+            name = node.attrs.get('name')
+            if not name or 'disabled' in node.attrs:
+                continue
+            if node.tag == 'input':
+                input_type = node.attrs.get('type', 'text').lower()
+                if input_type in SKIPPED_INPUT_TYPES:
+                    continue
+                if input_type in ('radio', 'checkbox'):
+                    if 'checked' in node.attrs:
+                        fields[name] = node.attrs.get('value', 'on')
+                    continue
+                fields[name] = node.attrs.get('value', '')
+            elif node.tag == 'select':
+                options = list(node.iter('option'))
+                selected = [option for option in options if 'selected' in option.attrs] or options[:1]
+                if selected:
+                    fields[name] = selected[0].attrs.get('value', selected[0].text())
+            elif node.tag == 'textarea':
+                fields[name] = node.text()
+        return fields
+
+    def _postback(self, button):
+        """Post back the form as if button was clicked.
+
+        :param button: Input Node of the button.
+        :return: Alert messages from the response.
+        """
+        fields = self._collect_fields()
+        fields.setdefault('__EVENTTARGET', '')
+        fields.setdefault('__EVENTARGUMENT', '')
+        name = button.attrs.get('name', '')
+        input_type = button.attrs.get('type', 'submit').lower()
+        match = POSTBACK_PATTERN.search(button.attrs.get('onclick', ''))
+        if input_type == 'image':
+            fields[f'{name}.x'] = '1'
+            fields[f'{name}.y'] = '1'
+            target = name
+        elif match and (input_type == 'button' or not name):
+            fields['__EVENTTARGET'] = match.group(1)
+            fields['__EVENTARGUMENT'] = match.group(2)
+            target = match.group(1)
+        else:
+            fields[name] = button.attrs.get('value', '')
+            target = name
+
+        headers = {'Referer': self.page_url}
+        if self._script_manager:
+            panel = next((self._update_panels[panel_id] for panel_id in button.ancestor_ids()
+                          if panel_id in self._update_panels), self._script_manager)
+            fields[self._script_manager] = f'{panel}|{target}'
+            fields['__ASYNCPOST'] = 'true'
+            headers['X-MicrosoftAjax'] = 'Delta=true'
+            headers['X-Requested-With'] = 'XMLHttpRequest'
+
+        response = self.session.post(self._action_url, data=fields, headers=headers, timeout=self.timeout)
+        response.raise_for_status()
+        if self._script_manager and response.text[:1].isdigit():
+            return self._apply_delta(response.text)
+        self._load_page(response.text, response.url)
+        return [alert for script in self._root.iter('script') for alert in extract_alerts(script.text())]
+
+    def _apply_delta(self, text):
+        """Apply an async postback response to the page state.
+
+        :return: Alert messages from the response.
+        """
+        alerts = []
+        for record_type, record_id, content in parse_delta_response(text):
+            if record_type == 'updatePanel':
+                panel = self._root.find(record_id)
+                if panel is None:
+                    continue
+                fragment = parse_html(content)
+                panel.children = fragment.children
+                for child in panel.children:
+                    if isinstance(child, Node):
+                        child.parent = panel
+            elif record_type == 'hiddenField':
+                self._set_hidden_field(record_id, content)
+            elif record_type in ('scriptStartupBlock', 'scriptBlock', 'onSubmit'):
+                alerts.extend(extract_alerts(content))
+            elif record_type == 'pageRedirect':
+                raise SessionExpiredError(f"伺服器要求重新導向: {content}")
+            elif record_type == 'error':
+                raise PostbackError(f"伺服器回傳錯誤: {content}")
+        return alerts
+
+    def _set_hidden_field(self, name, value):
+        """Set hidden field like __VIEWSTATE, adding it to the form if missing."""
+        for node in self._form.iter('input'):
+            if node.attrs.get('name') == name:
+                node.attrs['value'] = value
+                return
+        node = Node('input', {'type': 'hidden', 'name': name, 'id': name, 'value': value}, self._form)
+        self._form.children.append(node)
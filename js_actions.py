@@ -0,0 +1,176 @@
+"""This python file will run a group of page actions in one WebDriver round trip.
+
+Each driver_send_keys / driver_click / driver_get_text call locates the
+element with a fresh wait, reads its type, then clears, types or clicks it,
+every step a WebDriver command of its own. A BatchExecutor compiles a group
+like "set tbSubID, click query, wait for the postback, read lblMsgBlock"
+into one async script. Elements are cached in the page by locator and
+located again once the UpdatePanel has replaced them.
+"""
+from collections import namedtuple
+
+from selenium.common.exceptions import UnexpectedAlertPresentException, WebDriverException
+from selenium.webdriver.common.by import By
+
+import page_sync
+import utilities as utils
+
+BatchResult = namedtuple('BatchResult', ['values', 'alert'])
+
+JS_LOCATOR_TYPES = {By.ID: 'id', By.XPATH: 'xpath', By.CSS_SELECTOR: 'css'}
+
+EXECUTOR_SCRIPT = """
+var steps = arguments[0], after = arguments[1], wait = arguments[2], timeoutMs = arguments[3], quietMs = arguments[4];
+var done = arguments[arguments.length - 1];
+var cache = window.__autoclassElements || (window.__autoclassElements = {});
+var deadline = Date.now() + timeoutMs;
+var values = [];
+
+function locate(locator) {
+    var key = locator.by + ':' + locator.value;
+    var element = cache[key];
+    // An element replaced by the UpdatePanel is detached from the document
+    if (element && element.isConnected) {
+        return element;
+    }
+    if (locator.by === 'id') {
+        element = document.getElementById(locator.value);
+    } else if (locator.by === 'xpath') {
+        element = document.evaluate(locator.value, document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null)
+            .singleNodeValue;
+    } else {
+        element = document.querySelector(locator.value);
+    }
+    if (element) {
+        cache[key] = element;
+    } else {
+        delete cache[key];
+    }
+    return element;
+}
+
+function perform(step, element) {
+    if (step.op === 'set') {
+        element.focus();
+        element.value = step.value;
+        element.dispatchEvent(new Event('input', {bubbles: true}));
+        element.dispatchEvent(new Event('change', {bubbles: true}));
+        return true;
+    }
+    if (step.op === 'click') {
+        element.click();
+        return true;
+    }
+    return element.innerText;
+}
+
+function runSteps(list, index, next) {
+    if (index >= list.length) {
+        next();
+        return;
+    }
+    var element = locate(list[index].locator);
+    if (!element) {
+        if (Date.now() > deadline) {
+            done({error: 'Element not found: ' + list[index].locator.value, values: values, alerts: []});
+            return;
+        }
+        setTimeout(function () { runSteps(list, index, next); }, 50);
+        return;
+    }
+    values.push(perform(list[index], element));
+    runSteps(list, index + 1, next);
+}
+
+function waitForReady(next) {
+    (function () {
+        %s
+    }).call(null, Math.max(deadline - Date.now(), 0), quietMs, next);
+}
+
+runSteps(steps, 0, function () {
+    if (!wait) {
+        done({values: values, alerts: []});
+        return;
+    }
+    waitForReady(function (result) {
+        runSteps(after, 0, function () {
+            done({values: values, alerts: result.alerts, ready: result.ready});
+        });
+    });
+});
+""" % page_sync.WAIT_SCRIPT
+
+
+class BatchActionError(Exception):
+    """An element of the batch wasn't found in time."""
+
+
+def set_value(locator, value):
+    """Step that sets the value of an input, like send_keys after clear."""
+    return {'op': 'set', 'locator': to_js_locator(locator), 'value': value}
+
+
+def click(locator):
+    """Step that clicks an element."""
+    return {'op': 'click', 'locator': to_js_locator(locator)}
+
+
+def get_text(locator):
+    """Step that reads the rendered text of an element."""
+    return {'op': 'text', 'locator': to_js_locator(locator)}
+
+
+def to_js_locator(locator):
+    """Convert a Selenium (By, value) locator for the executor script.
+
+    :rtype: dict
+    """
+    by, value = locator
+    if by not in JS_LOCATOR_TYPES:
+        raise ValueError(f"Unsupported locator for batched actions: {by}")
+    return {'by': JS_LOCATOR_TYPES[by], 'value': value}
+
+
+class BatchExecutor:
+    """Run groups of steps in one execute_async_script call."""
+
+    def __init__(self, web_driver, timeout=10):
+        """Create the executor.
+
+        :param web_driver: Driver to use.
+        :param timeout: Max seconds for a batch, element lookups and the postback wait together.
+        """
+        self.web_driver = web_driver
+        self.timeout = timeout
+
+    def run(self, steps, after=(), wait=False):
+        """Run the steps, optionally wait for the postback they started, then run the after steps.
+
+        :param steps: Steps made by set_value, click and get_text.
+        :param after: Steps to run once the postback has finished, only used with wait.
+        :param wait: Wait like page_sync.wait_for_ready after the steps.
+        :return: BatchResult of the step values (text of get_text steps) and the alert raised meanwhile.
+        """
+        try:
+            result = self.web_driver.execute_async_script(EXECUTOR_SCRIPT, list(steps), list(after), wait,
+                                                          int(self.timeout * 1000), page_sync.QUIET_MS)
+        except UnexpectedAlertPresentException as e:
+            # A native alert interrupted the batch after the steps that raised it
+            alert_text = page_sync.alert_text_of(e)
+            utils.log_debug(f"Alert detected: {alert_text}")
+            return BatchResult([], alert_text)
+        except WebDriverException as e:
+            if wait:
+                # A full postback replaced the document under the script, it is loaded by now
+                utils.log_warning(f"批次操作等待頁面更新時發生錯誤: {e.msg}")
+                return BatchResult([], None)
+            raise
+        if result.get('error'):
+            raise BatchActionError(result['error'])
+        if wait and not result.get('ready'):
+            utils.log_warning(f"等待頁面更新逾時 ({self.timeout} 秒)")
+        alerts = result.get('alerts')
+        if alerts:
+            utils.log_debug(f"Alert detected: {alerts[-1]}")
+        return BatchResult(result['values'], alerts[-1] if alerts else None)
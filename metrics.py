@@ -0,0 +1,183 @@
+"""This python file will collect latency metrics of the hot phases.
+
+Every phase (browser launch, page load, captcha, OCR, login, seat query,
+alert wait, add click, round) records its latency, per course where it
+applies. The metrics can be scraped in Prometheus text format from a local
+HTTP endpoint, and are written as a JSON summary every now and then.
+"""
+import json
+import math
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import utilities as utils
+
+QUANTILES = (50, 95, 99)
+# Latest samples kept per series for the quantiles, count and sum cover every sample
+MAX_SAMPLES = 2048
+
+
+def percentile(samples, q):
+    """Get the q-th percentile of samples with nearest-rank.
+
+    :param samples: List of numbers.
+    :param q: Percentile between 0 and 100.
+    :rtype: float
+    """
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    # Smallest rank covering q percent of the samples, multiplied first so 7 * 100 / 100 stays exactly 7
+    rank = max(1, math.ceil(q * len(ordered) / 100))
+    return ordered[rank - 1]
+
+
+class Metrics:
+    """Latency series keyed by (phase, course), safe to use across threads."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def observe(self, phase, seconds, course=None):
+        """Record one latency sample.
+
+        :param phase: Phase name, like 'seat_query'.
+        :param seconds: Latency in seconds.
+        :param course: Class id the sample belongs to, if any.
+        """
+        with self._lock:
+            series = self._series.get((phase, course))
+            if series is None:
+                series = self._series[(phase, course)] = {'count': 0, 'sum': 0.0, 'samples': deque(maxlen=MAX_SAMPLES)}
+            series['count'] += 1
+            series['sum'] += seconds
+            series['samples'].append(seconds)
+
+    @contextmanager
+    def timer(self, phase, course=None):
+        """Time the block as one sample of phase, failed attempts included."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(phase, time.perf_counter() - start, course)
+
+    def snapshot(self):
+        """Summarize every series.
+
+        :return: List of dicts with phase, course, count, sum and p50/p95/p99 in seconds.
+        """
+        with self._lock:
+            series = [(key, value['count'], value['sum'], list(value['samples'])) for key, value in self._series.items()]
+        summary = []
+        for (phase, course), count, total, samples in sorted(series, key=lambda item: (item[0][0], item[0][1] or '')):
+            entry = {'phase': phase, 'course': course, 'count': count, 'sum': round(total, 6)}
+            for q in QUANTILES:
+                entry[f'p{q}'] = round(percentile(samples, q), 6)
+            summary.append(entry)
+        return summary
+
+    def to_prometheus(self):
+        """Render the metrics in Prometheus text exposition format.
+
+        :rtype: str
+        """
+        lines = ['# HELP autoclass_phase_seconds Latency of the FCU AutoClass phases.',
+                 '# TYPE autoclass_phase_seconds summary']
+        for entry in self.snapshot():
+            labels = f'phase="{entry["phase"]}"'
+            if entry['course'] is not None:
+                labels += f',course="{entry["course"]}"'
+            for q in QUANTILES:
+                lines.append(f'autoclass_phase_seconds{{{labels},quantile="{q / 100}"}} {entry[f"p{q}"]}')
+            lines.append(f'autoclass_phase_seconds_sum{{{labels}}} {entry["sum"]}')
+            lines.append(f'autoclass_phase_seconds_count{{{labels}}} {entry["count"]}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Metrics()
+
+
+def observe(phase, seconds, course=None):
+    """Record one latency sample in the shared registry."""
+    registry.observe(phase, seconds, course)
+
+
+def timer(phase, course=None):
+    """Time a block in the shared registry."""
+    return registry.timer(phase, course)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    """Serve /metrics (Prometheus text) and /metrics.json."""
+
+    def do_GET(self):
+        if self.path == '/metrics':
+            body = registry.to_prometheus().encode('utf8')
+            content_type = 'text/plain; version=0.0.4; charset=utf-8'
+        elif self.path == '/metrics.json':
+            body = json.dumps(registry.snapshot(), ensure_ascii=False).encode('utf8')
+            content_type = 'application/json'
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes would flood the application log
+        pass
+
+
+def serve(port, host='127.0.0.1'):
+    """Serve the metrics over HTTP in a background thread.
+
+    :param port: Port to listen on.
+    :param host: Address to bind, local only by default.
+    :rtype: ThreadingHTTPServer
+    """
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    utils.log_info(f"效能指標服務已啟動: http://{host}:{server.server_address[1]}/metrics")
+    return server
+
+
+def write_summary(path):
+    """Write the JSON summary, replacing the previous one atomically.
+
+    :param path: Summary file path.
+    """
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w', encoding='utf8') as f:
+        json.dump({'updated_at': time.strftime('%Y-%m-%d %H:%M:%S'), 'phases': registry.snapshot()}, f,
+                  ensure_ascii=False, indent=2)
+    os.replace(temp_path, path)
+
+
+def start_summary_writer(path, interval=60):
+    """Write the JSON summary every interval seconds in a background thread.
+
+    :param path: Summary file path.
+    :param interval: Seconds between writes.
+    :return: The writer thread.
+    """
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                write_summary(path)
+            except OSError as e:
+                utils.log_warning(f"寫入效能指標摘要失敗: {e}")
+
+    thread = threading.Thread(target=run, name="metrics-summary", daemon=True)
+    thread.start()
+    return thread
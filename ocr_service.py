@@ -0,0 +1,320 @@
+"""This python file will share one OCR model among the bot instances of a host.
+
+Every bot process loads its own copy of the ddddocr ONNX model, so a host
+running many instances holds many copies in memory and pays the model load
+in each of them. The OCR service loads the model once and answers captcha
+requests over a Unix domain socket:
+
+    python ocr_service.py [--socket /tmp/fcu-autoclass-ocr.sock]
+
+Each connection thread only queues its images. One inference thread takes
+every queued image at once as a batch and decodes them back to back, so
+concurrent requests don't fight over the CPU cores of the ONNX runtime.
+Bots set ocr_socket in config.yml and fall back to in-process OCR whenever
+the service can't be reached.
+"""
+import argparse
+import json
+import os
+import queue
+import signal
+import socket
+import stat
+import struct
+import sys
+import threading
+import time
+
+import utilities as utils
+
+DEFAULT_SOCKET = '/tmp/fcu-autoclass-ocr.sock'
+HEADER = struct.Struct('>I')
+# A captcha screenshot is a few KB, anything larger is a broken client
+MAX_FRAME_SIZE = 4 * 1024 * 1024
+
+
+def is_supported():
+    """Check the platform has Unix domain sockets.
+
+    :rtype: bool
+    """
+    return hasattr(socket, 'AF_UNIX')
+
+
+def send_frame(sock, payload):
+    """Send one length-prefixed frame.
+
+    :param sock: Connected socket.
+    :param payload: Bytes to send.
+    """
+    sock.sendall(HEADER.pack(len(payload)) + payload)
+
+
+def _recv_exact(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(size)
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def recv_frame(sock):
+    """Receive one length-prefixed frame.
+
+    :param sock: Connected socket.
+    :return: Payload bytes, or None when the peer closed the connection.
+    :raises ValueError: When the frame is larger than MAX_FRAME_SIZE.
+    """
+    header = _recv_exact(sock, HEADER.size)
+    if header is None:
+        return None
+    size, = HEADER.unpack(header)
+    if size > MAX_FRAME_SIZE:
+        raise ValueError(f"Frame of {size} bytes is too large")
+    return _recv_exact(sock, size)
+
+
+class _Job:
+    """One image waiting for the inference thread."""
+
+    def __init__(self, image):
+        self.image = image
+        self.answer = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class OcrServer:
+    """Answer captcha images from many clients with one OCR engine."""
+
+    def __init__(self, socket_path=DEFAULT_SOCKET, engine=None, max_batch=32):
+        """Create the server, the model is loaded when it starts serving.
+
+        :param socket_path: Path of the Unix domain socket.
+        :param engine: OCR engine with a classification(bytes) method, default to the in-process engine.
+        :param max_batch: Max images the inference thread takes at once.
+        """
+        self.socket_path = socket_path
+        self.engine = engine
+        self.max_batch = max_batch
+        self.requests = 0
+        self.batches = 0
+        self.largest_batch = 0
+        self._jobs = queue.Queue()
+        self._listener = None
+        self._closed = threading.Event()
+
+    def _bind(self):
+        if os.path.exists(self.socket_path):
+            # A socket file left by a crashed service can be replaced, a live service can't
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.socket_path)
+                raise RuntimeError(f"OCR service is already running on {self.socket_path}")
+            except (ConnectionRefusedError, FileNotFoundError):
+                os.unlink(self.socket_path)
+            finally:
+                probe.close()
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(self.socket_path)
+        # Only the bots of the same user may send captchas
+        os.chmod(self.socket_path, stat.S_IRUSR | stat.S_IWUSR)
+        listener.listen(64)
+        return listener
+
+    def serve_forever(self, ready=None):
+        """Load the model, bind the socket and serve until close() is called.
+
+        :param ready: Event set once the service accepts requests.
+        """
+        if self.engine is None:
+            self.engine = utils.get_local_ocr_engine()
+        self._listener = self._bind()
+        threading.Thread(target=self._infer_loop, name="ocr-infer", daemon=True).start()
+        utils.log_info(f"OCR 服務已啟動: {self.socket_path}")
+        if ready is not None:
+            ready.set()
+        try:
+            while not self._closed.is_set():
+                try:
+                    conn, _ = self._listener.accept()
+                except OSError:
+                    break
+                threading.Thread(target=self._handle, args=(conn,), name="ocr-client", daemon=True).start()
+        finally:
+            self.close()
+
+    def close(self):
+        """Stop accepting requests and remove the socket file."""
+        if self._closed.is_set():
+            return
+        self._closed.set()
+        if self._listener is not None:
+            try:
+                # Wakes the accept() blocked in the serving thread
+                self._listener.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self._listener.close()
+        try:
+            os.unlink(self.socket_path)
+        except OSError:
+            pass
+        utils.log_info(f"OCR 服務已停止，共 {self.requests} 個請求，{self.batches} 批，最大批次 {self.largest_batch}")
+
+    def _handle(self, conn):
+        """Serve the requests of one client connection in order."""
+        with conn:
+            while True:
+                try:
+                    image = recv_frame(conn)
+                except (OSError, ValueError) as e:
+                    utils.log_warning(f"OCR 服務讀取請求失敗: {e}")
+                    return
+                if image is None:
+                    return
+                job = _Job(image)
+                self._jobs.put(job)
+                job.done.wait()
+                reply = {'answer': job.answer} if job.error is None else {'error': job.error}
+                try:
+                    send_frame(conn, json.dumps(reply).encode('utf8'))
+                except OSError:
+                    return
+
+    def _infer_loop(self):
+        """Take every queued image as one batch and decode them back to back."""
+        while True:
+            batch = [self._jobs.get()]
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._jobs.get_nowait())
+                except queue.Empty:
+                    break
+            self.batches += 1
+            self.requests += len(batch)
+            self.largest_batch = max(self.largest_batch, len(batch))
+            for job in batch:
+                try:
+                    job.answer = self.engine.classification(job.image)
+                except Exception as e:
+                    job.error = str(e)
+                job.done.set()
+
+
+class OcrClient:
+    """Drop-in OCR engine that sends the images to the OCR service.
+
+    Each thread keeps its own connection. When the service can't be reached
+    the image is decoded by the fallback engine, and the service is tried
+    again after retry_after seconds.
+    """
+
+    def __init__(self, socket_path=DEFAULT_SOCKET, fallback=None, timeout=5, retry_after=30):
+        """Create the client.
+
+        :param socket_path: Path of the service socket.
+        :param fallback: Called to get the in-process engine when the service is down.
+        :param timeout: Socket timeout of each request in seconds.
+        :param retry_after: Seconds to use the fallback before trying the service again.
+        """
+        self.socket_path = socket_path
+        self.fallback = fallback
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self._local = threading.local()
+        self._down_until = 0.0
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            conn.settimeout(self.timeout)
+            try:
+                conn.connect(self.socket_path)
+            except OSError:
+                conn.close()
+                raise
+            self._local.conn = conn
+        return conn
+
+    def _drop_connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def ping(self):
+        """Check the service accepts connections.
+
+        :rtype: bool
+        """
+        try:
+            self._connection()
+            return True
+        except OSError:
+            return False
+
+    def remote_classification(self, image):
+        """Decode the image on the service only.
+
+        :param image: Captcha image as PNG bytes.
+        :rtype: str
+        :raises OSError: When the service can't be reached.
+        :raises RuntimeError: When the service failed to decode the image.
+        """
+        try:
+            conn = self._connection()
+            send_frame(conn, bytes(image))
+            payload = recv_frame(conn)
+        except (OSError, ValueError):
+            self._drop_connection()
+            raise
+        if payload is None:
+            self._drop_connection()
+            raise ConnectionResetError("OCR service closed the connection")
+        reply = json.loads(payload)
+        if 'error' in reply:
+            raise RuntimeError(reply['error'])
+        return reply['answer']
+
+    def classification(self, image):
+        """Decode the image on the service, or in process when it is down.
+
+        :param image: Captcha image as PNG bytes.
+        :rtype: str
+        """
+        if time.monotonic() >= self._down_until:
+            try:
+                return self.remote_classification(image)
+            except OSError as e:
+                if self.fallback is None:
+                    raise
+                self._down_until = time.monotonic() + self.retry_after
+                utils.log_warning(f"無法連線 OCR 服務 ({e})，改用本機 OCR，{self.retry_after} 秒後重試")
+        return self.fallback().classification(image)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shared OCR service of FCU AutoClass")
+    parser.add_argument('--socket', default=DEFAULT_SOCKET, help="path of the Unix domain socket")
+    parser.add_argument('--max-batch', type=int, default=32, help="max images decoded per batch")
+    parser.add_argument('--log-dir', default='./logs')
+    args = parser.parse_args()
+    if not is_supported():
+        sys.exit("Unix domain sockets aren't supported on this platform.")
+
+    utils.setup_logger(log_dir=args.log_dir)
+    server = OcrServer(args.socket, max_batch=args.max_batch)
+    signal.signal(signal.SIGTERM, lambda signum, frame: server.close())
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+"""This python file will tell what an enrollment message means and remember the settled courses across restarts.
+
+The quota alerts and lblMsgBlock results fall into three kinds:
+
+- success: the course is added.
+- transient: no seat right now, taken by someone else, or an unknown
+  message. The course is worth polling again.
+- permanent: already enrolled, a time conflict (衝堂), over the credit
+  limit (超修), a closed or unknown course. Polling it again only wastes
+  the request budget, so the course is evicted with the reason.
+
+Added and evicted courses are checkpointed in .cache/progress.json, so a
+restart resumes with only the courses still worth polling. Course codes are
+reused every term, so the checkpoint only applies to the same account,
+course site and class list, and each course expires after
+PROGRESS_MAX_AGE_DAYS.
+"""
+import json
+import os
+import threading
+import time
+from collections import namedtuple
+
+import utilities as utils
+
+SUCCESS = 'success'
+TRANSIENT = 'transient'
+PERMANENT = 'permanent'
+
+Outcome = namedtuple('Outcome', ['kind', 'reason', 'message'])
+
+SUCCESS_KEYWORDS = ('加選成功',)
+# Checked before the permanent reasons, a full course must never be evicted
+SEAT_TAKEN_KEYWORDS = ('名額已滿', '額滿', '人數已滿')
+# Messages only listing what might be wrong, like '請確認是否已加選或衝堂', prove nothing
+HEDGE_KEYWORDS = ('請確認', '是否')
+# Whole phrases, checked in order, the first reason with a phrase in the message wins
+PERMANENT_PHRASES = (
+    ('enrolled', ('已選過此課程', '已加選此課程', '已修過此課程', '重複加選')),
+    ('conflict', ('衝堂',)),
+    ('credits', ('超修', '超過學分上限', '已達學分上限')),
+    ('closed', ('停開', '停止開課', '課程已關閉', '本課程不開放')),
+    ('not_found', ('查無此課程',)),
+)
+REASON_TEXT = {
+    'enrolled': '已加選過',
+    'conflict': '衝堂',
+    'credits': '超修',
+    'closed': '課程停開或不開放加選',
+    'not_found': '查無此課程',
+    'alternative': '已加選同組的備選課程',
+}
+
+PROGRESS_FILE = './.cache/progress.json'
+# Longer than an enrollment period, shorter than the break before the next term
+PROGRESS_MAX_AGE_DAYS = 30
+
+
+def classify(message):
+    """Classify a quota alert or add result message.
+
+    :param message: Message text, None or empty if the page showed none.
+    :rtype: Outcome
+    """
+    message = (message or '').strip()
+    if not message:
+        return Outcome(TRANSIENT, 'no_message', message)
+    if any(keyword in message for keyword in SUCCESS_KEYWORDS) and '失敗' not in message:
+        return Outcome(SUCCESS, 'added', message)
+    if any(keyword in message for keyword in SEAT_TAKEN_KEYWORDS):
+        return Outcome(TRANSIENT, 'seat_taken', message)
+    if any(keyword in message for keyword in HEDGE_KEYWORDS):
+        return Outcome(TRANSIENT, 'unknown', message)
+    for reason, phrases in PERMANENT_PHRASES:
+        if any(phrase in message for phrase in phrases):
+            return Outcome(PERMANENT, reason, message)
+    return Outcome(TRANSIENT, 'unknown', message)
+
+
+def describe(outcome):
+    """Get the reason of an outcome for the log.
+
+    :rtype: str
+    """
+    return REASON_TEXT.get(outcome.reason, outcome.reason)
+
+
+class ProgressCheckpoint:
+    """Record the added and evicted courses of a run in a file, safe to use across threads."""
+
+    def __init__(self, username, course_url, class_ids, path=PROGRESS_FILE, max_age_days=PROGRESS_MAX_AGE_DAYS):
+        """Create the checkpoint and load the progress saved by the last run with the same settings.
+
+        :param username: Account the progress belongs to.
+        :param course_url: Course site the progress belongs to.
+        :param class_ids: Configured class ids, a new class list starts over.
+        :param path: Path of the checkpoint file.
+        :param max_age_days: Days a settled course is remembered.
+        """
+        self.username = username
+        self.scope = {'course_url': course_url, 'class_ids': sorted(class_ids)}
+        self.path = path
+        self.max_age = max_age_days * 86400
+        self.settled = {}
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            utils.log_warning(f"讀取加選進度失敗，從頭開始: {e}")
+            return
+        if data.get('username') != self.username:
+            utils.log_info("加選進度屬於其他帳號，從頭開始")
+            return
+        if data.get('scope') != self.scope:
+            utils.log_info("選課網址或課程清單與上次執行不同，加選進度從頭開始")
+            return
+        now = time.time()
+        for class_id, record in data.get('courses', {}).items():
+            if now - record.get('saved_at', 0) > self.max_age:
+                utils.log_info(f"課程 {class_id} 的加選進度已超過 {self.max_age / 86400:.0f} 天，重新輪詢")
+                continue
+            self.settled[class_id] = record
+
+    def _save(self):
+        """Write the file atomically, a crash mid-write keeps the previous checkpoint."""
+        temp_path = f"{self.path}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(temp_path, 'w', encoding='utf8') as f:
+                json.dump({'username': self.username, 'scope': self.scope, 'courses': self.settled}, f,
+                          ensure_ascii=False, indent=2)
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            utils.log_warning(f"儲存加選進度失敗: {e}")
+
+    def resume(self, class_ids, scheduler=None):
+        """Drop the courses settled by the last run.
+
+        :param class_ids: Class ids of the config.
+        :param scheduler: priority.PriorityScheduler to drop the alternatives of the added courses with.
+        :return: Class ids still worth polling.
+        """
+        remaining = list(class_ids)
+        with self._lock:
+            settled = dict(self.settled)
+        skipped = []
+        for class_id, record in settled.items():
+            if class_id not in remaining:
+                continue
+            remaining.remove(class_id)
+            saved_at = time.strftime('%Y-%m-%d %H:%M', time.localtime(record['saved_at']))
+            if record['kind'] == SUCCESS:
+                skipped.append(class_id)
+                utils.log_info(f"略過課程 {class_id}: 已於 {saved_at} 加選成功")
+                if scheduler:
+                    skipped.extend(scheduler.drop_alternatives(remaining, class_id))
+            else:
+                skipped.append(class_id)
+                utils.log_info(f"略過課程 {class_id}: {saved_at} 判定無法加選 "
+                               f"({REASON_TEXT.get(record['reason'], record['reason'])}: {record['message']})")
+        if skipped:
+            utils.log_info(f"依上次執行的加選進度略過 {len(skipped)} 門課程: {', '.join(skipped)}，"
+                           f"刪除 {self.path} 可重新輪詢")
+        return remaining
+
+    def record(self, class_id, outcome):
+        """Save the outcome of a course settled for good.
+
+        :param class_id: Class id added or evicted.
+        :param outcome: Outcome of kind SUCCESS or PERMANENT.
+        """
+        with self._lock:
+            self.settled[class_id] = {'kind': outcome.kind, 'reason': outcome.reason, 'message': outcome.message,
+                                      'saved_at': time.time()}
+            self._save()
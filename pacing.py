@@ -0,0 +1,93 @@
+"""This python file will pace the seat queries by how fast the server answers.
+
+Each polling session has an AimdPacer: the interval between queries shrinks
+additively while the server is responsive and grows multiplicatively when
+queries get slow, fail or time out waiting for the quota alert. A shared
+RateLimiter caps the total query rate of all sessions.
+"""
+import threading
+import time
+
+import utilities as utils
+
+
+class RateLimiter:
+    """Space query starts at least 1 / max_rate seconds apart, across threads."""
+
+    def __init__(self, max_rate=None):
+        """Create the limiter.
+
+        :param max_rate: Max queries per second, None or 0 for no limit.
+        """
+        self.spacing = 1 / max_rate if max_rate else 0.0
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Wait for the next free slot."""
+        if not self.spacing:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.spacing
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class AimdPacer:
+    """Adaptive interval between queries (additive increase, multiplicative decrease of the rate)."""
+
+    def __init__(self, min_interval=0.2, max_interval=5.0, initial_interval=0.8, step=0.05, backoff=2.0,
+                 target_latency=1.5, max_rate=None, limiter=None, smoothing=0.3):
+        """Create the pacer.
+
+        :param min_interval: Shortest interval between query starts in seconds.
+        :param max_interval: Longest interval between query starts in seconds.
+        :param initial_interval: Interval to start with.
+        :param step: Seconds taken off the interval after each healthy query.
+        :param backoff: Factor the interval is multiplied by when the server degrades.
+        :param target_latency: Smoothed query latency in seconds above which the server counts as degraded.
+        :param max_rate: Max queries per second, only used when limiter isn't given.
+        :param limiter: Shared RateLimiter.
+        :param smoothing: Weight of the newest latency in the moving average.
+        """
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = min(max(initial_interval, min_interval), max_interval)
+        self.step = step
+        self.backoff = backoff
+        self.target_latency = target_latency
+        self.limiter = limiter or RateLimiter(max_rate)
+        self.smoothing = smoothing
+        self.latency = None
+        self._last_start = 0.0
+
+    def wait(self):
+        """Wait until the next query may start."""
+        delay = self._last_start + self.interval - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        self.limiter.acquire()
+        self._last_start = time.monotonic()
+
+    def record(self, latency, ok=True):
+        """Record the outcome of a query and adapt the interval.
+
+        :param latency: Seconds the query took.
+        :param ok: False if the query failed or its alert timed out.
+        """
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency = self.smoothing * latency + (1 - self.smoothing) * self.latency
+
+        if ok and self.latency <= self.target_latency:
+            self.interval = max(self.min_interval, self.interval - self.step)
+            return
+
+        previous = self.interval
+        self.interval = min(self.max_interval, self.interval * self.backoff)
+        if self.interval > previous:
+            reason = "查詢失敗或逾時" if not ok else f"平均回應 {self.latency:.2f} 秒"
+            utils.log_warning(f"伺服器回應變差 ({reason})，輪詢間隔放慢至 {self.interval:.2f} 秒")
@@ -0,0 +1,130 @@
+"""This python file will tell when the course page is ready for the next action.
+
+The course page is an ASP.NET UpdatePanel page, every click is a partial
+postback. Instead of sleeping a guessed delay after each click, we ask the
+page's Sys.WebForms.PageRequestManager whether a postback is in flight and
+wait for its endRequest event. Pages without the request manager fall back to
+waiting until the DOM stops changing.
+"""
+import re
+import threading
+
+from selenium.common.exceptions import UnexpectedAlertPresentException, WebDriverException
+
+import utilities as utils
+
+# Milliseconds without DOM mutations before a page without the request manager counts as settled
+QUIET_MS = 50
+
+WAIT_SCRIPT = """
+var timeoutMs = arguments[0], quietMs = arguments[1], done = arguments[arguments.length - 1];
+var finished = false;
+function finish(result) {
+    if (!finished) {
+        finished = true;
+        // Hand over the messages caught by the alert hook in the same round trip
+        var alerts = window.__autoclassAlerts;
+        done({ready: result, alerts: alerts ? alerts.splice(0, alerts.length) : []});
+    }
+}
+setTimeout(function () { finish(false); }, timeoutMs);
+
+var prm = window.Sys && Sys.WebForms && Sys.WebForms.PageRequestManager
+    ? Sys.WebForms.PageRequestManager.getInstance() : null;
+if (prm) {
+    if (!prm.get_isInAsyncPostBack()) {
+        finish(true);
+        return;
+    }
+    var onEnd = function () {
+        prm.remove_endRequest(onEnd);
+        // Let the other endRequest handlers and startup scripts run first
+        setTimeout(function () { finish(true); }, 0);
+    };
+    prm.add_endRequest(onEnd);
+    return;
+}
+
+function waitQuiet() {
+    var timer = null;
+    var observer = new MutationObserver(function () { settle(); });
+    function settle() {
+        clearTimeout(timer);
+        timer = setTimeout(function () {
+            observer.disconnect();
+            finish(true);
+        }, quietMs);
+    }
+    observer.observe(document.documentElement, {childList: true, subtree: true, attributes: true, characterData: true});
+    settle();
+}
+if (document.readyState === 'complete') {
+    waitQuiet();
+} else {
+    window.addEventListener('load', waitQuiet);
+}
+"""
+
+ALERT_TEXT_PATTERN = re.compile(r"Alert text\s*:\s*(.*?)\}", re.S)
+
+
+def alert_text_of(error):
+    """Get the alert text of an UnexpectedAlertPresentException."""
+    if error.alert_text:
+        return error.alert_text
+    # chromedriver only puts the text in the message
+    match = ALERT_TEXT_PATTERN.search(error.msg or '')
+    return match.group(1).strip() if match else ''
+
+
+def wait_for_ready(web_driver, timeout=10):
+    """Wait until the partial postback in flight, if any, has finished.
+
+    An alert raised by the postback, like the quota alert, interrupts the
+    wait. The alert is handled by the driver and its text returned. With the
+    alert_hook installed the alert is read from the page instead.
+
+    :param web_driver: Driver to use.
+    :param timeout: Max seconds to wait.
+    :return: Text of the alert that interrupted the wait, or None.
+    """
+    try:
+        result = web_driver.execute_async_script(WAIT_SCRIPT, int(timeout * 1000), QUIET_MS)
+    except UnexpectedAlertPresentException as e:
+        alert_text = alert_text_of(e)
+        utils.log_debug(f"Alert detected: {alert_text}")
+        return alert_text
+    except WebDriverException as e:
+        # A full postback replaced the document under the script, it is loaded by now
+        utils.log_warning(f"等待頁面更新時發生錯誤: {e.msg}")
+        return None
+    if not result['ready']:
+        utils.log_warning(f"等待頁面更新逾時 ({timeout} 秒)")
+    if result['alerts']:
+        utils.log_debug(f"Alert detected: {result['alerts'][-1]}")
+        return result['alerts'][-1]
+    return None
+
+
+class CycleStats:
+    """Running average of the time taken to check one course, across threads."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        """Record the time one course check took.
+
+        :param seconds: Seconds from the query to the result.
+        """
+        with self._lock:
+            self.count += 1
+            self.total += seconds
+
+    @property
+    def average(self):
+        """Average seconds per course check, 0 before any check."""
+        with self._lock:
+            return self.total / self.count if self.count else 0.0
@@ -0,0 +1,90 @@
+"""This python file will share the polling rounds among the watched courses by priority.
+
+Every course has a weight: the heaviest courses are queried every round,
+a course of half the weight every other round, and so on, so the limited
+query budget goes to the courses that matter most. Courses can also be put
+in an alternative group, once one course of the group is added the others
+are dropped.
+"""
+import threading
+
+import utilities as utils
+
+
+class PriorityScheduler:
+    """Pick the courses to query each round in proportion to their weight, safe to use across threads."""
+
+    def __init__(self, weights=None, groups=None):
+        """Create the scheduler.
+
+        :param weights: Dict of class id to weight, courses not in it weigh 1.
+        :param groups: Dict of class id to alternative group name.
+        """
+        self.weights = dict(weights or {})
+        self.groups = dict(groups or {})
+        self._credits = {}
+        self._lock = threading.Lock()
+
+    def weight(self, class_id):
+        """Get the weight of a course.
+
+        :rtype: float
+        """
+        return self.weights.get(class_id, 1.0)
+
+    def due(self, class_ids, all_class_ids=None):
+        """Get the courses to query this round, heaviest first.
+
+        Each round a course earns its weight divided by the heaviest weight
+        of all the courses still to join, and is queried whenever it has
+        earned a full query.
+
+        :param class_ids: Class ids to pick from, like the shard of a polling session.
+        :param all_class_ids: Every class id still to join, default to class_ids.
+        :rtype: list
+        """
+        if not class_ids:
+            return []
+        top = max(self.weight(class_id) for class_id in (all_class_ids or class_ids))
+        due = []
+        with self._lock:
+            for class_id in class_ids:
+                credit = self._credits.get(class_id, 0.0) + self.weight(class_id) / top
+                if credit >= 1 - 1e-9:
+                    credit -= 1
+                    due.append(class_id)
+                self._credits[class_id] = credit
+        return sorted(due, key=self.weight, reverse=True)
+
+    def alternatives(self, class_id):
+        """Get the other courses of the alternative group of class_id.
+
+        :rtype: list
+        """
+        group = self.groups.get(class_id)
+        if group is None:
+            return []
+        return [other for other, other_group in self.groups.items() if other_group == group and other != class_id]
+
+    def drop_alternatives(self, class_ids, class_id):
+        """Remove the alternatives of an added course from class_ids in place.
+
+        :param class_ids: List of class ids still to join.
+        :param class_id: Class id just added.
+        :return: Class ids dropped.
+        """
+        dropped = [other for other in self.alternatives(class_id) if other in class_ids]
+        for other in dropped:
+            class_ids.remove(other)
+        if dropped:
+            utils.log_info(f"課程 {class_id} 已加選，同組 ({self.groups[class_id]}) 的備選課程不再輪詢: {', '.join(dropped)}")
+        return dropped
+
+
+def from_config(config):
+    """Create the scheduler of the courses setting.
+
+    :param config: Config dict from utilities.read_config.
+    :rtype: PriorityScheduler
+    """
+    return PriorityScheduler(config.get('class_weights'), config.get('class_groups'))
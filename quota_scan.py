@@ -0,0 +1,146 @@
+"""This python file will read the remaining seats of every watched course at once.
+
+Querying a course on the enrollment tab costs a few round trips each, so a
+round grows with the number of watched courses. A course listing page (an
+HTML table, or the JSON of the course search site) shows the seats of many
+courses in one response. It is fetched once per round and parsed in one
+pass, and only the courses showing free seats go through the query and add
+flow.
+"""
+import json
+import re
+
+import requests
+
+import catalog
+import utilities as utils
+from http_engine import Node, parse_html
+
+# Accepted column names of each field, the first match wins
+QUOTA_FIELD_ALIASES = {
+    'code': catalog.FIELD_ALIASES['code'],
+    'remaining': ('remaining', '剩餘名額', '餘額'),
+    'capacity': ('capacity', '開放名額', '名額上限', 'scr_precnt'),
+    'enrolled': ('enrolled', '實收名額', '已選人數', '選課人數', 'scr_acptcnt'),
+    'quota': ('quota', '剩餘名額/開放名額', '名額'),
+}
+QUOTA_PATTERN = re.compile(r"(\d+)\s*/\s*(\d+)")
+
+
+def _field(row, name):
+    for alias in QUOTA_FIELD_ALIASES[name]:
+        if alias in row and row[alias] not in (None, ''):
+            return str(row[alias]).strip()
+    return ''
+
+
+def _to_int(text):
+    match = re.search(r"-?\d+", text)
+    return int(match.group()) if match else None
+
+
+def remaining_seats(row):
+    """Get the remaining seats of a listing row.
+
+    :param row: Dict of column name to value.
+    :return: Remaining seats, or None if the row doesn't tell.
+    """
+    remaining = _to_int(_field(row, 'remaining'))
+    if remaining is not None:
+        return remaining
+    capacity, enrolled = _to_int(_field(row, 'capacity')), _to_int(_field(row, 'enrolled'))
+    if capacity is not None and enrolled is not None:
+        return capacity - enrolled
+    # Only read 'a / b' as remaining / capacity, like the quota alert
+    match = QUOTA_PATTERN.search(_field(row, 'quota'))
+    return int(match.group(1)) if match else None
+
+
+def _table_rows(root):
+    """Turn every table of the page into dicts keyed by its header cells."""
+    rows = []
+    for table in root.iter('table'):
+        header = None
+        for tr in table.iter('tr'):
+            cells = [cell for cell in tr.children if isinstance(cell, Node) and cell.tag in ('td', 'th')]
+            texts = [' '.join(cell.text().split()) for cell in cells]
+            if header is None:
+                if any(text in QUOTA_FIELD_ALIASES['code'] for text in texts):
+                    header = texts
+                continue
+            rows.append(dict(zip(header, texts)))
+    return rows
+
+
+def parse_listing(text):
+    """Parse a course listing in one pass.
+
+    :param text: HTML page with a course table, or JSON of the course search site.
+    :return: Dict of course code to remaining seats.
+    """
+    stripped = text.lstrip()
+    if stripped[:1] in ('{', '['):
+        rows = catalog.json_rows(json.loads(stripped))
+    else:
+        rows = _table_rows(parse_html(text))
+    quotas = {}
+    for row in rows:
+        code = _field(row, 'code')
+        remaining = remaining_seats(row)
+        if code and remaining is not None:
+            quotas[code] = remaining
+    return quotas
+
+
+class QuotaScanner:
+    """Fetch the course listing over a keep-alive HTTP session."""
+
+    def __init__(self, url, body='', cookies=(), user_agent=None, timeout=10):
+        """Create the scanner.
+
+        :param url: URL of the listing page or course search service.
+        :param body: JSON body to POST, empty to GET the URL.
+        :param cookies: Cookies in Selenium ``get_cookies()`` format, for listings behind the login.
+        :param user_agent: User agent to send.
+        :param timeout: Timeout of each request in seconds.
+        """
+        self.url = url
+        self.body = body
+        self.timeout = timeout
+        self.session = requests.Session()
+        if user_agent:
+            self.session.headers['User-Agent'] = user_agent
+        for cookie in cookies:
+            self.session.cookies.set(cookie['name'], cookie['value'], domain=cookie.get('domain', ''),
+                                     path=cookie.get('path', '/'))
+
+    @classmethod
+    def from_driver(cls, url, body, driver, **kwargs):
+        """Create the scanner with the cookies of a logged in Selenium driver.
+
+        :rtype: QuotaScanner
+        """
+        user_agent = driver.execute_script("return navigator.userAgent")
+        return cls(url, body, driver.get_cookies(), user_agent=user_agent, **kwargs)
+
+    def close(self):
+        """Close the pooled connections."""
+        self.session.close()
+
+    def scan(self, class_ids):
+        """Get the remaining seats of the watched courses.
+
+        :param class_ids: Watched class ids.
+        :return: Dict of class id to remaining seats, None for courses missing from the listing.
+        """
+        if self.body:
+            response = self.session.post(self.url, data=self.body.encode('utf8'), timeout=self.timeout,
+                                         headers={'Content-Type': 'application/json; charset=utf-8'})
+        else:
+            response = self.session.get(self.url, timeout=self.timeout)
+        response.raise_for_status()
+        quotas = parse_listing(response.text)
+        missing = [class_id for class_id in class_ids if class_id not in quotas]
+        if missing:
+            utils.log_repeated(('scan_missing', tuple(missing)), f"課程清單頁沒有課程 {', '.join(missing)}，改為逐一查詢")
+        return {class_id: quotas.get(class_id) for class_id in class_ids}
@@ -0,0 +1,113 @@
+"""This python file will keep the logged in session across restarts.
+
+After a successful login the cookies of the course site (ASP.NET session and
+auth cookies) are saved encrypted, with a key derived from the account
+password. A new browser gets them back through DevTools before loading the
+course page, so login is skipped while the server session is still alive.
+"""
+import base64
+import json
+import os
+import time
+from os.path import exists
+
+from cryptography.fernet import Fernet, InvalidToken
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+
+import utilities as utils
+
+SESSION_FILE = './.cache/session.bin'
+SALT_SIZE = 16
+KDF_ITERATIONS = 200_000
+
+_keys = {}
+
+
+def _derive_key(username, password, salt):
+    """Derive the Fernet key of the account, cached since the KDF is slow on purpose."""
+    cache_key = (username, password, salt)
+    if cache_key not in _keys:
+        kdf = PBKDF2HMAC(algorithm=hashes.SHA256(), length=32, salt=salt, iterations=KDF_ITERATIONS)
+        _keys[cache_key] = base64.urlsafe_b64encode(kdf.derive(f"{username}\0{password}".encode('utf8')))
+    return _keys[cache_key]
+
+
+def save_session(cookies, url, username, password):
+    """Save the cookies of a logged in browser.
+
+    :param cookies: Cookies from WebDriver.get_cookies().
+    :param url: Page to load with the cookies, like the course page after login.
+    :param username: Account the cookies belong to.
+    :param password: Password of the account, the encryption key is derived from it.
+    """
+    salt = os.urandom(SALT_SIZE)
+    payload = json.dumps({'username': username, 'url': url, 'saved_at': time.time(), 'cookies': cookies})
+    token = Fernet(_derive_key(username, password, salt)).encrypt(payload.encode('utf8'))
+    try:
+        os.makedirs(os.path.dirname(SESSION_FILE), exist_ok=True)
+        # Only readable by the owner, it still grants access to the account
+        fd = os.open(SESSION_FILE, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(salt + token)
+        utils.log_info(f"已儲存登入狀態 ({len(cookies)} 個 Cookie)")
+    except OSError as e:
+        utils.log_warning(f"儲存登入狀態失敗: {e}")
+
+
+def load_session(username, password):
+    """Load the saved session of the account.
+
+    :return: Dict with url, saved_at and cookies, or None if there is no usable one.
+    """
+    if not exists(SESSION_FILE):
+        return None
+    try:
+        with open(SESSION_FILE, 'rb') as f:
+            data = f.read()
+        salt, token = data[:SALT_SIZE], data[SALT_SIZE:]
+        session = json.loads(Fernet(_derive_key(username, password, salt)).decrypt(token))
+    except (OSError, ValueError, InvalidToken) as e:
+        # Another account, a changed password or a damaged file
+        utils.log_warning(f"無法讀取已儲存的登入狀態，將重新登入: {e.__class__.__name__}")
+        clear_session()
+        return None
+    if session.get('username') != username:
+        clear_session()
+        return None
+    now = time.time()
+    session['cookies'] = [cookie for cookie in session['cookies'] if cookie.get('expiry', now + 1) > now]
+    return session if session['cookies'] else None
+
+
+def clear_session():
+    """Delete the saved session, e.g. after the server expired it."""
+    try:
+        os.remove(SESSION_FILE)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        utils.log_warning(f"刪除已儲存的登入狀態失敗: {e}")
+
+
+def to_cdp_cookie(cookie):
+    """Convert a WebDriver cookie to the Network.setCookies format.
+
+    :rtype: dict
+    """
+    cdp_cookie = {key: cookie[key] for key in ('name', 'value', 'domain', 'path', 'secure', 'httpOnly')
+                  if key in cookie}
+    if 'expiry' in cookie:
+        cdp_cookie['expires'] = cookie['expiry']
+    if cookie.get('sameSite') in ('Strict', 'Lax', 'None'):
+        cdp_cookie['sameSite'] = cookie['sameSite']
+    return cdp_cookie
+
+
+def restore_cookies(web_driver, cookies):
+    """Put the cookies into a browser without loading any page of the site first.
+
+    :param web_driver: Chrome driver.
+    :param cookies: Cookies from load_session.
+    """
+    web_driver.execute_cdp_cmd('Network.setCookies', {'cookies': [to_cdp_cookie(cookie) for cookie in cookies]})
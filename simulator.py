@@ -0,0 +1,641 @@
+"""This python file will simulate the FCU course site locally.
+
+The simulator serves the pages the bot touches with the same element IDs: the
+login form with its captcha, and the course page with the enrollment tab,
+tbSubID, the gvToAdd grid, the quota alert and lblMsgBlock. The course page is
+an UpdatePanel page driven by a small stand-in of the ASP.NET
+PageRequestManager, so both the selenium and the http engine work against it.
+
+Seats open on a schedule and competing bots grab them after a random reaction
+time, so the reaction time of a config can be measured without touching the
+real site. Usage:
+
+    python simulator.py --port 8080 --course 0050:75 --course 0051:60 --open 0050@30+2 --bots 3
+
+Then set ``course_url: 'http://127.0.0.1:8080/'`` in config.yml.
+"""
+import argparse
+import heapq
+import html
+import io
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+SESSION_COOKIE = 'ASP.NET_SessionId'
+SCRIPT_MANAGER = 'ctl00$ScriptManager1'
+UPDATE_PANEL_UNIQUE_ID = 'ctl00$MainContent$TabContainer1$tabSelected$UpdatePanel1'
+UPDATE_PANEL_ID = 'ctl00_MainContent_TabContainer1_tabSelected_UpdatePanel1'
+SUB_ID_NAME = 'ctl00$MainContent$TabContainer1$tabSelected$tbSubID'
+ADD_BUTTON_NAME = 'ctl00$MainContent$TabContainer1$tabSelected$gvToAdd$ctl02$btnAdd'
+QUERY_BUTTON_NAME = 'ctl00$MainContent$TabContainer1$tabSelected$gvToAdd$ctl02$btnQuery'
+LOGOUT_BUTTON_NAME = 'ctl00$btnLogout'
+
+# Stand-in of the ASP.NET AJAX PageRequestManager and the TabContainer, just what the course page uses
+PAGE_SCRIPT = r"""
+var Sys = {WebForms: {PageRequestManager: (function () {
+    var instance = null;
+    function PageRequestManager() {
+        this._request = null;
+        this._endRequestHandlers = [];
+    }
+    PageRequestManager.getInstance = function () {
+        return instance || (instance = new PageRequestManager());
+    };
+    PageRequestManager._initialize = function (scriptManager, formId, panels) {
+        var prm = PageRequestManager.getInstance();
+        prm._scriptManager = scriptManager;
+        prm._form = document.getElementById(formId);
+        prm._panels = [];
+        for (var i = 0; i < panels.length; i += 2) {
+            prm._panels.push({uniqueId: panels[i].substr(1), clientId: panels[i + 1]});
+        }
+        prm._form.addEventListener('click', function (event) {
+            var button = event.target;
+            if (button.tagName === 'INPUT' && button.type === 'submit' && prm._panelOf(button)) {
+                event.preventDefault();
+                prm._post(button.name, button);
+            }
+        });
+    };
+    PageRequestManager.prototype.get_isInAsyncPostBack = function () {
+        return this._request !== null;
+    };
+    PageRequestManager.prototype.add_endRequest = function (handler) {
+        this._endRequestHandlers.push(handler);
+    };
+    PageRequestManager.prototype.remove_endRequest = function (handler) {
+        var index = this._endRequestHandlers.indexOf(handler);
+        if (index >= 0) {
+            this._endRequestHandlers.splice(index, 1);
+        }
+    };
+    PageRequestManager.prototype._panelOf = function (element) {
+        for (var i = 0; i < this._panels.length; i++) {
+            var panel = document.getElementById(this._panels[i].clientId);
+            if (panel && panel.contains(element)) {
+                return this._panels[i];
+            }
+        }
+        return null;
+    };
+    PageRequestManager.prototype._post = function (target, button, argument) {
+        var prm = this;
+        var panel = (button && this._panelOf(button)) || this._panels[0];
+        var data = new URLSearchParams(new FormData(this._form));
+        if (button) {
+            data.set(button.name, button.value);
+        } else {
+            data.set('__EVENTTARGET', target);
+            data.set('__EVENTARGUMENT', argument || '');
+        }
+        data.set(this._scriptManager, panel.uniqueId + '|' + target);
+        data.set('__ASYNCPOST', 'true');
+        var request = new XMLHttpRequest();
+        this._request = request;
+        request.open('POST', this._form.action);
+        request.setRequestHeader('X-MicrosoftAjax', 'Delta=true');
+        request.setRequestHeader('Content-Type', 'application/x-www-form-urlencoded; charset=utf-8');
+        request.onload = function () { prm._onResponse(request.responseText); };
+        request.onerror = function () { prm._endPostBack(); };
+        request.send(data.toString());
+    };
+    PageRequestManager.prototype._onResponse = function (text) {
+        var scripts = [], index = 0;
+        while (index < text.length) {
+            var lengthEnd = text.indexOf('|', index);
+            var length = parseInt(text.substring(index, lengthEnd), 10);
+            var typeEnd = text.indexOf('|', lengthEnd + 1);
+            var idEnd = text.indexOf('|', typeEnd + 1);
+            var type = text.substring(lengthEnd + 1, typeEnd), id = text.substring(typeEnd + 1, idEnd);
+            var content = text.substr(idEnd + 1, length);
+            index = idEnd + 1 + length + 1;
+            if (type === 'updatePanel') {
+                document.getElementById(id).innerHTML = content;
+            } else if (type === 'hiddenField') {
+                var field = this._form.elements[id];
+                if (field) {
+                    field.value = content;
+                }
+            } else if (type === 'scriptStartupBlock') {
+                scripts.push(content);
+            } else if (type === 'pageRedirect') {
+                window.location.href = content;
+                return;
+            }
+        }
+        // Startup scripts run before endRequest, like ASP.NET
+        for (var i = 0; i < scripts.length; i++) {
+            eval(scripts[i]);
+        }
+        this._endPostBack();
+    };
+    PageRequestManager.prototype._endPostBack = function () {
+        this._request = null;
+        var handlers = this._endRequestHandlers.slice();
+        for (var i = 0; i < handlers.length; i++) {
+            handlers[i](this, {});
+        }
+    };
+    return PageRequestManager;
+})()}};
+
+function __doPostBack(target, argument) {
+    Sys.WebForms.PageRequestManager.getInstance()._post(target, null, argument);
+}
+
+function showTab(container, tabId) {
+    var body = document.getElementById(container + '_body');
+    var tabs = body.children, state = document.getElementById(container + '_ClientState');
+    for (var i = 0; i < tabs.length; i++) {
+        var active = tabs[i].id === tabId;
+        tabs[i].style.display = active ? '' : 'none';
+        if (active) {
+            state.value = JSON.stringify({ActiveTabIndex: i, TabEnabledState: [true, true], TabState: [true, true]});
+        }
+    }
+}
+"""
+
+LOGIN_PAGE = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>逢甲大學選課系統 (模擬)</title></head><body>
+<form name="aspnetForm" method="post" action="./" id="aspnetForm">
+<input type="hidden" name="__VIEWSTATE" id="__VIEWSTATE" value="{view_state}" />
+<input type="hidden" name="__EVENTVALIDATION" id="__EVENTVALIDATION" value="{view_state}" />
+<table id="ctl00_Login1_RadioButtonList1"><tr>
+<td><input id="ctl00_Login1_RadioButtonList1_0" type="radio" name="ctl00$Login1$RadioButtonList1" value="0" />
+<label for="ctl00_Login1_RadioButtonList1_0">學生</label></td>
+<td><input id="ctl00_Login1_RadioButtonList1_1" type="radio" name="ctl00$Login1$RadioButtonList1" value="1" />
+<label for="ctl00_Login1_RadioButtonList1_1">教職員</label></td>
+</tr></table>
+<input name="ctl00$Login1$UserName" type="text" id="ctl00_Login1_UserName" />
+<input name="ctl00$Login1$Password" type="password" id="ctl00_Login1_Password" />
+<img id="ctl00_Login1_Image1" src="validateCode.aspx" alt="驗證碼" />
+<input name="ctl00$Login1$vcode" type="text" id="ctl00_Login1_vcode" />
+<input type="submit" name="ctl00$Login1$LoginButton" value="登入" id="ctl00_Login1_LoginButton" />
+<span id="ctl00_Login1_FailureText" style="color:Red;">{failure}</span>
+</form></body></html>"""
+
+COURSE_PAGE = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>逢甲大學選課系統 (模擬)</title>
+<script src="ScriptResource.axd"></script></head><body>
+<form name="aspnetForm" method="post" action="./Main.aspx" id="aspnetForm">
+<input type="hidden" name="__EVENTTARGET" id="__EVENTTARGET" value="" />
+<input type="hidden" name="__EVENTARGUMENT" id="__EVENTARGUMENT" value="" />
+<input type="hidden" name="__VIEWSTATE" id="__VIEWSTATE" value="{view_state}" />
+<input type="hidden" name="__EVENTVALIDATION" id="__EVENTVALIDATION" value="{view_state}" />
+<script>
+Sys.WebForms.PageRequestManager._initialize('{script_manager}', 'aspnetForm', ['t{panel_unique_id}','{panel_id}'], [], [], 90, 'ctl00');
+</script>
+<div>{username} <input type="submit" name="{logout_name}" value="登出" id="ctl00_btnLogout" /></div>
+<div id="ctl00_MainContent_TabContainer1">
+<div id="ctl00_MainContent_TabContainer1_header">
+<span id="__tab_ctl00_MainContent_TabContainer1_tabCourse" onclick="showTab('ctl00_MainContent_TabContainer1', 'ctl00_MainContent_TabContainer1_tabCourse')"><span id="ctl00_MainContent_TabContainer1_tabCourse_Label1">我的課表</span></span>
+<span id="__tab_ctl00_MainContent_TabContainer1_tabSelected" onclick="showTab('ctl00_MainContent_TabContainer1', 'ctl00_MainContent_TabContainer1_tabSelected')"><span id="ctl00_MainContent_TabContainer1_tabSelected_Label3">加退選</span></span>
+</div>
+<div id="ctl00_MainContent_TabContainer1_body">
+<div id="ctl00_MainContent_TabContainer1_tabCourse">{timetable}</div>
+<div id="ctl00_MainContent_TabContainer1_tabSelected" style="display:none;">
+<div id="{panel_id}">{panel}</div>
+</div>
+</div>
+<input type="hidden" name="ctl00_MainContent_TabContainer1_ClientState" id="ctl00_MainContent_TabContainer1_ClientState" value='{{"ActiveTabIndex":0,"TabEnabledState":[true,true],"TabState":[true,true]}}' />
+</div>
+</form></body></html>"""
+
+ENROLLMENT_PANEL = """
+課程代碼 <input name="{sub_id_name}" type="text" value="{class_id}" id="ctl00_MainContent_TabContainer1_tabSelected_tbSubID" />
+<table id="ctl00_MainContent_TabContainer1_tabSelected_gvToAdd"><tbody>
+<tr><th>加選</th><th>選課代號</th><th>科目名稱</th><th>學分</th><th>上課時間</th><th>開課班級</th><th>授課教師</th><th>名額</th></tr>
+<tr><td><input type="submit" name="{add_name}" value="加選" id="ctl00_MainContent_TabContainer1_tabSelected_gvToAdd_ctl02_btnAdd" /></td>
+<td>{class_id}</td><td>模擬課程</td><td>2</td><td>(二)03-04</td><td>模擬班級</td><td>模擬教師</td>
+<td><input type="button" value="查詢名額" onclick="__doPostBack('{query_name}','')" id="ctl00_MainContent_TabContainer1_tabSelected_gvToAdd_ctl02_btnQuery" /></td></tr>
+</tbody></table>
+<span id="ctl00_MainContent_TabContainer1_tabSelected_lblMsgBlock"><span>{message}</span></span>
+"""
+
+
+class SimulatedCourse:
+    """Seats of a simulated course."""
+
+    def __init__(self, code, capacity, enrolled=None):
+        """Create the course.
+
+        :param code: Course code.
+        :param capacity: Open positions.
+        :param enrolled: Enrolled students, default to full.
+        """
+        self.code = code
+        self.capacity = capacity
+        self.enrolled = capacity if enrolled is None else enrolled
+
+    @property
+    def remaining(self):
+        return self.capacity - self.enrolled
+
+
+class CourseSite:
+    """State of the simulated site: courses, seat openings, bots and login sessions."""
+
+    def __init__(self, courses, openings=(), latency=0.05, jitter=0.05, bots=0, bot_reaction=2.0,
+                 any_captcha=True, session_timeout=None):
+        """Create the site.
+
+        :param courses: List of SimulatedCourse.
+        :param openings: List of (seconds after start, course code, seats) when seats are released.
+        :param latency: Base server latency of page requests in seconds.
+        :param jitter: Max random latency added on top in seconds.
+        :param bots: Number of competing bots grabbing released seats.
+        :param bot_reaction: Mean reaction time of the bots in seconds.
+        :param any_captcha: Accept any captcha answer, so OCR accuracy doesn't skew the timing.
+        :param session_timeout: Seconds of inactivity before a login expires, None for never.
+        """
+        self.courses = {course.code: course for course in courses}
+        self.openings = list(openings)
+        self.latency = latency
+        self.jitter = jitter
+        self.bots = bots
+        self.bot_reaction = bot_reaction
+        self.any_captcha = any_captcha
+        self.session_timeout = session_timeout
+        self.sessions = {}
+        self.events = []
+        self.started_at = None
+        self._lock = threading.Lock()
+        self._condition = threading.Condition(self._lock)
+        self._schedule = []
+
+    def start(self):
+        """Start the seat schedule clock."""
+        with self._condition:
+            self.started_at = time.time()
+            for delay, code, seats in self.openings:
+                heapq.heappush(self._schedule, (self.started_at + delay, 'open', code, seats))
+            self._condition.notify()
+        threading.Thread(target=self._run_schedule, name="simulator-schedule", daemon=True).start()
+
+    def _run_schedule(self):
+        with self._condition:
+            while True:
+                if not self._schedule:
+                    self._condition.wait()
+                    continue
+                when, kind, code, seats = self._schedule[0]
+                if when > time.time():
+                    self._condition.wait(when - time.time())
+                    continue
+                heapq.heappop(self._schedule)
+                course = self.courses.get(code)
+                if course is None:
+                    continue
+                if kind == 'open':
+                    course.enrolled = max(0, course.enrolled - seats)
+                    self.events.append((time.time(), 'open', code, 'site'))
+                    for bot in range(self.bots):
+                        reaction = random.expovariate(1 / self.bot_reaction) if self.bot_reaction else 0
+                        heapq.heappush(self._schedule, (time.time() + reaction, 'bot', code, bot))
+                elif kind == 'bot' and course.remaining > 0:
+                    course.enrolled += 1
+                    self.events.append((time.time(), 'add', code, f'bot-{seats}'))
+
+    def delay(self):
+        """Sleep the simulated server latency."""
+        time.sleep(self.latency + random.uniform(0, self.jitter))
+
+    def session(self, session_id):
+        """Get the session by id, creating it if missing.
+
+        :rtype: dict
+        """
+        with self._lock:
+            session = self.sessions.get(session_id)
+            if session is None:
+                session = self.sessions[session_id] = {'captcha': '', 'user': None, 'seen': time.time(),
+                                                       'view_state': 0}
+            if (session['user'] and self.session_timeout
+                    and time.time() - session['seen'] > self.session_timeout):
+                session['user'] = None
+            session['seen'] = time.time()
+            return session
+
+    def query(self, code):
+        """Get the quota alert of a course.
+
+        :rtype: str
+        """
+        with self._lock:
+            course = self.courses.get(code)
+            self.events.append((time.time(), 'query', code, 'user'))
+            if course is None:
+                return "查無此課程代碼"
+            return f"剩餘名額/開放名額：{course.remaining}  /{course.capacity}"
+
+    def listing(self):
+        """Render the course listing page with the seats of every course.
+
+        :rtype: str
+        """
+        with self._lock:
+            self.events.append((time.time(), 'scan', '', 'user'))
+            rows = ''.join(f"<tr><td>{course.code}</td><td>模擬課程 {course.code}</td><td>{course.remaining}</td>"
+                           f"<td>{course.capacity}</td></tr>" for course in self.courses.values())
+        return ("<html><body><table id=\"gvCourse\"><tr><th>選課代號</th><th>科目名稱</th><th>剩餘名額</th>"
+                f"<th>開放名額</th></tr>{rows}</table></body></html>")
+
+    def add(self, code, user):
+        """Add a course for the user.
+
+        :return: Result message of lblMsgBlock.
+        """
+        with self._lock:
+            course = self.courses.get(code)
+            if course is None:
+                return "查無此課程代碼"
+            if any(kind == 'add' and event_code == code and who == user for _, kind, event_code, who in self.events):
+                return "加選失敗：已選過此課程"
+            if course.remaining <= 0:
+                return "加選失敗：名額已滿"
+            course.enrolled += 1
+            self.events.append((time.time(), 'add', code, user))
+            return "加選成功"
+
+    def summary(self):
+        """Summarize the run: reaction time of each user add and the query rate.
+
+        :rtype: dict
+        """
+        with self._lock:
+            events = list(self.events)
+        adds = []
+        for when, kind, code, who in events:
+            if kind != 'add' or who.startswith('bot-'):
+                continue
+            opened = [open_time for open_time, open_kind, open_code, _ in events
+                      if open_kind == 'open' and open_code == code and open_time <= when]
+            adds.append({'course': code, 'at': when - self.started_at,
+                         'reaction': when - opened[-1] if opened else None})
+        queries = [when for when, kind, _, _ in events if kind == 'query']
+        span = queries[-1] - queries[0] if len(queries) > 1 else 0
+        scans = [when for when, kind, _, _ in events if kind == 'scan']
+        scan_span = scans[-1] - scans[0] if len(scans) > 1 else 0
+        return {
+            'adds': adds,
+            'bot_adds': sum(1 for _, kind, _, who in events if kind == 'add' and who.startswith('bot-')),
+            'queries': len(queries),
+            'scans': len(scans),
+            'scans_per_second': (len(scans) - 1) / scan_span if scan_span else 0.0,
+            'queries_per_second': (len(queries) - 1) / span if span else 0.0,
+        }
+
+
+def captcha_png(answer):
+    """Draw a captcha image of answer.
+
+    :rtype: bytes
+    """
+    from PIL import Image, ImageDraw
+
+    image = Image.new('RGB', (50, 18), 'white')
+    draw = ImageDraw.Draw(image)
+    for index, char in enumerate(answer):
+        draw.text((4 + index * 11, 3 + random.randint(-1, 1)), char, fill='black')
+    buffer = io.BytesIO()
+    image.resize((100, 36)).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def delta(*records):
+    """Build an UpdatePanel async postback response from (type, id, content) records.
+
+    :rtype: str
+    """
+    return ''.join(f"{len(content)}|{record_type}|{record_id}|{content}|" for record_type, record_id, content in records)
+
+
+class SimulatorHandler(BaseHTTPRequestHandler):
+    """Serve the simulated pages of the site in server.site."""
+
+    protocol_version = 'HTTP/1.1'
+
+    @property
+    def site(self):
+        return self.server.site
+
+    def log_message(self, format, *args):
+        pass
+
+    def _session(self):
+        cookies = dict(part.strip().split('=', 1) for part in (self.headers.get('Cookie') or '').split(';')
+                       if '=' in part)
+        session_id = cookies.get(SESSION_COOKIE)
+        is_new = session_id is None
+        if is_new:
+            session_id = uuid.uuid4().hex
+        return session_id, self.site.session(session_id), is_new
+
+    def _send(self, status, body=b'', content_type='text/html; charset=utf-8', session_id=None, location=None):
+        if isinstance(body, str):
+            body = body.encode('utf8')
+        self.send_response(status)
+        if session_id:
+            self.send_header('Set-Cookie', f'{SESSION_COOKIE}={session_id}; path=/; HttpOnly')
+        if location:
+            self.send_header('Location', location)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _form(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        fields = parse_qs(self.rfile.read(length).decode('utf8'), keep_blank_values=True)
+        return {name: values[0] for name, values in fields.items()}
+
+    def do_HEAD(self):
+        self._send(200)
+
+    def do_GET(self):
+        session_id, session, is_new = self._session()
+        new_cookie = session_id if is_new else None
+        path = urlsplit(self.path).path
+        if path == '/ScriptResource.axd':
+            self._send(200, PAGE_SCRIPT, 'application/javascript; charset=utf-8', new_cookie)
+        elif path == '/validateCode.aspx':
+            session['captcha'] = ''.join(random.choice('0123456789') for _ in range(4))
+            self._send(200, captcha_png(session['captcha']), 'image/png', new_cookie)
+        elif path == '/Main.aspx':
+            self.site.delay()
+            if not session['user']:
+                self._send(302, session_id=new_cookie, location='/')
+                return
+            self._send(200, self._course_page(session), session_id=new_cookie)
+        elif path == '/CourseList.aspx':
+            self.site.delay()
+            if not session['user']:
+                self._send(302, session_id=new_cookie, location='/')
+                return
+            self._send(200, self.site.listing(), session_id=new_cookie)
+        else:
+            self.site.delay()
+            self._send(200, self._login_page(session), session_id=new_cookie)
+
+    def do_POST(self):
+        session_id, session, is_new = self._session()
+        new_cookie = session_id if is_new else None
+        fields = self._form()
+        self.site.delay()
+        if urlsplit(self.path).path != '/Main.aspx':
+            self._login(session, fields, new_cookie)
+            return
+
+        is_async = self.headers.get('X-MicrosoftAjax') == 'Delta=true'
+        if not session['user']:
+            if is_async:
+                self._send(200, delta(('pageRedirect', '', '/')), 'text/plain; charset=utf-8', new_cookie)
+            else:
+                self._send(302, session_id=new_cookie, location='/')
+            return
+        target = fields.get(SCRIPT_MANAGER, '').split('|')[-1] or fields.get('__EVENTTARGET') or next(
+            (name for name in (ADD_BUTTON_NAME, QUERY_BUTTON_NAME, LOGOUT_BUTTON_NAME) if name in fields), '')
+        if target == LOGOUT_BUTTON_NAME:
+            session['user'] = None
+            self._send(302, session_id=new_cookie, location='/')
+            return
+
+        class_id = fields.get(SUB_ID_NAME, '').strip()
+        message, script = '', ''
+        if target == QUERY_BUTTON_NAME:
+            script = f"alert('{self.site.query(class_id)}');"
+        elif target == ADD_BUTTON_NAME:
+            message = self.site.add(class_id, session['user'])
+        session['view_state'] += 1
+        view_state = f"vs{session['view_state']}"
+        if not is_async:
+            self._send(200, self._course_page(session, class_id, message), session_id=new_cookie)
+            return
+        records = [('updatePanel', UPDATE_PANEL_ID, self._panel(class_id, message)),
+                   ('hiddenField', '__VIEWSTATE', view_state),
+                   ('hiddenField', '__EVENTVALIDATION', view_state)]
+        if script:
+            records.append(('scriptStartupBlock', 'ScriptContentNoTags', script))
+        self._send(200, delta(*records), 'text/plain; charset=utf-8', new_cookie)
+
+    def _login(self, session, fields, new_cookie):
+        username = fields.get('ctl00$Login1$UserName', '')
+        answer = fields.get('ctl00$Login1$vcode', '')
+        if not username or not fields.get('ctl00$Login1$Password'):
+            failure = "請輸入帳號密碼"
+        elif not self.site.any_captcha and answer != session['captcha']:
+            failure = "驗證碼錯誤"
+        else:
+            session['user'] = username
+            self._send(302, session_id=new_cookie, location='/Main.aspx')
+            return
+        self._send(200, self._login_page(session, failure), session_id=new_cookie)
+
+    @staticmethod
+    def _login_page(session, failure=''):
+        return LOGIN_PAGE.format(view_state=f"login{session['view_state']}", failure=html.escape(failure))
+
+    def _course_page(self, session, class_id='', message=''):
+        with self.site._lock:
+            added = sorted({code for _, kind, code, who in self.site.events if kind == 'add' and who == session['user']})
+        return COURSE_PAGE.format(
+            view_state=f"vs{session['view_state']}", script_manager=SCRIPT_MANAGER,
+            panel_unique_id=UPDATE_PANEL_UNIQUE_ID, panel_id=UPDATE_PANEL_ID, username=html.escape(session['user']),
+            logout_name=LOGOUT_BUTTON_NAME, timetable=html.escape(', '.join(added) or '尚無課程'),
+            panel=self._panel(class_id, message))
+
+    @staticmethod
+    def _panel(class_id, message):
+        return ENROLLMENT_PANEL.format(sub_id_name=SUB_ID_NAME, add_name=ADD_BUTTON_NAME, query_name=QUERY_BUTTON_NAME,
+                                       class_id=html.escape(class_id), message=html.escape(message))
+
+
+def serve(site, port=0, host='127.0.0.1'):
+    """Serve the site in a background thread.
+
+    :param site: CourseSite to serve.
+    :param port: Port to listen on, 0 for any free port.
+    :param host: Address to bind.
+    :rtype: ThreadingHTTPServer
+    """
+    server = ThreadingHTTPServer((host, port), SimulatorHandler)
+    server.daemon_threads = True
+    server.site = site
+    threading.Thread(target=server.serve_forever, name="simulator", daemon=True).start()
+    return server
+
+
+def parse_course(text):
+    """Parse a course spec like '0050:75' or '0050:75:70' (code:capacity[:enrolled]).
+
+    :rtype: SimulatedCourse
+    """
+    parts = text.split(':')
+    return SimulatedCourse(parts[0], int(parts[1]) if len(parts) > 1 else 50,
+                           int(parts[2]) if len(parts) > 2 else None)
+
+
+def parse_opening(text):
+    """Parse a seat opening spec like '0050@30+2' (code@seconds+seats).
+
+    :return: (seconds, code, seats).
+    """
+    code, rest = text.split('@', 1)
+    seconds, _, seats = rest.partition('+')
+    return float(seconds), code, int(seats or 1)
+
+
+def add_site_arguments(parser):
+    """Add the options of the simulated site to an argparse parser."""
+    parser.add_argument('--course', action='append', default=[], type=parse_course,
+                        help="course as code:capacity[:enrolled], full by default (repeatable)")
+    parser.add_argument('--open', action='append', default=[], type=parse_opening,
+                        help="release seats as code@seconds+seats (repeatable)")
+    parser.add_argument('--latency', type=float, default=0.05, help="base server latency in seconds")
+    parser.add_argument('--jitter', type=float, default=0.05, help="max random extra latency in seconds")
+    parser.add_argument('--bots', type=int, default=0, help="number of competing bots")
+    parser.add_argument('--bot-reaction', type=float, default=2.0, help="mean reaction time of the bots in seconds")
+    parser.add_argument('--check-captcha', action='store_true', help="reject wrong captcha answers")
+    parser.add_argument('--session-timeout', type=float, help="seconds of inactivity before a login expires")
+
+
+def site_from_args(args):
+    """Create the CourseSite from parsed add_site_arguments options.
+
+    :rtype: CourseSite
+    """
+    courses = args.course or [SimulatedCourse('0050', 75)]
+    return CourseSite(courses, args.open, latency=args.latency, jitter=args.jitter, bots=args.bots,
+                      bot_reaction=args.bot_reaction, any_captcha=not args.check_captcha,
+                      session_timeout=args.session_timeout)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local simulator of the FCU course site")
+    parser.add_argument('--port', type=int, default=8080)
+    add_site_arguments(parser)
+    args = parser.parse_args()
+
+    site = site_from_args(args)
+    server = serve(site, args.port)
+    site.start()
+    print(f"模擬選課網站已啟動: http://127.0.0.1:{server.server_address[1]}/ (Ctrl+C 結束)")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    summary = site.summary()
+    for add in summary['adds']:
+        reaction = f"{add['reaction']:.3f} 秒" if add['reaction'] is not None else "-"
+        print(f"課程 {add['course']} 於 {add['at']:.1f} 秒加選成功，反應時間 {reaction}")
+    print(f"查詢 {summary['queries']} 次 ({summary['queries_per_second']:.2f} 次/秒)，其他機器人搶走 {summary['bot_adds']} 個名額")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""This python file will keep the bot logged in and polling, recovering from errors in a loop.
+
+The supervisor is a state machine run by one loop instead of login() and
+auto_class() calling each other, so a run of many days and many recoveries
+doesn't grow the stack:
+
+    LOGGED_OUT -> LOGGING_IN -> POLLING -> DONE
+                      ^            |
+                      |            v
+                      +------ RECOVERING
+
+Recovery climbs a ladder of steps from the cheapest (click the tab again)
+to the most expensive (replace the browser). A step that fails, or an error
+coming back before the polling made any progress, moves to the next step.
+Each recovery is timed. When the whole ladder keeps running out without any
+progress in between, the error isn't one a new browser can fix and the
+supervisor gives up.
+"""
+import time
+
+import metrics
+import utilities as utils
+
+LOGGED_OUT = 'LOGGED_OUT'
+LOGGING_IN = 'LOGGING_IN'
+POLLING = 'POLLING'
+RECOVERING = 'RECOVERING'
+DONE = 'DONE'
+
+
+class RecoveryFailed(Exception):
+    """Every step of the ladder failed, or login kept failing."""
+
+
+class Supervisor:
+    """Run login and polling until done, escalating recovery cheapest-first."""
+
+    def __init__(self, login, poll, ladder, replace_browser, max_login_attempts=3, first_step=None, fatal=(),
+                 max_ladder_cycles=3):
+        """Create the supervisor.
+
+        :param login: Called to log in, returns True on success.
+        :param poll: Called to poll until every class is added, raises on a critical error.
+        :param ladder: List of (name, step) from the cheapest recovery, each step returns True if polling can resume.
+        :param replace_browser: Called before a new login attempt after a failed one.
+        :param max_login_attempts: Failed logins in a row before giving up.
+        :param first_step: Called with the error, returns the name of the step to start the ladder at, or None.
+        :param fatal: Exception types of login or polling that no retry can fix, raised as they are.
+        :param max_ladder_cycles: Times the whole ladder may run out without progress in between before giving up.
+        """
+        self.login = login
+        self.poll = poll
+        self.ladder = ladder
+        self.replace_browser = replace_browser
+        self.max_login_attempts = max_login_attempts
+        self.first_step = first_step
+        self.fatal = tuple(fatal)
+        self.max_ladder_cycles = max_ladder_cycles
+        self.failed_cycles = 0
+        self.state = LOGGED_OUT
+        self.level = 0
+        # Running totals, a run of many days would grow a list of every step
+        self.recovery_steps = 0
+        self.recovery_seconds = 0.0
+        self._error = None
+
+    def mark_progress(self):
+        """Tell the supervisor the polling works again, the next error starts at the cheapest step."""
+        self.level = 0
+        self.failed_cycles = 0
+
+    def run(self):
+        """Run until every class is added.
+
+        :raises RecoveryFailed: When login or recovery can't go on.
+        """
+        login_attempts = 0
+        while self.state != DONE:
+            utils.log_debug(f"監控狀態: {self.state}")
+            if self.state == LOGGED_OUT:
+                if login_attempts:
+                    self.replace_browser()
+                self.state = LOGGING_IN
+            elif self.state == LOGGING_IN:
+                login_attempts += 1
+                utils.log_info(f"登入嘗試 {login_attempts}/{self.max_login_attempts}")
+                try:
+                    logged_in = self.login()
+                except self.fatal:
+                    raise
+                except Exception as e:
+                    utils.log_error(f"登入過程中發生未預期錯誤 (第 {login_attempts}/{self.max_login_attempts} 次嘗試): {e}")
+                    logged_in = False
+                if logged_in:
+                    login_attempts = 0
+                    self.state = POLLING
+                elif login_attempts >= self.max_login_attempts:
+                    raise RecoveryFailed("Login failed after maximum attempts.")
+                else:
+                    utils.log_warning(f"登入失敗 (第 {login_attempts}/{self.max_login_attempts} 次嘗試)")
+                    self.state = LOGGED_OUT
+            elif self.state == POLLING:
+                try:
+                    self.poll()
+                    self.state = DONE
+                except self.fatal:
+                    raise
+                except Exception as e:
+                    utils.log_error(f"自動加課過程中發生嚴重錯誤: {e}")
+                    self._error = e
+                    self.state = RECOVERING
+            elif self.state == RECOVERING:
+                if self._recover(self._error):
+                    self.state = POLLING
+                    continue
+                self.failed_cycles += 1
+                if self.failed_cycles >= self.max_ladder_cycles:
+                    raise RecoveryFailed(f"Recovery ran out {self.failed_cycles} times without progress, "
+                                         f"last error: {self._error}")
+                utils.log_warning(f"所有復原步驟皆已用盡 ({self.failed_cycles}/{self.max_ladder_cycles})，重新登入")
+                self.state = LOGGED_OUT
+
+    def _recover(self, error):
+        """Climb the ladder from the current level until a step works.
+
+        :return: True if polling can resume, False if only a new login is left.
+        """
+        names = [name for name, _ in self.ladder]
+        start_name = self.first_step(error) if self.first_step else None
+        if start_name in names:
+            self.level = max(self.level, names.index(start_name))
+        while self.level < len(self.ladder):
+            name, step = self.ladder[self.level]
+            utils.log_info(f"嘗試復原 ({self.level + 1}/{len(self.ladder)}): {name}")
+            start = time.perf_counter()
+            try:
+                recovered = step()
+            except self.fatal:
+                raise
+            except Exception as e:
+                utils.log_warning(f"復原步驟 {name} 失敗: {e}")
+                recovered = False
+            elapsed = time.perf_counter() - start
+            metrics.observe(f'recovery_{name}', elapsed)
+            self.recovery_steps += 1
+            self.recovery_seconds += elapsed
+            utils.log_info(f"復原步驟 {name} {'成功' if recovered else '失敗'}，耗時 {elapsed:.2f} 秒",
+                           step=name, seconds=round(elapsed, 3), recovered=recovered)
+            # Start one step higher if the error comes back before any progress
+            self.level += 1
+            if recovered:
+                return True
+        self.level = 0
+        return False
@@ -0,0 +1,126 @@
+import pytest
+
+import app
+import outcomes
+import priority
+
+
+class FakeEngine:
+    def __init__(self):
+        self.closed = False
+
+    def open(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def recover(self):
+        pass
+
+    def keep_alive(self):
+        pass
+
+
+@pytest.fixture
+def engines(monkeypatch):
+    """Run app without a browser, every enrollment engine created is recorded."""
+    created = []
+
+    def create_enrollment_engine(web_driver=None):
+        created.append(FakeEngine())
+        return created[-1]
+
+    monkeypatch.setattr(app, 'config', {'pacing': {'min_interval': 0, 'initial_interval': 0}, 'page_sync': 'event',
+                                        'sessions': 1})
+    monkeypatch.setattr(app, 'scheduler', priority.PriorityScheduler())
+    monkeypatch.setattr(app, 'checkpoint', None)
+    monkeypatch.setattr(app, 'settled_classes', {})
+    monkeypatch.setattr(app, 'create_enrollment_engine', create_enrollment_engine)
+    monkeypatch.setattr(app, 'create_quota_scanner', lambda web_driver=None: None)
+    monkeypatch.setattr(app, 'create_burst_pacer', lambda: None)
+    return created
+
+
+def test_shard_rounds_report_progress(monkeypatch, engines):
+    rounds = []
+
+    def check_class(engine, class_id, pacer=None):
+        # A seat opens on the third round
+        if len(rounds) < 2:
+            return outcomes.Outcome(outcomes.TRANSIENT, 'seat_taken', "額滿")
+        return outcomes.Outcome(outcomes.SUCCESS, 'added', "加選成功")
+
+    monkeypatch.setattr(app, 'check_class', check_class)
+    first_driver = object()
+    monkeypatch.setattr(app, 'driver', first_driver)
+
+    app.ShardedPoller(['0050'], 1, first_driver=first_driver, on_progress=lambda: rounds.append('round')).run()
+
+    assert rounds == ['round'] * 3
+    assert all(engine.closed for engine in engines)
+
+
+def test_auto_class_closes_the_engine_on_a_critical_error(monkeypatch, engines):
+    def check_class(engine, class_id, pacer=None):
+        raise app.http_engine.SessionExpiredError("登入狀態已失效")
+
+    monkeypatch.setattr(app, 'check_class', check_class)
+
+    for _ in range(3):
+        # Every recovery calls auto_class again
+        with pytest.raises(app.http_engine.SessionExpiredError):
+            app.auto_class(['0050'])
+
+    assert len(engines) == 3
+    assert all(engine.closed for engine in engines)
+
+
+class FakePage:
+    """lblMsgBlock of a page without postback events, the add click may or may not change it."""
+
+    def __init__(self, message, after_click):
+        self.message = message
+        self.after_click = after_click
+
+    def batch(self, steps, after=()):
+        values = []
+        for step in steps:
+            if step['op'] == 'text':
+                values.append(self.message)
+            elif step['op'] == 'click':
+                self.message = self.after_click
+        return app.js_actions.BatchResult(values, None)
+
+    def get_text(self, locator, web_driver=None):
+        return self.message
+
+
+@pytest.fixture
+def sleep_page(monkeypatch):
+    monkeypatch.setattr(app, 'config', {'page_sync': 'sleep', 'alert_mode': 'hook', 'batch_actions': True})
+
+    def create(message, after_click):
+        page = FakePage(message, after_click)
+        engine = app.BrowserEngine(object())
+        monkeypatch.setattr(engine, '_batch', page.batch)
+        monkeypatch.setattr(app, 'driver_get_text', page.get_text)
+        return engine
+
+    return create
+
+
+def test_sleep_mode_reads_the_new_add_message(sleep_page):
+    engine = sleep_page("加選失敗：已選過此課程", after_click="加選成功")
+
+    assert engine.add_class('0051') == "加選成功"
+
+
+def test_sleep_mode_never_evicts_on_a_message_left_by_the_last_course(sleep_page):
+    # The postback of this add never changed the message shown for the last course
+    engine = sleep_page("加選失敗：已選過此課程", after_click="加選失敗：已選過此課程")
+
+    result = engine._wait_new_message("加選失敗：已選過此課程", timeout=0.2)
+
+    assert result is None
+    assert app.outcomes.classify(result).kind == app.outcomes.TRANSIENT
@@ -0,0 +1,105 @@
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+import browser
+
+pytestmark = pytest.mark.skipif(os.name == 'nt', reason="process groups are POSIX only")
+
+# Stands in for chromedriver: a group leader with two children, like the browser processes
+FAKE_TREE = "import subprocess, time; [subprocess.Popen(['sleep', '300']) for _ in range(2)]; time.sleep(300)"
+
+
+class FakeDriver:
+    """Quits like chromedriver does, leaving its children orphaned."""
+
+    def __init__(self, process):
+        self.process = process
+
+    def quit(self):
+        self.process.terminate()
+        self.process.wait()
+
+
+def start_fake_tree():
+    process = subprocess.Popen([sys.executable, '-c', FAKE_TREE], start_new_session=True)
+    deadline = time.monotonic() + 10
+    while len(browser.descendant_pids(process.pid)) < 2:
+        assert time.monotonic() < deadline, "fake tree didn't start"
+        time.sleep(0.05)
+    return process
+
+
+def is_running(pid):
+    start_time = browser.process_start_time(pid)
+    if start_time is None:
+        return False
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            # A killed orphan stays a zombie until init reaps it
+            return f.read().rsplit(')', 1)[1].split()[0] != 'Z'
+    except OSError:
+        return True
+
+
+@pytest.fixture
+def trees():
+    started = []
+
+    def start():
+        process = start_fake_tree()
+        started.append(process)
+        return process, browser.descendant_pids(process.pid)
+
+    yield start
+    for process in started:
+        try:
+            os.killpg(process.pid, 9)
+        except (ProcessLookupError, PermissionError):
+            pass
+        process.wait()
+
+
+def wait_until_gone(pids, timeout=5):
+    deadline = time.monotonic() + timeout
+    while any(is_running(pid) for pid in pids) and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+
+def test_kill_process_tree_leaves_other_instances_alone(trees):
+    mine, my_children = trees()
+    other, other_children = trees()
+
+    browser.kill_process_tree(mine)
+    wait_until_gone(my_children)
+
+    assert mine.poll() is not None
+    assert not any(is_running(pid) for pid in my_children)
+    assert other.poll() is None
+    assert all(is_running(pid) for pid in other_children)
+
+
+def test_release_kills_orphans_of_its_browser_only(trees, tmp_path):
+    mine, my_children = trees()
+    other, other_children = trees()
+    factory = browser.BrowserFactory(standby=False)
+    fake_driver = FakeDriver(mine)
+    factory._processes[fake_driver] = (mine, str(tmp_path))
+
+    factory.release(fake_driver)
+    wait_until_gone(my_children)
+
+    assert not any(is_running(pid) for pid in my_children)
+    assert all(is_running(pid) for pid in other_children)
+    assert not tmp_path.exists()
+
+
+def test_kill_pids_skips_reused_pids(trees):
+    process, children = trees()
+    # A start time that doesn't match stands for a pid given to another process
+    browser.kill_pids({pid: 'another process' for pid in children})
+
+    assert all(is_running(pid) for pid in children)
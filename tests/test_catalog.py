@@ -0,0 +1,46 @@
+import catalog
+
+CATALOG = {
+    '0050': catalog.Course('0050', '微積分', 3.0, '資訊一甲', catalog.parse_slots('(二)03-04')),
+    '0051': catalog.Course('0051', '微積分', 3.0, '資訊一乙', catalog.parse_slots('(二)03-04')),
+    '0052': catalog.Course('0052', '微積分', 4.0, '資訊一丙', catalog.parse_slots('(二)04')),
+    '0060': catalog.Course('0060', '英文', 2.0, '資訊一甲', catalog.parse_slots('(二)03')),
+    '0070': catalog.Course('0070', '體育', 1.0, '資訊一甲', catalog.parse_slots('(五)01')),
+}
+GROUPS = {'0050': 'calculus', '0051': 'calculus', '0052': 'calculus'}
+
+
+def test_parse_slots():
+    assert catalog.parse_slots('(二)03-04 資電234 (四)02') == {(2, 3), (2, 4), (4, 2)}
+
+
+def test_unknown_and_over_limit_courses_are_dropped():
+    kept, issues = catalog.preflight(['0070', '9999', '0052'], CATALOG, max_credits=3)
+
+    assert kept == ['0070']
+    assert [class_id for class_id, _ in issues] == ['9999', '0052']
+
+
+def test_conflict_is_dropped_without_groups():
+    kept, issues = catalog.preflight(['0050', '0051'], CATALOG, drop_conflicts=True)
+
+    assert kept == ['0050']
+    assert issues == [('0051', "與 0050 衝堂")]
+
+
+def test_alternatives_of_a_group_may_share_a_slot():
+    kept, issues = catalog.preflight(['0050', '0051', '0052', '0060'], CATALOG, drop_conflicts=True, groups=GROUPS)
+
+    assert kept == ['0050', '0051', '0052']
+    # A course outside the group still conflicts with the alternatives
+    assert issues == [('0060', "與 0050, 0051 衝堂")]
+
+
+def test_group_counts_its_largest_course_once():
+    kept, issues = catalog.preflight(['0050', '0051', '0052', '0070'], CATALOG, max_credits=5, groups=GROUPS)
+
+    assert kept == ['0050', '0051', '0052', '0070']
+    assert issues == []
+
+    kept, issues = catalog.preflight(['0050', '0051', '0052', '0070'], CATALOG, max_credits=4.5, groups=GROUPS)
+    assert issues == [('*', "全部加選共 5 學分，超過可加選學分 4.5，後面的課程可能會超修")]
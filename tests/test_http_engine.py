@@ -0,0 +1,61 @@
+import pytest
+import requests
+
+import http_engine
+import simulator
+
+
+@pytest.fixture
+def engine():
+    site = simulator.CourseSite([simulator.SimulatedCourse('0050', 75, enrolled=73),
+                                 simulator.SimulatedCourse('0051', 60)], latency=0, jitter=0)
+    server = simulator.serve(site)
+    url = f'http://127.0.0.1:{server.server_address[1]}/'
+    # Log in like the browser does, the engine only takes over the cookies
+    with requests.Session() as session:
+        session.get(url)
+        session.post(url, data={'ctl00$Login1$UserName': 'D0000000', 'ctl00$Login1$Password': 'simulator',
+                                'ctl00$Login1$vcode': '1234'})
+        cookies = [{'name': cookie.name, 'value': cookie.value, 'path': cookie.path}
+                   for cookie in session.cookies]
+    http_enrollment_engine = http_engine.HttpEnrollmentEngine(url + 'Main.aspx', cookies)
+    yield http_enrollment_engine
+    http_enrollment_engine.close()
+    server.shutdown()
+
+
+def test_query_quota(engine):
+    assert engine.query_quota('0050') == "剩餘名額/開放名額：2  /75"
+    assert engine.query_quota('0051') == "剩餘名額/開放名額：0  /60"
+
+
+def test_add_class(engine):
+    engine.query_quota('0050')
+
+    assert engine.add_class('0050') == "加選成功"
+
+
+def test_add_class_already_added(engine):
+    engine.add_class('0050')
+
+    assert engine.add_class('0050') == "加選失敗：已選過此課程"
+
+
+def test_unknown_course(engine):
+    assert engine.query_quota('9999') == "查無此課程代碼"
+    assert engine.add_class('9999') == "查無此課程代碼"
+
+
+def test_parse_delta_response():
+    text = '16|updatePanel|panel|<span>a|b</span>|6|hiddenField|__VIEWSTATE|state1|'
+
+    assert http_engine.parse_delta_response(text) == [('updatePanel', 'panel', '<span>a|b</span>'),
+                                                      ('hiddenField', '__VIEWSTATE', 'state1')]
+    with pytest.raises(http_engine.PostbackError):
+        http_engine.parse_delta_response('99|updatePanel|x|short|')
+
+
+def test_extract_alerts():
+    script = "alert('\\u5269\\u9918 \\'0\\''); alert(\"line\\nbreak\");"
+
+    assert http_engine.extract_alerts(script) == ["剩餘 '0'", "line\nbreak"]
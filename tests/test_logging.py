@@ -0,0 +1,36 @@
+import logging
+import queue
+
+import utilities as utils
+
+
+def make_record(message, level=logging.INFO):
+    return logging.makeLogRecord({'name': 'test', 'levelno': level, 'levelname': logging.getLevelName(level),
+                                  'msg': message})
+
+
+def test_full_queue_counts_dropped_lines():
+    log_queue = queue.Queue(1)
+    handler = utils.DroppingQueueHandler(log_queue)
+    handler.enqueue(make_record("first"))
+    handler.enqueue(make_record("second"))
+    handler.enqueue(make_record("third"))
+    assert handler.dropped == 2
+
+
+def test_drop_count_kept_until_the_notice_is_queued():
+    log_queue = queue.Queue(1)
+    handler = utils.DroppingQueueHandler(log_queue)
+    handler.enqueue(make_record("first"))
+    handler.enqueue(make_record("second"))
+    # Still full, the notice can't be queued and the count goes on
+    handler.enqueue(make_record("third"))
+    assert handler.dropped == 2
+
+    log_queue.get_nowait()
+    handler.enqueue(make_record("fourth"))
+    notice = log_queue.get_nowait()
+    assert notice.levelno == logging.WARNING
+    assert "丟棄了 2 行日誌" in notice.getMessage()
+    # The record after the notice found the queue full again
+    assert handler.dropped == 1
@@ -0,0 +1,30 @@
+import pytest
+
+import metrics
+
+
+@pytest.mark.parametrize('samples, q, expected', [
+    (range(1, 11), 50, 5),
+    (range(1, 11), 90, 9),
+    (range(1, 11), 100, 10),
+    (range(1, 11), 0, 1),
+    (range(1, 101), 7, 7),
+    (range(1, 101), 50, 50),
+    (range(1, 101), 95, 95),
+    (range(1, 101), 99, 99),
+    ([3, 1, 2], 50, 2),
+    ([0.5], 99, 0.5),
+    ([], 50, 0.0),
+])
+def test_percentile_nearest_rank(samples, q, expected):
+    assert metrics.percentile(list(samples), q) == expected
+
+
+def test_snapshot_quantiles():
+    collector = metrics.Metrics()
+    for value in range(1, 101):
+        collector.observe('seat_query', value / 1000)
+
+    entry, = collector.snapshot()
+    assert entry['count'] == 100
+    assert (entry['p50'], entry['p95'], entry['p99']) == (0.05, 0.095, 0.099)
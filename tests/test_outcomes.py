@@ -0,0 +1,48 @@
+import pytest
+
+import outcomes
+
+
+@pytest.mark.parametrize('message, kind, reason', [
+    ('加選成功', outcomes.SUCCESS, 'added'),
+    ('加選失敗：名額已滿', outcomes.TRANSIENT, 'seat_taken'),
+    ('已加選人數已滿', outcomes.TRANSIENT, 'seat_taken'),
+    ('加選失敗，請確認是否已加選或衝堂/超修', outcomes.TRANSIENT, 'unknown'),
+    ('加選失敗：已選過此課程', outcomes.PERMANENT, 'enrolled'),
+    ('加選失敗：與已選課程衝堂', outcomes.PERMANENT, 'conflict'),
+    ('加選失敗：超修', outcomes.PERMANENT, 'credits'),
+    ('本課程停開', outcomes.PERMANENT, 'closed'),
+    ('查無此課程代碼', outcomes.PERMANENT, 'not_found'),
+    ('系統忙碌中', outcomes.TRANSIENT, 'unknown'),
+    ('', outcomes.TRANSIENT, 'no_message'),
+    (None, outcomes.TRANSIENT, 'no_message'),
+])
+def test_classify(message, kind, reason):
+    outcome = outcomes.classify(message)
+
+    assert (outcome.kind, outcome.reason) == (kind, reason)
+
+
+def create_checkpoint(tmp_path, class_ids=('0050', '0051', '0052'), course_url='https://course.fcu.edu.tw/', **kwargs):
+    return outcomes.ProgressCheckpoint('D0000000', course_url, class_ids, path=str(tmp_path / 'progress.json'), **kwargs)
+
+
+def test_checkpoint_resumes_without_settled_courses(tmp_path):
+    checkpoint = create_checkpoint(tmp_path)
+    checkpoint.record('0050', outcomes.classify('加選成功'))
+    checkpoint.record('0051', outcomes.classify('加選失敗：與已選課程衝堂'))
+
+    assert create_checkpoint(tmp_path).resume(['0050', '0051', '0052']) == ['0052']
+
+
+def test_checkpoint_of_another_class_list_starts_over(tmp_path):
+    create_checkpoint(tmp_path).record('0050', outcomes.classify('加選成功'))
+
+    assert create_checkpoint(tmp_path, class_ids=('0050', '0060')).resume(['0050', '0060']) == ['0050', '0060']
+    assert create_checkpoint(tmp_path, course_url='http://127.0.0.1/').resume(['0050']) == ['0050']
+
+
+def test_checkpoint_expires(tmp_path):
+    create_checkpoint(tmp_path).record('0050', outcomes.classify('加選成功'))
+
+    assert create_checkpoint(tmp_path, max_age_days=0).resume(['0050']) == ['0050']
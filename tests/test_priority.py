@@ -0,0 +1,27 @@
+import priority
+
+
+def test_due_in_proportion_to_weight():
+    scheduler = priority.PriorityScheduler({'0050': 3, '0051': 1})
+
+    rounds = [scheduler.due(['0050', '0051']) for _ in range(6)]
+
+    assert sum('0050' in due for due in rounds) == 6
+    assert sum('0051' in due for due in rounds) == 2
+
+
+def test_light_course_alone_in_its_shard_keeps_its_weight():
+    scheduler = priority.PriorityScheduler({'0050': 3, '0051': 1})
+    all_class_ids = ['0050', '0051']
+
+    rounds = [scheduler.due(['0051'], all_class_ids) for _ in range(6)]
+
+    assert sum('0051' in due for due in rounds) == 2
+
+
+def test_drop_alternatives():
+    scheduler = priority.PriorityScheduler(groups={'0051': 'calculus', '0052': 'calculus'})
+    class_ids = ['0050', '0052']
+
+    assert scheduler.drop_alternatives(class_ids, '0051') == ['0052']
+    assert class_ids == ['0050']
@@ -0,0 +1,117 @@
+import pytest
+
+import supervisor
+
+
+class Recorder:
+    """Fake login, poll and recovery steps that count their calls."""
+
+    def __init__(self, poll_errors):
+        self.poll_errors = poll_errors
+        self.calls = []
+
+    def login(self):
+        self.calls.append('login')
+        return True
+
+    def poll(self):
+        self.calls.append('poll')
+        if self.poll_errors:
+            self.poll_errors -= 1
+            raise RuntimeError("poll failed")
+
+    def step(self, name):
+        def run():
+            self.calls.append(name)
+            return True
+        return run
+
+    def replace_browser(self):
+        self.calls.append('replace_browser')
+
+
+def create_supervisor(recorder, **kwargs):
+    ladder = [(name, recorder.step(name)) for name in ('tab', 'reload', 'relogin', 'new_browser')]
+    return supervisor.Supervisor(recorder.login, recorder.poll, ladder, recorder.replace_browser, **kwargs)
+
+
+def test_poll_that_always_fails_gives_up():
+    recorder = Recorder(poll_errors=float('inf'))
+    bot_supervisor = create_supervisor(recorder, max_ladder_cycles=3)
+
+    with pytest.raises(supervisor.RecoveryFailed):
+        bot_supervisor.run()
+
+    assert bot_supervisor.failed_cycles == 3
+    assert recorder.calls.count('new_browser') == 3
+    assert recorder.calls.count('login') == 3
+
+
+def test_progress_resets_the_ladder_cycles():
+    recorder = Recorder(poll_errors=float('inf'))
+    bot_supervisor = create_supervisor(recorder, max_ladder_cycles=2)
+    poll = recorder.poll
+
+    def poll_with_progress():
+        # Every other poll makes progress before failing
+        if recorder.calls.count('poll') % 2:
+            bot_supervisor.mark_progress()
+        if recorder.calls.count('poll') >= 20:
+            recorder.poll_errors = 0
+        poll()
+
+    bot_supervisor.poll = poll_with_progress
+    bot_supervisor.run()
+
+    assert bot_supervisor.state == supervisor.DONE
+
+
+def test_recovers_with_the_cheapest_step():
+    recorder = Recorder(poll_errors=1)
+    bot_supervisor = create_supervisor(recorder)
+
+    bot_supervisor.run()
+
+    assert recorder.calls == ['login', 'poll', 'tab', 'poll']
+    assert bot_supervisor.state == supervisor.DONE
+
+
+class Rejected(Exception):
+    pass
+
+
+def test_fatal_poll_error_is_raised_at_once():
+    recorder = Recorder(poll_errors=0)
+    bot_supervisor = create_supervisor(recorder, fatal=(Rejected,))
+
+    def poll():
+        recorder.calls.append('poll')
+        raise Rejected("wrong password")
+
+    bot_supervisor.poll = poll
+    with pytest.raises(Rejected):
+        bot_supervisor.run()
+
+    assert recorder.calls == ['login', 'poll']
+
+
+def test_recoveries_separated_by_progress_never_give_up():
+    recorder = Recorder(poll_errors=0)
+    bot_supervisor = create_supervisor(recorder, max_ladder_cycles=3)
+    # Every recovery step fails, so each poll error runs the whole ladder out
+    bot_supervisor.ladder = [(name, lambda: False) for name, _ in bot_supervisor.ladder]
+    polls = []
+
+    def poll():
+        polls.append('poll')
+        # Days of polling between the errors
+        bot_supervisor.mark_progress()
+        if len(polls) <= 5:
+            raise RuntimeError("poll failed")
+
+    bot_supervisor.poll = poll
+    bot_supervisor.run()
+
+    assert bot_supervisor.state == supervisor.DONE
+    assert len(polls) == 6
+    assert bot_supervisor.recovery_steps == 5 * 4
@@ -1,56 +1,214 @@
 """This python will handle some extra functions."""
 import sys
 import os
+import time
+import gzip
+import json
+import queue
+import atexit
+import shutil
 import logging
+import threading
+import logging.handlers
 from datetime import datetime
 from os.path import exists
 
-import ddddocr
 import yaml
 from yaml import SafeLoader
 
+ENGINES = ('selenium', 'http')
+PAGE_SYNC_MODES = ('event', 'sleep')
+ALERT_MODES = ('hook', 'native')
+PACING_DEFAULTS = {
+    'min_interval': 0.2,
+    'max_interval': 5.0,
+    'initial_interval': 0.8,
+    'step': 0.05,
+    'backoff': 2.0,
+    'target_latency': 1.5,
+    'max_rate': 5.0,
+}
 
-def setup_logger():
-    """Setup logger for the application."""
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+# Records waiting for the writer thread, info lines beyond it are dropped instead of blocking the caller
+LOG_QUEUE_SIZE = 10000
+
+_logger = logging.getLogger(__name__)
+_log_listener = None
+_repeats = {}
+_repeats_lock = threading.Lock()
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Queue handler that drops info and debug records when the queue is full."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # The writer thread is in this process, the record is formatted there instead of in the caller
+        return record
+
+    def enqueue(self, record):
+        if record.levelno >= logging.WARNING:
+            # Warnings and errors are worth waiting for
+            self.queue.put(record)
+            return
+        try:
+            if self.dropped:
+                self.queue.put_nowait(logging.makeLogRecord({
+                    'name': record.name, 'levelno': logging.WARNING, 'levelname': 'WARNING',
+                    'msg': f"日誌佇列已滿，丟棄了 {self.dropped} 行日誌"}))
+                # Only once the notice is queued, a full queue keeps counting
+                self.dropped = 0
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class LogWriter(logging.handlers.QueueListener):
+    """Background thread writing the queued records to the real handlers."""
+
+    def enqueue_sentinel(self):
+        # The queue may be full when stopping, wait for room instead of failing
+        self.queue.put(self._sentinel)
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """Format records as one JSON object per line, with the fields passed to the log functions."""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        entry.update(getattr(record, 'fields', None) or {})
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def _gzip_rotator(source, dest):
+    """Compress the rotated log file."""
+    with open(source, 'rb') as f_in, gzip.open(dest, 'wb') as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.remove(source)
+
+
+def _rotating_handler(filename, max_bytes, backup_count):
+    handler = logging.handlers.RotatingFileHandler(filename, maxBytes=max_bytes, backupCount=backup_count,
+                                                   encoding='utf-8')
+    handler.namer = lambda name: name + '.gz'
+    handler.rotator = _gzip_rotator
+    return handler
+
+
+def setup_logger(max_bytes=10 * 1024 * 1024, backup_count=5, jsonl=False, log_dir='./logs', stream=sys.stdout):
+    """Setup logger for the application.
+
+    Records are handed to a background writer thread through a bounded queue,
+    so logging never waits for disk or console I/O. Log files rotate by size
+    and the rotated files are gzip compressed.
+
+    :param max_bytes: Size of a log file before it rotates, 0 to never rotate.
+    :param backup_count: Number of rotated files to keep.
+    :param jsonl: Also write structured records to a .jsonl file.
+    :param log_dir: Folder of the log files.
+    :param stream: Console stream, None for no console output.
+    """
+    global _log_listener
     # Create logs directory if it doesn't exist
-    if not exists('./logs'):
-        os.makedirs('./logs')
+    if not exists(log_dir):
+        os.makedirs(log_dir)
     
     # Create a timestamp for the log file
     timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
-    log_filename = f'./logs/logs-{timestamp}.txt'
-    
+    log_filename = f'{log_dir}/logs-{timestamp}.txt'
+
+    file_handler = _rotating_handler(log_filename, max_bytes, backup_count)
+    file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    handlers = [file_handler]
+    if stream is not None:
+        # Also output to console
+        console_handler = logging.StreamHandler(stream)
+        console_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        handlers.append(console_handler)
+    if jsonl:
+        jsonl_handler = _rotating_handler(f'{log_dir}/logs-{timestamp}.jsonl', max_bytes, backup_count)
+        jsonl_handler.setFormatter(JsonLinesFormatter())
+        handlers.append(jsonl_handler)
+
+    stop_logger()
+    log_queue = queue.Queue(LOG_QUEUE_SIZE)
+    _log_listener = LogWriter(log_queue, *handlers)
+    _log_listener.start()
+    # Flush what is left in the queue on exit
+    atexit.register(stop_logger)
+
     # Configure logging
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s - %(levelname)s - %(message)s',
-        handlers=[
-            logging.FileHandler(log_filename, encoding='utf-8'),
-            logging.StreamHandler(sys.stdout)  # Also output to console
-        ]
-    )
+    queue_handler = DroppingQueueHandler(log_queue)
+    logging.basicConfig(level=logging.INFO, handlers=[queue_handler], force=True)
     
-    logger = logging.getLogger(__name__)
-    logger.info("=== FCU AutoClass 程式啟動 ===")
-    return logger
+    _logger.info("=== FCU AutoClass 程式啟動 ===")
+    return _logger
+
+
+def stop_logger():
+    """Write out the queued records and stop the writer thread."""
+    global _log_listener
+    listener, _log_listener = _log_listener, None
+    if listener is not None:
+        listener.stop()
+        for handler in listener.handlers:
+            handler.close()
 
 
-def log_info(message):
-    """Log info message."""
-    logger = logging.getLogger(__name__)
-    logger.info(message)
+def log_debug(message, **fields):
+    """Log debug message, dropped at the default level."""
+    _logger.debug(message, extra={'fields': fields})
 
 
-def log_error(message):
+def log_info(message, **fields):
+    """Log info message.
+
+    :param fields: Extra fields of the structured (JSONL) record.
+    """
+    _logger.info(message, extra={'fields': fields})
+
+
+def log_error(message, **fields):
     """Log error message."""
-    logger = logging.getLogger(__name__)
-    logger.error(message)
+    _logger.error(message, extra={'fields': fields})
 
 
-def log_warning(message):
+def log_warning(message, **fields):
     """Log warning message.""" 
-    logger = logging.getLogger(__name__)
-    logger.warning(message)
+    _logger.warning(message, extra={'fields': fields})
+
+
+def log_repeated(key, message, interval=60, **fields):
+    """Log a line that repeats every round at most once per interval.
+
+    The repeats in between are counted and reported with the next line logged.
+
+    :param key: What makes two lines the same, like ('no_seats', class_id).
+    :param message: Message to log.
+    :param interval: Min seconds between two logged lines of key, 0 to log every line.
+    """
+    now = time.monotonic()
+    with _repeats_lock:
+        last, count = _repeats.get(key, (None, 0))
+        if last is not None and now - last < interval:
+            _repeats[key] = (last, count + 1)
+            return
+        _repeats[key] = (now, 0)
+    if count:
+        message = f"{message} (過去 {now - last:.0f} 秒內另有 {count} 次相同結果)"
+    log_info(message, repeated=count, **fields)
 
 
 def config_file_generator():
@@ -71,9 +229,148 @@ password: ''
 # The less class_id you have, the more rate you can get the class you want.
 class_id: ''
 
+# Course priority
+# Instead of class_id, list the courses with a weight and an optional alternative group.
+# A course is queried in proportion to its weight: the heaviest every round, weight 1 of 3 every third round.
+# Once one course of a group is added, the other courses of the group are dropped.
+# Example:
+# courses:
+#   - id: '0050'
+#     weight: 3
+#   - id: '0051'
+#     weight: 1
+#     group: 'calculus'
+#   - id: '0052'
+#     weight: 1
+#     group: 'calculus'
+courses: []
+
+# Course site
+# Only change this to point the bot at the local simulator, like 'http://127.0.0.1:8080/' (python simulator.py).
+course_url: 'https://course.fcu.edu.tw/'
+
 # Headless mode
 # If you want to run this script in headless mode, please set this to true.
 headless: false
+
+# Standby browser
+# Keep one pre-launched Chrome ready, so restarting after a failure is a hand-off instead of a cold launch.
+# Costs the memory of one extra idle Chrome.
+browser_standby: true
+
+# Lean browser profile
+# Block images, fonts, stylesheets and trackers (the captcha is still loaded), and run Chrome without
+# extensions, GPU and background networking in a small fixed window. Set to false to see the styled page.
+lean_browser: true
+
+# Session persistence
+# Save the login cookies encrypted (key derived from the password) in .cache/session.bin after login.
+# Restarts reuse them and skip the captcha login while the server session is still alive.
+session_persistence: true
+
+# Pipelined login
+# Capture the captcha as soon as the login page loads and recognize it while the username and password are typed.
+# Set to false for the old one-step-after-another login, e.g. to compare the time to the login click.
+login_pipeline: true
+
+# Captcha retry budget
+# A login failing only because of a wrong captcha is retried on the same page with a new captcha, up to this many times.
+# A wrong username or password stops the program instead of retrying.
+captcha_retry_budget: 3
+
+# Shared OCR service
+# Socket of a running "python ocr_service.py", so the instances of a host share one OCR model.
+# Leave empty to load the model in this process. Falls back to in-process OCR when the service is down.
+ocr_socket: ''
+
+# Progress checkpoint
+# Save the added courses and the courses that can never be added (already enrolled, conflict, over the credit limit,
+# closed) in .cache/progress.json, so a restart only polls the courses still worth polling.
+progress_checkpoint: true
+
+# Enrollment engine
+# selenium: query and add classes by clicking through the course page in Chrome.
+# http: only login with Chrome, then replay the page postbacks over a keep-alive HTTP session (faster).
+engine: 'selenium'
+
+# Page synchronization of the selenium engine
+# event: fire the next click as soon as the UpdatePanel postback has finished (ASP.NET endRequest event).
+# sleep: the old fixed delays, only useful to compare the per-course cycle time.
+page_sync: 'event'
+
+# Alert handling of the selenium engine
+# hook: a page script catches the quota and add result alerts, read together with the page wait (faster).
+# native: wait for the browser alert dialogs through WebDriver.
+alert_mode: 'hook'
+
+# Batched page actions of the selenium engine
+# Fill in the class id, click and read the result in one browser script call instead of a WebDriver command per step.
+batch_actions: true
+
+# Scheduled start
+# Login ahead of time and start querying at this time of the server clock, like '2025-09-04 12:30:00'.
+# The session is kept alive while waiting, then every class is queried without pacing for start_burst_seconds.
+# Leave empty to start right after login.
+start_at: ''
+start_burst_seconds: 10
+
+# Bulk quota scan
+# URL of a course listing showing the seats of many courses, like a course search result page or its JSON service.
+# It is fetched once per round and only courses showing free seats are queried, instead of querying every course.
+# quota_scan_body: JSON body to POST to the URL (copy it from the browser's developer tools), empty to GET.
+# Leave quota_scan_url empty to query every course one by one.
+quota_scan_url: ''
+quota_scan_body: ''
+
+# Polling sessions
+# Number of logged in sessions polling the classes in parallel, each with its own browser.
+# The classes are split across the sessions, so each class is checked about this many times more often.
+sessions: 1
+
+# Polling pace
+# The interval between seat queries shrinks by step (seconds) while the server answers within target_latency,
+# and is multiplied by backoff when queries get slow, fail or time out, staying within min/max_interval.
+# max_rate caps the queries per second of all sessions together.
+pacing:
+  min_interval: 0.2
+  max_interval: 5.0
+  initial_interval: 0.8
+  step: 0.05
+  backoff: 2.0
+  target_latency: 1.5
+  max_rate: 5.0
+
+# Logging
+# Log files rotate at log_max_mb and the rotated files are gzip compressed, log_backup_count of them are kept.
+# log_jsonl: also write structured records to logs/logs-*.jsonl.
+# log_repeat_interval: seconds between two "no seats" lines of the same class, the repeats are counted instead.
+log_max_mb: 10
+log_backup_count: 5
+log_jsonl: false
+log_repeat_interval: 60
+
+# Metrics
+# Latency (count, p50/p95/p99) of each phase: browser launch, page load, captcha, OCR, login, seat query, ...
+# metrics_port: serve them on http://127.0.0.1:<port>/metrics in Prometheus text format, 0 to disable.
+# metrics_summary_interval: write a JSON summary to logs/metrics.json every this many seconds, 0 to disable.
+metrics_port: 0
+metrics_summary_interval: 60
+
+# Captcha
+# The captcha answer is checked against this length and charset before login.
+# If the OCR confidence (0~1) is below captcha_min_confidence, a new captcha is loaded instead of submitting.
+captcha_length: 4
+captcha_charset: '0123456789'
+captcha_min_confidence: 0.5
+
+# Course catalog
+# Path of a course listing export (CSV, or JSON saved from the course search site) to check class_id before polling.
+# Unknown class ids are dropped. Courses that conflict with an earlier class_id are flagged,
+# or dropped when catalog_drop_conflicts is true. Leave empty to skip the check.
+catalog_file: ''
+catalog_drop_conflicts: false
+# Credits you can still add, courses over it are dropped. Leave empty for no limit.
+max_credits:
 """
                 )
     sys.exit()
@@ -94,18 +391,73 @@ def read_config():
 
     try:
         with open('config.yml', 'r', encoding="utf8") as f:
-            data = yaml.load(f, Loader=SafeLoader)
-            class_ids = get_class_ids(data['class_id'])
+            # An empty file loads as None, reported like a missing setting
+            data = yaml.load(f, Loader=SafeLoader) or {}
+            if data.get('courses'):
+                class_ids, class_weights, class_groups = get_courses(data['courses'])
+            else:
+                class_ids, class_weights, class_groups = get_class_ids(data['class_id']), {}, {}
             config = {
                 'username': data['username'],
                 'password': data['password'],
                 'class_ids': class_ids,
-                'headless': data['headless']
+                'class_weights': class_weights,
+                'class_groups': class_groups,
+                'headless': data['headless'],
+                'course_url': data.get('course_url') or 'https://course.fcu.edu.tw/',
+                'browser_standby': bool(data.get('browser_standby', True)),
+                'lean_browser': bool(data.get('lean_browser', True)),
+                'session_persistence': bool(data.get('session_persistence', True)),
+                'login_pipeline': bool(data.get('login_pipeline', True)),
+                'captcha_retry_budget': int(data.get('captcha_retry_budget', 3)),
+                'ocr_socket': data.get('ocr_socket') or '',
+                'progress_checkpoint': bool(data.get('progress_checkpoint', True)),
+                'engine': data.get('engine') or 'selenium',
+                'page_sync': data.get('page_sync') or 'event',
+                'alert_mode': data.get('alert_mode') or 'hook',
+                'batch_actions': bool(data.get('batch_actions', True)),
+                'quota_scan_url': data.get('quota_scan_url') or '',
+                'quota_scan_body': data.get('quota_scan_body') or '',
+                'sessions': max(1, int(data.get('sessions') or 1)),
+                'start_at': data.get('start_at') or None,
+                'start_burst_seconds': float(data.get('start_burst_seconds', 10)),
+                'pacing': {key: float(value) for key, value in {**PACING_DEFAULTS, **(data.get('pacing') or {})}.items()
+                           if key in PACING_DEFAULTS and value is not None},
+                'log_max_mb': float(data.get('log_max_mb', 10) or 0),
+                'log_backup_count': int(data.get('log_backup_count', 5)),
+                'log_jsonl': bool(data.get('log_jsonl', False)),
+                'log_repeat_interval': float(data.get('log_repeat_interval', 60) or 0),
+                'metrics_port': int(data.get('metrics_port') or 0),
+                'metrics_summary_interval': float(data.get('metrics_summary_interval', 60) or 0),
+                'captcha_length': int(data.get('captcha_length', 4)),
+                'captcha_charset': str(data.get('captcha_charset', '0123456789')),
+                'captcha_min_confidence': float(data.get('captcha_min_confidence', 0.5)),
+                'catalog_file': data.get('catalog_file') or '',
+                'catalog_drop_conflicts': bool(data.get('catalog_drop_conflicts', False)),
+                'max_credits': float(data['max_credits']) if data.get('max_credits') is not None else None
             }
+            if config['engine'] not in ENGINES:
+                print(f"未知的 engine 設定: {config['engine']}，改用 selenium")
+                config['engine'] = 'selenium'
+            if config['page_sync'] not in PAGE_SYNC_MODES:
+                print(f"未知的 page_sync 設定: {config['page_sync']}，改用 event")
+                config['page_sync'] = 'event'
+            if config['alert_mode'] not in ALERT_MODES:
+                print(f"未知的 alert_mode 設定: {config['alert_mode']}，改用 hook")
+                config['alert_mode'] = 'hook'
+            # Imported here, clock imports this module
+            import clock
+            try:
+                # Keep the epoch seconds, a typo must stop here instead of failing every poll after login
+                config['start_at'] = clock.parse_start_at(config['start_at'])
+            except ValueError:
+                print(f"start_at 設定格式錯誤: {config['start_at']}\n"
+                      "請填寫像 '2025-09-04 12:30:00' 的時間，或留空表示登入後立即開始。")
+                sys.exit()
             # Don't log sensitive information like password, only basic info
             print(f"設定檔讀取成功 - 使用者: {config['username']}, 課程數量: {len(class_ids)}")
             return config
-    except (KeyError, TypeError) as e:
+    except (KeyError, TypeError, ValueError) as e:
         error_msg = (
             "讀取 config.yml 時發生錯誤，請檢查檔案是否正確填寫。\n"
             "如果問題無法解決，請考慮刪除 config.yml 並重新啟動程式。\n"
@@ -128,17 +480,115 @@ def get_class_ids(class_id):
     return class_ids
 
 
-def get_ocr_answer(ocr_image_path):
+def get_courses(courses):
+    """Read the courses list from config file.
+
+    :param courses: List of dicts with id, weight and group, or plain class ids.
+    :return: Tuple of class ids, dict of class id to weight and dict of class id to group.
+    :rtype: tuple
+    """
+    class_ids, weights, groups = [], {}, {}
+    for course in courses:
+        if not isinstance(course, dict):
+            course = {'id': course}
+        class_id = str(course['id']).strip()
+        weight = float(course.get('weight') or 1)
+        if weight <= 0:
+            raise ValueError(f"課程 {class_id} 的 weight 必須大於 0")
+        class_ids.append(class_id)
+        weights[class_id] = weight
+        if course.get('group') not in (None, ''):
+            groups[class_id] = str(course['group'])
+    return class_ids, weights, groups
+
+
+def parse_remain_position(alert_text):
+    """Parse remaining positions from the quota alert text.
+
+    :param alert_text: Alert text like '剩餘名額/開放名額：0  /75'.
+    :rtype: int
+    """
+    return int(alert_text.strip('剩餘名額/開放名額：').split(" /")[0])
+
+
+_ocr_engine = None
+_ocr_lock = threading.Lock()
+_ocr_client = None
+
+
+def use_ocr_service(socket_path):
+    """Send the OCR of get_ocr_engine() to the shared OCR service, falling back to the in-process model.
+
+    :param socket_path: Socket of ocr_service.py, empty for in-process OCR only.
+    :return: True if the service is reachable now.
+    """
+    global _ocr_client
+    if not socket_path:
+        _ocr_client = None
+        return False
+    # Imported here, like the OCR model it is only needed when configured
+    import ocr_service
+    if not ocr_service.is_supported():
+        log_warning("此平台不支援 Unix domain socket，使用本機 OCR")
+        _ocr_client = None
+        return False
+    _ocr_client = ocr_service.OcrClient(socket_path, fallback=get_local_ocr_engine)
+    if _ocr_client.ping():
+        log_info(f"使用共用 OCR 服務: {socket_path}")
+        return True
+    log_warning(f"無法連線 OCR 服務 {socket_path}，目前使用本機 OCR")
+    return False
+
+
+def get_ocr_engine():
+    """Get the OCR engine, the OCR service client when use_ocr_service() was called.
+
+    :return: Engine with a classification(bytes) method.
+    """
+    return _ocr_client or get_local_ocr_engine()
+
+
+def get_local_ocr_engine():
+    """Get the in-process OCR engine, loading the ONNX model on first use.
+
+    :rtype: ddddocr.DdddOcr
+    """
+    global _ocr_engine
+    with _ocr_lock:
+        if _ocr_engine is None:
+            start = time.perf_counter()
+            # Imported here, onnxruntime is slow to import and many runs never need OCR
+            import ddddocr
+            _ocr_engine = ddddocr.DdddOcr()
+            log_info(f"OCR 模型載入完成，耗時 {time.perf_counter() - start:.2f} 秒")
+        return _ocr_engine
+
+
+def warm_up_ocr():
+    """Load the OCR model in a background thread so the first login doesn't wait for it.
+
+    :return: The warm-up thread.
+    """
+    thread = threading.Thread(target=get_local_ocr_engine, name="ocr-warm-up", daemon=True)
+    thread.start()
+    return thread
+
+
+def get_ocr_answer(ocr_image):
     """Get the answer of ocr.
 
+    :param ocr_image: Captcha image as PNG bytes, or path to the image file.
     :rtype: str
     """
     try:
-        log_info(f"開始 OCR 辨識圖片: {ocr_image_path}")
-        ocr = ddddocr.DdddOcr()
-        with open(ocr_image_path, 'rb') as f:
-            image = f.read()
-        answer = ocr.classification(image)
+        if isinstance(ocr_image, (bytes, bytearray)):
+            log_info(f"開始 OCR 辨識圖片 ({len(ocr_image)} bytes)")
+            image = bytes(ocr_image)
+        else:
+            log_info(f"開始 OCR 辨識圖片: {ocr_image}")
+            with open(ocr_image, 'rb') as f:
+                image = f.read()
+        answer = get_ocr_engine().classification(image)
         log_info(f"OCR 辨識完成，結果: {answer}")
         return answer
     except Exception as e:
@@ -146,11 +596,12 @@ def get_ocr_answer(ocr_image_path):
         return ""
 
 
-def safe_handle_alert(driver, timeout=3):
+def safe_handle_alert(driver, timeout=3, poll_frequency=0.5):
     """Safely handle alert with timeout and proper error handling.
     
     :param driver: Selenium WebDriver instance
     :param timeout: Maximum time to wait for alert
+    :param poll_frequency: Seconds between checks for the alert
     :return: Alert text if found, None if no alert
     """
     try:
@@ -159,7 +610,7 @@ def safe_handle_alert(driver, timeout=3):
         from selenium.common.exceptions import TimeoutException, NoAlertPresentException
         
         # Wait for alert to be present
-        alert = WebDriverWait(driver, timeout).until(EC.alert_is_present())
+        alert = WebDriverWait(driver, timeout, poll_frequency=poll_frequency).until(EC.alert_is_present())
         alert_text = alert.text
         log_info(f"Alert detected: {alert_text}")
         alert.accept()
@@ -197,7 +648,7 @@ def dismiss_any_alert(driver):
         return False
 
 
-def safe_element_interaction(driver, locator, action, *args, max_retries=3):
+def safe_element_interaction(driver, locator, action, *args, max_retries=3, stale_wait=None):
     """Safely interact with element, handling stale element references.
     
     :param driver: Selenium WebDriver instance
@@ -205,6 +656,7 @@ def safe_element_interaction(driver, locator, action, *args, max_retries=3):
     :param action: Action to perform ('click', 'send_keys', 'get_text', 'clear')
     :param args: Arguments for the action
     :param max_retries: Maximum number of retries
+    :param stale_wait: Called with the driver to wait for the page to settle on a stale element, default to a 0.5 second sleep
     :return: Result of action or None if failed
     """
     from selenium.webdriver.support.ui import WebDriverWait
@@ -214,7 +666,7 @@ def safe_element_interaction(driver, locator, action, *args, max_retries=3):
     for attempt in range(max_retries):
         try:
             # Re-find the element each time to avoid stale reference
-            element = WebDriverWait(driver, 10).until(EC.presence_of_element_located(locator))
+            element = WebDriverWait(driver, 10, poll_frequency=0.05).until(EC.presence_of_element_located(locator))
             
             if action == 'click':
                 element.click()
@@ -236,8 +688,10 @@ def safe_element_interaction(driver, locator, action, *args, max_retries=3):
         except StaleElementReferenceException:
             log_warning(f"Stale element detected, retrying ({attempt + 1}/{max_retries})")
             if attempt < max_retries - 1:
-                import time
-                time.sleep(0.5)
+                if stale_wait:
+                    stale_wait(driver)
+                else:
+                    time.sleep(0.5)
                 continue
             else:
                 log_error(f"Failed to interact with element after {max_retries} attempts")